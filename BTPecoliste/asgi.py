@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "BTPecoliste.settings")
 
-application = get_asgi_application()
+# As get_asgi_application, with the handler sending the exports without running their queries on the event loop
+django.setup(set_prefix=False)
+
+from ecoliste.streaming import ASGIHandler  # noqa: E402
+
+application = ASGIHandler()
@@ -36,26 +36,38 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "django.contrib.gis",
+    "django.contrib.postgres",
     "ecoliste.apps.EcolisteConfig",
-    "debug_toolbar",
 ]
 
 MIDDLEWARE = [
+    # First, so they measure all the others
+    "ecoliste.middleware.MetricsMiddleware",
+    "ecoliste.middleware.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    # Answers 304 to the requests whose ETag is still the one of the response, for the JSON APIs among others
+    "django.middleware.http.ConditionalGetMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    # Within the sessions, whose changes don't send the reads of their user to the default database
+    "ecoliste.middleware.ReplicaMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
+# The debug toolbar keeps every query and template of the requests, only for development
+if DEBUG:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+
 ROOT_URLCONF = "BTPecoliste.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # Measures the rendering time for the Server-Timing header
+        "BACKEND": "ecoliste.instrumentation.DjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -74,12 +86,142 @@ WSGI_APPLICATION = "BTPecoliste.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# The connections are kept between the requests, and checked when a request first uses them as the CONN_HEALTH_CHECKS
+# setting of Django 4.1 does, with the backend of ecoliste/postgis.
 DATABASES = {
     "default": {
-        "ENGINE": "django.contrib.gis.db.backends.postgis",
+        "ENGINE": "ecoliste.postgis",
+        "NAME": "BTPecoliste",
+        "USER": "timothee",
+        "CONN_MAX_AGE": 60,
+        "CONN_HEALTH_CHECKS": True,
+    },
+    # A read replica, here the database itself so it can be developed with, and a second connection to the test
+    # database in the tests
+    "replica": {
+        "ENGINE": "ecoliste.postgis",
         "NAME": "BTPecoliste",
         "USER": "timothee",
-    }
+        "CONN_MAX_AGE": 60,
+        "CONN_HEALTH_CHECKS": True,
+        "TEST": {"MIRROR": "default"},
+    },
+}
+
+# Replicas
+# The searches, facets, maps, exports and enterprise pages read from the replicas of ECOLISTE_REPLICAS, the other reads
+# and all the writes go to the default database, see ecoliste/replicas.py. A replica lagging more than
+# ECOLISTE_REPLICA_MAX_LAG seconds behind is left aside, its lag being checked every ECOLISTE_REPLICA_CHECK_INTERVAL
+# seconds, and a user who changed some data reads from the default database for ECOLISTE_REPLICA_STICKINESS seconds.
+
+DATABASE_ROUTERS = ["ecoliste.replicas.ReplicaRouter"]
+
+ECOLISTE_REPLICAS = []
+
+ECOLISTE_REPLICA_MAX_LAG = 5
+
+ECOLISTE_REPLICA_CHECK_INTERVAL = 10
+
+ECOLISTE_REPLICA_STICKINESS = 30
+
+# Search
+# Distances on the WGS84 spheroid are the most expensive part of the searches. The addresses are also stored in a local
+# projection in meters, Lambert-93 for metropolitan France, where distances are planar and much cheaper.
+# Changing the SRID needs a migration of the projected columns.
+
+ECOLISTE_PROJECTION_SRID = 2154
+
+ECOLISTE_PROJECTED_SEARCH = False
+
+# From this zoom level, the maps get the addresses one by one instead of clusters
+ECOLISTE_CLUSTER_MAX_ZOOM = 14
+
+# The most addresses returned one by one for a map view, the response being then marked as truncated
+ECOLISTE_CLUSTER_MAX_FEATURES = 1000
+
+# Cache
+# The results of the searches are cached, see ecoliste/search_cache.py. Any cache backend can be used, and
+# ECOLISTE_SEARCH_CACHE = None disables it. The search locations are snapped to a grid of ECOLISTE_SEARCH_CACHE_GRID
+# degrees (about 1 km), and a change of an address invalidates the searches around it, in tiles of
+# ECOLISTE_SEARCH_CACHE_TILE degrees.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "search": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "ecoliste-search",
+        "TIMEOUT": 600,
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+    "autocomplete": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "ecoliste-autocomplete",
+        "TIMEOUT": 30,
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+    "pages": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "ecoliste-pages",
+        "TIMEOUT": 86400,
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+    "geocoder": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "ecoliste-geocoder",
+        "TIMEOUT": 86400,
+        "OPTIONS": {"MAX_ENTRIES": 4096},
+    },
+}
+
+ECOLISTE_SEARCH_CACHE = "search"
+
+ECOLISTE_SEARCH_CACHE_GRID = 0.01
+
+ECOLISTE_SEARCH_CACHE_TILE = 0.5
+
+# The completions of the first letters of the enterprise names are cached there for a few seconds, None disables it
+ECOLISTE_AUTOCOMPLETE_CACHE = "autocomplete"
+
+# The rendered sections of the enterprise pages are cached there, see ecoliste/enterprise_pages.py, None disables it.
+# Their versions are bumped when the data changes, so with several processes the cache must be shared between them.
+ECOLISTE_PAGES_CACHE = "pages"
+
+# The results of the geocoder are cached there, see ecoliste/geocoder.py, None disables it. Their version is bumped by
+# the imports of the BAN, so with several processes the cache must be shared between them.
+ECOLISTE_GEOCODER_CACHE = "geocoder"
+
+# The vector tiles of the maps are stored there once built, None disables it
+ECOLISTE_TILES_DIR = BASE_DIR / "cache" / "tiles"
+
+# Timing
+# A share of the requests, from 0 to 1, is measured and gets a Server-Timing header with its SQL, templates and cache
+# metrics, see ecoliste/middleware.py. The measured requests slower than ECOLISTE_TIMING_LOG_THRESHOLD milliseconds are
+# logged by the "ecoliste.timing" logger, 0 logs them all.
+
+ECOLISTE_TIMING_SAMPLE_RATE = 1.0
+
+ECOLISTE_TIMING_LOG_THRESHOLD = 500
+
+# The directory shared by the processes of the application for their metrics, see ecoliste/metrics.py. It is needed
+# when several processes serve the application, as the gunicorn workers, and should be emptied at each deployment. A
+# worker killed on its timeout loses its metrics of the last few seconds.
+ECOLISTE_METRICS_DIR = None
+
+# The metrics are only shown to the staff, and to the scrapers sending an "Authorization: Bearer <token>" header with
+# this token, None allows none of them
+ECOLISTE_METRICS_TOKEN = None
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "ecoliste.timing": {"handlers": ["console"], "level": "INFO"},
+    },
 }
 
 # Password validation
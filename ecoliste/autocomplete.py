@@ -0,0 +1,66 @@
+"""
+Autocompletion of the enterprise names, tolerating typos and accents.
+
+The names are compared without their accents with the pg_trgm word similarity, which finds the typed text within the
+names, served by the trigram index of the 0006_enterprise_name_trigram migration. The first letters typed are the
+most frequent and the slowest to complete, as they match many names: their completions are kept a few seconds in the
+ECOLISTE_AUTOCOMPLETE_CACHE.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity, TrigramWordSimilarity
+from django.core.cache import caches
+from django.db.models import Value
+
+from . import instrumentation
+from .models import Enterprise, Unaccent
+
+MAX_RESULTS = 10
+
+# The shortest text completed, and the longest one whose completions are cached
+MIN_LENGTH = 2
+MAX_CACHED_LENGTH = 6
+
+
+def complete_names(text: str) -> list[dict]:
+    """
+    Finds the enterprises whose name matches a text, in the database.
+    :param text: The text typed, lower case and trimmed.
+    :return: The id and name of the enterprises, the most similar first.
+    """
+    unaccented = Unaccent(Value(text))
+    enterprises = (
+        Enterprise.objects.annotate(unaccented_name=Unaccent("name"))
+        .filter(unaccented_name__trigram_word_similar=unaccented)
+        .annotate(
+            score=TrigramWordSimilarity(unaccented, "unaccented_name"),
+            similarity=TrigramSimilarity("unaccented_name", unaccented),
+        )
+        .order_by("-score", "-similarity", "name", "pk")
+        .values("id", "name")
+    )
+    return list(enterprises[:MAX_RESULTS])
+
+
+def autocomplete(text: str) -> list[dict]:
+    """
+    Completes an enterprise name being typed.
+    :param text: The text typed.
+    :return: The id and name of at most MAX_RESULTS enterprises, the most similar first.
+    """
+    text = " ".join(text.lower().split())
+    if len(text) < MIN_LENGTH:
+        return []
+    alias = settings.ECOLISTE_AUTOCOMPLETE_CACHE
+    if not alias or len(text) > MAX_CACHED_LENGTH:
+        return complete_names(text)
+    cache = caches[alias]
+    key = "autocomplete:" + hashlib.sha1(text.encode()).hexdigest()
+    names = cache.get(key)
+    instrumentation.cache_lookup("autocomplete", hit=names is not None)
+    if names is None:
+        names = complete_names(text)
+        cache.set(key, names)
+    return names
@@ -0,0 +1,138 @@
+"""
+Import of the boundaries of the French administrative areas: régions, départements and communes.
+
+The boundaries come from files readable by GDAL, one kind of area per file: the shapefiles of IGN's ADMIN EXPRESS, or
+GeoJSON files such as the ones of geo.api.gouv.fr. The régions and départements should be imported before the communes,
+whose région is otherwise taken from their département.
+
+The addresses are located in their commune when they are indexed, see ecoliste.search_index.update_areas, so the search
+never tests the full polygons.
+"""
+
+from django.contrib.gis.gdal import DataSource, OGRGeometry
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.db import connection, transaction
+
+from . import search_index, signals
+from .models import AdministrativeArea
+
+Kinds = AdministrativeArea.Kinds
+
+# The tolerance of each simplified geometry, in degrees: about 100 m and 1 km
+SIMPLIFICATION_TOLERANCES = {"geometry_medium": 0.001, "geometry_low": 0.01}
+
+SIMPLIFY_SQL = "UPDATE ecoliste_administrativearea SET {} WHERE kind = %s".format(
+    ", ".join(
+        "{} = ST_Multi(ST_SimplifyPreserveTopology(geometry, {}))".format(
+            field, tolerance
+        )
+        for field, tolerance in SIMPLIFICATION_TOLERANCES.items()
+    )
+)
+
+# The properties read from the files, ADMIN EXPRESS ones then geo.api.gouv.fr ones: the first one found is used
+CODE_FIELDS = {
+    Kinds.REGION: ("INSEE_REG", "code"),
+    Kinds.DEPARTEMENT: ("INSEE_DEP", "code"),
+    Kinds.COMMUNE: ("INSEE_COM", "code"),
+}
+NAME_FIELDS = ("NOM", "NOM_M", "nom", "name")
+DEPARTEMENT_FIELDS = ("INSEE_DEP", "codeDepartement")
+REGION_FIELDS = ("INSEE_REG", "codeRegion")
+
+
+def feature_value(feature, fields: tuple[str, ...]) -> str:
+    """
+    The first of some properties of a GDAL feature.
+    :return: The value as a string, blank if the feature has none of the properties.
+    """
+    for field in fields:
+        if field in feature.fields:
+            value = feature.get(field)
+            return "" if value is None else str(value).strip()
+    return ""
+
+
+def commune_departement(code: str) -> str:
+    """
+    The département of a commune, from its INSEE code: its first 2 characters, or 3 overseas.
+    """
+    return code[:3] if code.startswith("97") else code[:2]
+
+
+def multipolygon(geometry: OGRGeometry) -> MultiPolygon:
+    """
+    The WGS84 boundaries of an area, read from a file without a spatial reference as WGS84 ones, as GeoJSON files.
+    :raise ValueError: If the geometry is not a polygon.
+    """
+    if geometry.srs is not None:
+        geometry.transform(4326)
+    geometry = geometry.geos
+    geometry.srid = 4326
+    if isinstance(geometry, Polygon):
+        geometry = MultiPolygon(geometry, srid=4326)
+    if not isinstance(geometry, MultiPolygon):
+        raise ValueError("{} is not a polygon".format(geometry.geom_type))
+    return geometry
+
+
+def read_areas(path: str, kind: str) -> list[AdministrativeArea]:
+    """
+    Reads the areas of a file.
+    :param path: The file, in a format readable by GDAL.
+    :param kind: The kind of the areas, one of AdministrativeArea.Kinds.
+    :return: The areas, not saved.
+    :raise ValueError: If an area has no code or is not a polygon.
+    :raise GDALException: If the file can't be read.
+    """
+    regions = dict(
+        AdministrativeArea.objects.filter(kind=Kinds.DEPARTEMENT).values_list(
+            "code", "region"
+        )
+    )
+    areas = []
+    for feature in DataSource(path)[0]:
+        code = feature_value(feature, CODE_FIELDS[kind])
+        if not code:
+            raise ValueError("feature {} has no code".format(feature.fid))
+        area = AdministrativeArea(
+            kind=kind,
+            code=code,
+            name=feature_value(feature, NAME_FIELDS),
+            geometry=multipolygon(feature.geom),
+        )
+        if kind == Kinds.DEPARTEMENT:
+            area.region = feature_value(feature, REGION_FIELDS)
+        elif kind == Kinds.COMMUNE:
+            area.departement = feature_value(
+                feature, DEPARTEMENT_FIELDS
+            ) or commune_departement(code)
+            area.region = feature_value(feature, REGION_FIELDS) or regions.get(
+                area.departement, ""
+            )
+        areas.append(area)
+    return areas
+
+
+def import_boundaries(paths: list[str], kind: str, batch_size: int = 1000) -> int:
+    """
+    Imports the areas of one kind, replacing all the ones already imported, and computes their simplified geometries.
+
+    After the communes, the indexed addresses are located again, and the cached searches around the ones whose areas
+    changed are invalidated.
+    :param paths: The files, in a format readable by GDAL.
+    :param kind: The kind of the areas, one of AdministrativeArea.Kinds.
+    :param batch_size: The number of areas sent to the database at once.
+    :return: The number of areas imported.
+    :raise ValueError: If an area has no code or is not a polygon.
+    :raise GDALException: If a file can't be read.
+    """
+    areas = [area for path in paths for area in read_areas(path, kind)]
+    with transaction.atomic():
+        AdministrativeArea.objects.filter(kind=kind).delete()
+        AdministrativeArea.objects.bulk_create(areas, batch_size=batch_size)
+        with connection.cursor() as cursor:
+            cursor.execute(SIMPLIFY_SQL, [kind])
+        if kind == Kinds.COMMUNE:
+            signals.locations_changed(search_index.update_areas())
+    return len(areas)
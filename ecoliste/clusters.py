@@ -0,0 +1,117 @@
+"""
+Clustering of the addresses for the maps: a national map can't draw a marker for each address.
+
+The addresses of the map view are grouped on a grid in Web Mercator, the projection of the map tiles, whose cells have
+the same size on the screen at every latitude. The grid is computed in PostGIS, so only one point per cell comes back,
+with the number of addresses it stands for. From ECOLISTE_CLUSTER_MAX_ZOOM on, the addresses come back one by one, so
+the map view must then be at most MAX_VIEW_TILES tiles wide and high, and at most ECOLISTE_CLUSTER_MAX_FEATURES of them
+are returned.
+"""
+
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.geos import Polygon
+from django.db.models import Avg, Count, FloatField, Func, Min, QuerySet
+from django.db.models.functions import Cast, Floor
+
+from .models import Address
+from .replicas import read_database
+from .search import filter_addresses
+
+# The width of the world in Web Mercator, in meters
+WEB_MERCATOR_WIDTH = 40075016.68557849
+
+TILE_SIZE = 256
+
+# The size of a cluster cell on the screen, in pixels
+CLUSTER_CELL_SIZE = 60
+
+WEB_MERCATOR_SRID = 3857
+
+# The largest map view, in tiles of its zoom level, where the addresses come back one by one: a large screen shows less
+# than 16 tiles across
+MAX_VIEW_TILES = 32
+
+
+def cell_size(zoom: int) -> float:
+    """
+    The size of the cluster cells at a zoom level, in Web Mercator meters.
+    """
+    return WEB_MERCATOR_WIDTH / (TILE_SIZE * 2**zoom) * CLUSTER_CELL_SIZE
+
+
+def view_too_large(bbox: tuple[float, float, float, float], zoom: int) -> bool:
+    """
+    Whether a bounding box is larger than any map view at a zoom level.
+    :param bbox: The WGS84 bounding box: (west, south, east, north).
+    """
+    west, south, east, north = bbox
+    span = 360 / 2**zoom * MAX_VIEW_TILES
+    return east - west > span or north - south > span
+
+
+def bbox_addresses(
+    bbox: tuple[float, float, float, float], filters: dict = None
+) -> QuerySet:
+    """
+    The addresses of a map view.
+    :param bbox: The WGS84 bounding box of the map view: (west, south, east, north).
+    :param filters: The filters, as described in ecoliste_research.
+    :return: The Address queryset.
+    """
+    addresses = Address.objects.using(read_database()).filter(
+        search_index__geolocation__intersects=Polygon.from_bbox(bbox)
+    )
+    if filters:
+        addresses = filter_addresses(addresses, filters)
+    return addresses
+
+
+def clusters(
+    bbox: tuple[float, float, float, float], zoom: int, filters: dict = None
+) -> list[dict]:
+    """
+    The clusters of the addresses of a map view.
+
+    :param bbox: The WGS84 bounding box of the map view: (west, south, east, north).
+    :param zoom: The zoom level of the map.
+    :param filters: The filters, as described in ecoliste_research.
+    :return: A list of dictionaries, with the longitude, latitude and count of each cluster, and the id of the address
+    when it is alone.
+    """
+    addresses = bbox_addresses(bbox, filters)
+    geometry = Cast("search_index__geolocation", GeometryField(srid=4326))
+    mercator = Func(
+        geometry,
+        WEB_MERCATOR_SRID,
+        function="ST_Transform",
+        output_field=GeometryField(srid=WEB_MERCATOR_SRID),
+    )
+    size = cell_size(zoom)
+    rows = (
+        addresses.annotate(
+            cell_x=Floor(
+                Func(mercator, function="ST_X", output_field=FloatField()) / size
+            ),
+            cell_y=Floor(
+                Func(mercator, function="ST_Y", output_field=FloatField()) / size
+            ),
+        )
+        .values("cell_x", "cell_y")
+        .annotate(
+            count=Count("pk"),
+            longitude=Avg(Func(geometry, function="ST_X", output_field=FloatField())),
+            latitude=Avg(Func(geometry, function="ST_Y", output_field=FloatField())),
+            address_id=Min("pk"),
+        )
+        .values_list("longitude", "latitude", "count", "address_id")
+        .order_by()
+    )
+    return [
+        {
+            "longitude": longitude,
+            "latitude": latitude,
+            "count": count,
+            "address_id": address_id if count == 1 else None,
+        }
+        for longitude, latitude, count, address_id in rows
+    ]
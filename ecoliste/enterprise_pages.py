@@ -0,0 +1,281 @@
+"""
+A cache of the rendered sections of the enterprise pages, which change rarely but are read constantly.
+
+Each section of a page has a version per enterprise, kept in the cache too, and is cached under a key containing its
+version. When a model is saved or deleted, the signals bump the versions of the sections showing it, so only these
+sections are rendered again. The materials sections also show the names of the material types, their categories and
+the biobased materials, which have a single version shared by all the enterprises. The versions expire as the
+sections do: an expired version only renders the sections again, and the versions created by the requests for
+enterprises which don't exist don't stay in the cache.
+
+A page whose sections are all cached is served without any query, and so is the date of its last change, which gives
+the conditional requests of the page their answer.
+"""
+
+import asyncio
+import hashlib
+import time
+from datetime import datetime
+from typing import Iterable, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import BaseCache, caches
+from django.core.serializers import serialize
+from django.db import connections, transaction
+from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import instrumentation, replicas
+from .models import Enterprise
+
+SECTIONS = ("identity", "materials", "addresses", "contacts")
+
+MATERIALS_NAMES_KEY = "enterprise-page:materials-names"
+
+
+def pages_cache() -> Optional[BaseCache]:
+    """
+    The cache of the ECOLISTE_PAGES_CACHE setting, or None if the cache is disabled.
+    """
+    alias = settings.ECOLISTE_PAGES_CACHE
+    return caches[alias] if alias else None
+
+
+def version_key(enterprise_id: int, section: str) -> str:
+    return "enterprise-page:{}:{}".format(enterprise_id, section)
+
+
+def versions(cache: BaseCache, keys: list[str]) -> dict:
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # A new version, so the sections cached before the version was evicted can't be found again
+            cache.add(key, time.time_ns())
+            found[key] = cache.get(key)
+    return found
+
+
+def render_section(enterprise: Enterprise, section: str):
+    """
+    Renders a section of the page of an enterprise.
+    :return: The HTML of the section, with the name of the enterprise for the identity.
+    """
+    if section == "identity":
+        html = render_to_string(
+            "ecoliste/enterprise/identity.html", {"enterprise": enterprise}
+        )
+        return enterprise.name, html
+    if section == "materials":
+        materials = (
+            enterprise.products.all()
+            .select_related("type", "type__category")
+            .prefetch_related("address", "biobased_material")
+        )
+        return render_to_string(
+            "ecoliste/enterprise/materials.html", {"materials": materials}
+        )
+    if section == "addresses":
+        # Evaluated once for both the list and the map
+        addresses = list(enterprise.addresses.all())
+        addresses_points = serialize(
+            "geojson",
+            addresses,
+            geometry_field="geolocation",
+            fields=("text_version", "is_production"),
+        )
+        return render_to_string(
+            "ecoliste/enterprise/addresses.html",
+            {"addresses": addresses, "addresses_points": addresses_points},
+        )
+    return render_to_string(
+        "ecoliste/enterprise/contacts.html", {"contacts": enterprise.contacts.all()}
+    )
+
+
+def section_keys(cache: BaseCache, enterprise_id: int) -> dict[str, str]:
+    """
+    The keys of the sections of the page of an enterprise, with their current versions.
+    """
+    section_versions = versions(
+        cache,
+        [version_key(enterprise_id, section) for section in SECTIONS]
+        + [MATERIALS_NAMES_KEY],
+    )
+    keys = {}
+    for section in SECTIONS:
+        version = section_versions[version_key(enterprise_id, section)]
+        if section == "materials":
+            version = "{}-{}".format(version, section_versions[MATERIALS_NAMES_KEY])
+        keys[section] = "{}:{}".format(version_key(enterprise_id, section), version)
+    return keys
+
+
+def last_modified(enterprise_id: int) -> Optional[datetime]:
+    """
+    The date of the last change of an enterprise or of anything shown on its page, from the cache when it is enabled.
+    :param enterprise_id: The id of the enterprise.
+    :return: The date, or None if the enterprise doesn't exist.
+    """
+    enterprise = Enterprise.objects.using(replicas.read_database()).filter(
+        pk=enterprise_id
+    )
+    cache = pages_cache()
+    if cache is None:
+        return enterprise.values_list("content_updated", flat=True).first()
+    # Cached under the versions of the sections, as a change of the date bumps one of them
+    key = "{}:modified:{}".format(
+        version_key(enterprise_id, "page"),
+        hashlib.sha1(
+            "|".join(section_keys(cache, enterprise_id).values()).encode()
+        ).hexdigest(),
+    )
+    modified = cache.get(key)
+    instrumentation.cache_lookup("pages", hit=modified is not None)
+    if modified is None:
+        modified = enterprise.values_list("content_updated", flat=True).first()
+        if modified is not None:
+            cache.set(key, modified)
+    return modified
+
+
+def cached_sections(enterprise_id: int) -> tuple[dict[str, str], dict]:
+    """
+    The sections of the page of an enterprise found in the cache.
+    :return: The key of each section, and the cached sections by key.
+    """
+    cache = pages_cache()
+    if cache is None:
+        return {section: section for section in SECTIONS}, {}
+    keys = section_keys(cache, enterprise_id)
+    rendered = cache.get_many(keys.values())
+    hits = sum(key in rendered for key in keys.values())
+    instrumentation.cache_lookup("pages", True, hits)
+    instrumentation.cache_lookup("pages", False, len(SECTIONS) - hits)
+    return keys, rendered
+
+
+def store_sections(sections: dict) -> None:
+    """
+    Caches newly rendered sections, by key.
+    """
+    cache = pages_cache()
+    if cache is not None:
+        cache.set_many(sections)
+
+
+def page_sections(keys: dict[str, str], rendered: dict) -> dict:
+    name, identity = rendered[keys["identity"]]
+    sections = {
+        section: mark_safe(rendered[keys[section]])
+        for section in SECTIONS
+        if section != "identity"
+    }
+    return {"name": name, "identity": mark_safe(identity), **sections}
+
+
+def enterprise_sections(enterprise_id: int) -> dict:
+    """
+    The rendered sections of the page of an enterprise, from the cache when it is enabled.
+
+    :param enterprise_id: The id of the enterprise.
+    :return: A dictionary with the HTML of each of the SECTIONS, and the name of the enterprise.
+    :raise Http404: If the enterprise doesn't exist and some sections aren't cached.
+    """
+    keys, rendered = cached_sections(enterprise_id)
+    missing = [section for section in SECTIONS if keys[section] not in rendered]
+    if missing:
+        enterprise = get_object_or_404(
+            Enterprise.objects.using(replicas.read_database()), pk=enterprise_id
+        )
+        new = {
+            keys[section]: render_section(enterprise, section) for section in missing
+        }
+        store_sections(new)
+        rendered.update(new)
+    return page_sections(keys, rendered)
+
+
+def enterprise_in_transaction(enterprise_id: int) -> tuple[Enterprise, bool]:
+    """
+    An enterprise, and whether the current thread is in a transaction, whose data the other connections can't see.
+    :raise Http404: If the enterprise doesn't exist.
+    """
+    database = replicas.read_database()
+    enterprise = get_object_or_404(Enterprise.objects.using(database), pk=enterprise_id)
+    return enterprise, transaction.get_connection(database).in_atomic_block
+
+
+def render_section_concurrently(enterprise: Enterprise, section: str):
+    """
+    render_section, in a thread of its own, which closes its database connections: the threads are kept by the
+    executor, and no request_finished signal would close their idle connections, whatever CONN_MAX_AGE.
+    """
+    try:
+        return render_section(enterprise, section)
+    finally:
+        connections.close_all()
+
+
+async def aenterprise_sections(enterprise_id: int) -> dict:
+    """
+    enterprise_sections, for the async views.
+
+    Django has no async database driver, so the queries run in threads. The missing sections are rendered
+    concurrently, each with a connection of its own, unless the request is in a transaction.
+    :param enterprise_id: The id of the enterprise.
+    :return: A dictionary with the HTML of each of the SECTIONS, and the name of the enterprise.
+    :raise Http404: If the enterprise doesn't exist and some sections aren't cached.
+    """
+    keys, rendered = await sync_to_async(cached_sections)(enterprise_id)
+    missing = [section for section in SECTIONS if keys[section] not in rendered]
+    if missing:
+        enterprise, in_transaction = await sync_to_async(enterprise_in_transaction)(
+            enterprise_id
+        )
+        if in_transaction or len(missing) == 1:
+            render = sync_to_async(render_section)
+        else:
+            render = sync_to_async(render_section_concurrently, thread_sensitive=False)
+        sections = await asyncio.gather(
+            *(render(enterprise, section) for section in missing)
+        )
+        new = {keys[section]: html for section, html in zip(missing, sections)}
+        await sync_to_async(store_sections)(new)
+        rendered.update(new)
+    return page_sections(keys, rendered)
+
+
+def invalidate(
+    enterprise_ids: Iterable[int], sections: Iterable[str] = SECTIONS
+) -> None:
+    """
+    Bumps the versions of some sections of the pages of some enterprises, once the current transaction is committed: a
+    page rendered before would otherwise cache the previous data again.
+    :param enterprise_ids: The ids of the enterprises that changed.
+    :param sections: The sections showing the data that changed, all of them by default.
+    """
+    cache = pages_cache()
+    if cache is None:
+        return
+    keys = [
+        version_key(enterprise_id, section)
+        for enterprise_id in set(enterprise_ids)
+        for section in sections
+    ]
+    if keys:
+        replicas.on_commit(
+            lambda: cache.set_many(dict.fromkeys(keys, time.time_ns()))
+        )
+
+
+def invalidate_materials_names() -> None:
+    """
+    Bumps the version of the materials sections of all the enterprises, once the current transaction is committed.
+    """
+    cache = pages_cache()
+    if cache is not None:
+        replicas.on_commit(
+            lambda: cache.set(MATERIALS_NAMES_KEY, time.time_ns())
+        )
@@ -0,0 +1,223 @@
+"""
+Export of the whole catalogue: the enterprises, with their addresses, materials and contacts.
+
+The enterprises are read with a server-side cursor, and their related objects are loaded a chunk of enterprises at a
+time. The export is produced line by line, so the memory used stays the same whatever the size of the catalogue.
+"""
+
+import csv
+import json
+from collections import defaultdict
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+from .models import Address, Contact, Enterprise, MaterialByEnterprise
+from .replicas import read_database
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "geojson": "application/geo+json",
+    "jsonl": "application/x-ndjson",
+}
+
+CSV_COLUMNS = [
+    "enterprise_id",
+    "enterprise_name",
+    "website",
+    "n_employees",
+    "annual_sales",
+    "address_id",
+    "text_version",
+    "is_production",
+    "longitude",
+    "latitude",
+    "materials",
+    "contacts",
+]
+
+
+def chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def label(choice_label) -> Optional[str]:
+    # The labels of the choices can be lazy translations, which can't be serialized
+    return None if choice_label is None else str(choice_label)
+
+
+def enterprise_records(
+    chunk_size: int = 500, database: Optional[str] = None
+) -> Iterator[dict]:
+    """
+    Reads the whole catalogue.
+    :param chunk_size: The number of enterprises whose related objects are loaded at once.
+    :param database: The database to read, see read_database by default.
+    :return: An iterator over a dictionary for each enterprise, with its addresses, materials and contacts.
+    """
+    database = database or read_database()
+    enterprises = (
+        Enterprise.objects.using(database)
+        .order_by("pk")
+        .iterator(chunk_size=chunk_size)
+    )
+    for chunk in chunks(enterprises, chunk_size):
+        ids = [enterprise.pk for enterprise in chunk]
+        addresses = defaultdict(list)
+        for address in (
+            Address.objects.using(database).filter(enterprise_id__in=ids).order_by("pk")
+        ):
+            addresses[address.enterprise_id].append(
+                {
+                    "id": address.pk,
+                    "text_version": address.text_version,
+                    "is_production": address.is_production,
+                    "longitude": address.geolocation.x,
+                    "latitude": address.geolocation.y,
+                }
+            )
+        materials = defaultdict(list)
+        products = (
+            MaterialByEnterprise.objects.using(database)
+            .filter(enterprise_id__in=ids)
+            .select_related("type", "type__category")
+            .prefetch_related("address", "biobased_material")
+        )
+        for product in products:
+            materials[product.enterprise_id].append(
+                {
+                    "type": product.type.name,
+                    "category": product.type.category.name
+                    if product.type.category
+                    else None,
+                    "origin": label(product.get_origin_display()),
+                    "biobased": [bio.name for bio in product.biobased_material.all()],
+                    "addresses": [address.pk for address in product.address.all()],
+                }
+            )
+        contacts = defaultdict(list)
+        for contact in (
+            Contact.objects.using(database).filter(enterprise_id__in=ids).order_by("pk")
+        ):
+            contacts[contact.enterprise_id].append(
+                {
+                    "firstname": contact.firstname,
+                    "surname": contact.surname,
+                    "description": contact.description,
+                    "phone1": contact.phone1,
+                    "phone2": contact.phone2,
+                    "mail": contact.mail,
+                }
+            )
+        for enterprise in chunk:
+            yield {
+                "id": enterprise.pk,
+                "name": enterprise.name,
+                "website": enterprise.website,
+                "description": enterprise.description,
+                "n_employees": label(enterprise.get_n_employees_display()),
+                "annual_sales": label(enterprise.get_annual_sales_display()),
+                "added": enterprise.added.isoformat(),
+                "updated": enterprise.updated.isoformat(),
+                "addresses": addresses[enterprise.pk],
+                "materials": materials[enterprise.pk],
+                "contacts": contacts[enterprise.pk],
+            }
+
+
+class Echo:
+    """
+    A file-like object giving back what is written, for the csv module to produce lines one by one.
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def csv_lines(records: Iterable[dict]) -> Iterator[str]:
+    """
+    One line per address, with its enterprise and a summary of the enterprise materials and contacts. Enterprises
+    without any address still have one line.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for record in records:
+        materials = "; ".join(
+            "{} ({})".format(material["type"], material["origin"])
+            for material in record["materials"]
+        )
+        contacts = "; ".join(
+            " ".join(filter(None, [contact["firstname"], contact["surname"]]))
+            for contact in record["contacts"]
+        )
+        enterprise = [
+            record["id"],
+            record["name"],
+            record["website"],
+            record["n_employees"],
+            record["annual_sales"],
+        ]
+        for address in record["addresses"] or [None]:
+            if address is None:
+                address_columns = [None] * 5
+            else:
+                address_columns = [
+                    address["id"],
+                    address["text_version"],
+                    address["is_production"],
+                    address["longitude"],
+                    address["latitude"],
+                ]
+            yield writer.writerow(enterprise + address_columns + [materials, contacts])
+
+
+def geojson_lines(records: Iterable[dict]) -> Iterator[str]:
+    """
+    A FeatureCollection with a feature for each address, carrying its enterprise.
+    """
+    yield '{"type": "FeatureCollection", "features": [\n'
+    separator = ""
+    for record in records:
+        enterprise = {
+            key: record[key]
+            for key in ("id", "name", "website", "n_employees", "annual_sales")
+        }
+        for address in record["addresses"]:
+            feature = {
+                "type": "Feature",
+                "id": address["id"],
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [address["longitude"], address["latitude"]],
+                },
+                "properties": {
+                    "text_version": address["text_version"],
+                    "is_production": address["is_production"],
+                    "enterprise": enterprise,
+                    "materials": record["materials"],
+                },
+            }
+            yield separator + json.dumps(feature, ensure_ascii=False)
+            separator = ",\n"
+    yield "\n]}\n"
+
+
+def jsonl_lines(records: Iterable[dict]) -> Iterator[str]:
+    """
+    One JSON object per line for each enterprise.
+    """
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def export_lines(export_format: str, chunk_size: int = 500) -> Iterator[str]:
+    """
+    Exports the whole catalogue.
+    :param export_format: One of the EXPORT_FORMATS.
+    :param chunk_size: The number of enterprises whose related objects are loaded at once.
+    :return: An iterator over the lines of the export.
+    """
+    writers = {"csv": csv_lines, "geojson": geojson_lines, "jsonl": jsonl_lines}
+    # Chosen now, as the lines are read once the response has left the ReplicaMiddleware
+    return writers[export_format](enterprise_records(chunk_size, read_database()))
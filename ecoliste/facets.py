@@ -0,0 +1,82 @@
+"""
+The facets of a search: how many addresses each filter value would give, shown next to the filters.
+
+Each facet is counted with all the user filters but its own, as checking another value of a filter adds results instead
+of narrowing them. All the facets are computed by a single query, a union of one GROUP BY per facet on the search
+index, the material types and biobased materials being unnested from its arrays.
+"""
+
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.db.models import CharField, Count, F, Func, IntegerField, QuerySet, Value
+
+from .models import Address
+from .replicas import read_database
+from .search import filter_addresses, geolocation_field, located
+
+# The search index column of each facet, named as the filters
+FACETS = {
+    "materials": "search_index__materials",
+    "origin": "search_index__origins",
+    "biobased": "search_index__biobased",
+    "nemployees": "search_index__n_employees",
+    "sales": "search_index__annual_sales",
+}
+ARRAY_FACETS = ("materials", "origin", "biobased")
+
+
+class Unnest(Func):
+    function = "unnest"
+    output_field = IntegerField()
+
+
+def facet_counts_queryset(addresses: QuerySet, facet: str) -> QuerySet:
+    """
+    The count of the addresses for each value of a facet.
+    :param addresses: The addresses found, filtered by all the filters but the ones of the facet.
+    :param facet: One of the FACETS.
+    :return: A queryset of (facet, value, count) tuples.
+    """
+    if facet in ARRAY_FACETS:
+        value = Unnest(F(FACETS[facet]))
+    else:
+        addresses = addresses.filter(**{FACETS[facet] + "__isnull": False})
+        value = F(FACETS[facet])
+    return (
+        addresses.annotate(facet=Value(facet, output_field=CharField()), value=value)
+        .values("facet", "value")
+        .annotate(count=Count("pk"))
+        .values_list("facet", "value", "count")
+        .order_by()
+    )
+
+
+def ecoliste_facets(
+    search_location: Point, distance: int, filters: dict = None, projected: bool = None
+) -> dict[str, dict[int, int]]:
+    """
+    Counts the addresses found by ecoliste_research for each filter value, in one query.
+
+    :param search_location: A geolocation using a Point object from django.contrib.gis.geos
+    :param distance: The distance around the search location, in kilometers
+    :param filters: The filters, as described in ecoliste_research.
+    :param projected: Computes the distances in the local projection, defaults to the ECOLISTE_PROJECTED_SEARCH setting.
+    :return: A dictionary giving, for each facet named as its filter, the number of addresses for each value. The
+    values without any address are missing.
+    """
+    filters = filters or {}
+    search_location = located(search_location)
+    geolocation = geolocation_field(projected)
+    addresses = Address.objects.using(read_database()).filter(
+        **{geolocation + "__dwithin": (search_location, D(km=distance))}
+    )
+    querysets = []
+    for facet in FACETS:
+        other_filters = {key: value for key, value in filters.items() if key != facet}
+        querysets.append(
+            facet_counts_queryset(filter_addresses(addresses, other_filters), facet)
+        )
+    counts = {facet: {} for facet in FACETS}
+    for facet, value, count in querysets[0].union(*querysets[1:], all=True):
+        counts[facet][value] = count
+    return counts
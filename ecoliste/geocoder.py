@@ -0,0 +1,344 @@
+"""
+Offline geocoding of French addresses and communes, from the Base Adresse Nationale (BAN) imported in BanAddress.
+
+The texts are normalized the same way when they are imported and searched: lower case, without accents nor
+punctuation, with the usual abbreviations expanded. The entries are then found with the pg_trgm word similarity and its GIN
+index, and the numbers of the text, house numbers and postcodes, must be among the tokens of the entry when possible,
+which trigrams alone don't check well. The results of the searches are kept in the ECOLISTE_GEOCODER_CACHE, shared by
+the processes, under a version which each import bumps.
+"""
+
+import csv
+import hashlib
+import io
+import re
+import time
+import unicodedata
+from collections import Counter
+from typing import IO, Iterator, NamedTuple, Optional
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.contrib.postgres.search import TrigramSimilarity, TrigramWordSimilarity
+from django.core.cache import BaseCache, caches
+from django.db import connection, transaction
+from django.db.models import QuerySet
+
+from . import enterprise_pages, instrumentation, signals
+from .export import chunks
+from .models import Address, BanAddress, project
+
+ABBREVIATIONS = {
+    "all": "allee",
+    "av": "avenue",
+    "bd": "boulevard",
+    "bld": "boulevard",
+    "ch": "chemin",
+    "fg": "faubourg",
+    "imp": "impasse",
+    "pl": "place",
+    "rte": "route",
+    "sq": "square",
+    "st": "saint",
+    "ste": "sainte",
+}
+
+# Below this similarity, a result is not trusted to move an address
+MIN_SCORE = 0.5
+
+VERSION_KEY = "geocoder:version"
+
+CREATE_IMPORT_TABLE_SQL = """
+CREATE TEMPORARY TABLE ecoliste_ban_import (
+    ban_id varchar(64),
+    kind varchar(12),
+    label varchar(250),
+    postcode varchar(5),
+    citycode varchar(5),
+    city varchar(100),
+    normalized varchar(250),
+    tokens varchar(100)[],
+    geolocation geography(Point, 4326)
+) ON COMMIT DROP
+"""
+
+UPSERT_SQL = """
+INSERT INTO ecoliste_banaddress (ban_id, kind, label, postcode, citycode, city, normalized, tokens, geolocation)
+SELECT DISTINCT ON (ban_id) * FROM ecoliste_ban_import
+ON CONFLICT (ban_id) DO UPDATE SET
+    kind = EXCLUDED.kind,
+    label = EXCLUDED.label,
+    postcode = EXCLUDED.postcode,
+    citycode = EXCLUDED.citycode,
+    city = EXCLUDED.city,
+    normalized = EXCLUDED.normalized,
+    tokens = EXCLUDED.tokens,
+    geolocation = EXCLUDED.geolocation
+"""
+
+
+class GeocodingResult(NamedTuple):
+    label: str
+    kind: str
+    longitude: float
+    latitude: float
+    score: float
+
+    @property
+    def point(self) -> Point:
+        return Point(self.longitude, self.latitude, srid=4326)
+
+
+def normalize(text: str) -> str:
+    """
+    Writes a text the way the geocoder compares them.
+    :param text: An address or a commune name.
+    :return: The words of the text, in lower case and without accents, separated by spaces.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(
+        ABBREVIATIONS.get(word, word) for word in re.findall(r"[a-z0-9]+", text)
+    )
+
+
+def geocoder_cache() -> Optional[BaseCache]:
+    """
+    The cache of the ECOLISTE_GEOCODER_CACHE setting, or None if the cache is disabled.
+    """
+    alias = settings.ECOLISTE_GEOCODER_CACHE
+    return caches[alias] if alias else None
+
+
+def find_entries(normalized: str, limit: int) -> tuple[GeocodingResult, ...]:
+    """
+    Finds the entries closest to a normalized text, in the database.
+    :return: The results, the most similar first.
+    """
+    # The word similarity finds the texts within longer entries, a commune name within its addresses, and the
+    # similarity then prefers the entries without other words, the commune itself
+    entries = (
+        BanAddress.objects.filter(normalized__trigram_word_similar=normalized)
+        .annotate(
+            score=TrigramWordSimilarity(normalized, "normalized"),
+            similarity=TrigramSimilarity("normalized", normalized),
+        )
+        .order_by("-score", "-similarity", "pk")
+        .values_list("label", "kind", "geolocation", "score")
+    )
+    rows = []
+    numbers = [word for word in normalized.split() if word.isdigit()]
+    if numbers:
+        rows = list(entries.filter(tokens__contains=numbers)[:limit])
+    if not rows:
+        rows = list(entries[:limit])
+    return tuple(
+        GeocodingResult(label, kind, geolocation.x, geolocation.y, score)
+        for label, kind, geolocation, score in rows
+    )
+
+
+def search_entries(normalized: str, limit: int) -> tuple[GeocodingResult, ...]:
+    """
+    find_entries, from the cache when it is enabled.
+    """
+    cache = geocoder_cache()
+    if cache is None:
+        return find_entries(normalized, limit)
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # A new version, so the results cached before the version was evicted can't be found again
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    key = "geocoder:{}:{}:{}".format(
+        version, limit, hashlib.sha1(normalized.encode()).hexdigest()
+    )
+    results = cache.get(key)
+    instrumentation.cache_lookup("geocoder", hit=results is not None)
+    if results is None:
+        results = find_entries(normalized, limit)
+        cache.set(key, results)
+    return results
+
+
+def invalidate() -> None:
+    """
+    Bumps the version of the cached results, once the current transaction is committed.
+    """
+    cache = geocoder_cache()
+    if cache is not None:
+        transaction.on_commit(
+            lambda: cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+        )
+
+
+def geocode(text: str, limit: int = 5) -> list[GeocodingResult]:
+    """
+    Finds the location of an address or a commune.
+    :param text: The address or commune, as written by a user.
+    :param limit: The maximum number of results.
+    :return: The results, the most likely first, with their similarity to the text from 0 to 1.
+    """
+    normalized = normalize(text)
+    if not normalized:
+        return []
+    return list(search_entries(normalized, limit))
+
+
+def entry_row(
+    ban_id: str,
+    kind: str,
+    label: str,
+    postcode: str,
+    citycode: str,
+    city: str,
+    tokens: set[str],
+    longitude: float,
+    latitude: float,
+) -> list:
+    normalized = normalize(label)
+    tokens = tokens | set(normalized.split())
+    return [
+        ban_id,
+        kind,
+        label[:250],
+        postcode,
+        citycode,
+        city,
+        normalized[:250],
+        "{" + ",".join(sorted(tokens)) + "}",
+        "SRID=4326;POINT({} {})".format(longitude, latitude),
+    ]
+
+
+def ban_rows(file: IO[str]) -> Iterator[list]:
+    """
+    Reads a BAN CSV file, with an address per line.
+    :param file: The file, in the "adresses-*.csv" format of adresse.data.gouv.fr.
+    :return: An iterator over the rows of the entries: the addresses, then their communes, located at the center of
+    their addresses.
+    """
+    communes = {}
+    for record in csv.DictReader(file, delimiter=";"):
+        number = " ".join(filter(None, [record["numero"], record["rep"]]))
+        label = " ".join(
+            filter(
+                None,
+                [
+                    number,
+                    record["nom_voie"],
+                    record["code_postal"],
+                    record["nom_commune"],
+                ],
+            )
+        )
+        longitude, latitude = float(record["lon"]), float(record["lat"])
+        yield entry_row(
+            record["id"],
+            BanAddress.Kinds.HOUSENUMBER,
+            label,
+            record["code_postal"],
+            record["code_insee"],
+            record["nom_commune"],
+            set(),
+            longitude,
+            latitude,
+        )
+        commune = communes.setdefault(
+            record["code_insee"],
+            {
+                "city": record["nom_commune"],
+                "postcodes": set(),
+                "longitude": 0,
+                "latitude": 0,
+                "count": 0,
+            },
+        )
+        commune["postcodes"].add(record["code_postal"])
+        commune["longitude"] += longitude
+        commune["latitude"] += latitude
+        commune["count"] += 1
+    for citycode, commune in communes.items():
+        postcodes = commune["postcodes"] - {""}
+        yield entry_row(
+            citycode,
+            BanAddress.Kinds.MUNICIPALITY,
+            commune["city"],
+            next(iter(postcodes)) if len(postcodes) == 1 else "",
+            citycode,
+            commune["city"],
+            postcodes | {citycode},
+            commune["longitude"] / commune["count"],
+            commune["latitude"] / commune["count"],
+        )
+
+
+def import_ban(file: IO[str], batch_size: int = 10000) -> int:
+    """
+    Imports a BAN CSV file, replacing the entries already imported with the same ids.
+
+    The rows are copied with COPY into a temporary table, then inserted at once.
+    :param file: The file, in the "adresses-*.csv" format of adresse.data.gouv.fr.
+    :param batch_size: The number of rows sent by each COPY.
+    :return: The number of entries imported, addresses and communes.
+    """
+    count = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(CREATE_IMPORT_TABLE_SQL)
+        for chunk in chunks(ban_rows(file), batch_size):
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(chunk)
+            buffer.seek(0)
+            cursor.copy_expert(
+                "COPY ecoliste_ban_import FROM STDIN WITH (FORMAT csv)", buffer
+            )
+            count += len(chunk)
+        cursor.execute(UPSERT_SQL)
+        # Dropped at once, as an enclosing transaction may import other files before being committed
+        cursor.execute("DROP TABLE ecoliste_ban_import")
+        invalidate()
+    return count
+
+
+def geocode_addresses(
+    addresses: QuerySet,
+    min_score: float = MIN_SCORE,
+    batch_size: int = 500,
+    dry_run: bool = False,
+) -> Counter:
+    """
+    Geocodes again existing addresses from their text, and moves the ones whose location changed.
+    :param addresses: The Address queryset to geocode.
+    :param min_score: The minimum similarity of a result to be used.
+    :param batch_size: The number of addresses updated at once.
+    :param dry_run: Only counts the addresses, without saving anything.
+    :return: The numbers of addresses found, moved, and not found.
+    """
+    stats = Counter()
+    for batch in chunks(addresses.order_by("pk").iterator(batch_size), batch_size):
+        moved, previous_locations = [], []
+        for address in batch:
+            results = geocode(address.text_version, limit=1)
+            if not results or results[0].score < min_score:
+                stats["not found"] += 1
+                continue
+            stats["found"] += 1
+            point = results[0].point
+            if address.geolocation.equals_exact(point, tolerance=1e-7):
+                continue
+            previous_locations.append(address.geolocation)
+            address.geolocation = point
+            # Not computed by bulk_update, which doesn't call save()
+            address.geolocation_projected = project(point)
+            moved.append(address)
+        stats["moved"] += len(moved)
+        if moved and not dry_run:
+            with transaction.atomic():
+                Address.objects.bulk_update(
+                    moved, ["geolocation", "geolocation_projected"]
+                )
+                enterprise_ids = {address.enterprise_id for address in moved}
+                signals.enterprises_changed(enterprise_ids)
+                signals.locations_changed(previous_locations)
+                enterprise_pages.invalidate(enterprise_ids, ["addresses"])
+    return stats
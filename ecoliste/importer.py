@@ -0,0 +1,432 @@
+"""
+Bulk import of suppliers: enterprises, with their addresses, materials and contacts.
+
+The records have the format of the JSON lines export, and the CSV export can also be read back. They are validated and
+written in batches, with a few bulk queries per batch instead of several queries per record. Importing the same file
+twice gives the same result: enterprises are matched by website, or by name when they have none, and their addresses,
+materials and contacts by their text, type and origin, and names.
+"""
+
+import csv
+import datetime
+import json
+import re
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+from typing import IO, Iterable, Iterator, Optional
+
+from django.contrib.gis.geos import Point
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+
+from . import enterprise_pages, signals
+from .export import CSV_COLUMNS, chunks
+from .models import (
+    Address,
+    BiobasedOriginMaterial,
+    Contact,
+    Enterprise,
+    MaterialByEnterprise,
+    MaterialType,
+    project,
+)
+
+ENTERPRISE_FIELDS = ["name", "website", "description", "n_employees", "annual_sales"]
+CONTACT_FIELDS = ["firstname", "surname", "description", "phone1", "phone2", "mail"]
+
+# A material of the CSV export, such as "Beams (Biosourcé)"
+CSV_MATERIAL = re.compile(r"^(?P<type>.*) \((?P<origin>[^()]*)\)$")
+
+
+class RecordError(Exception):
+    """
+    A record that can't be imported.
+    """
+
+
+def read_jsonl(stream: IO) -> Iterator[dict]:
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_json(stream: IO) -> Iterator[dict]:
+    # A JSON array can't be read progressively with the standard library
+    yield from json.load(stream)
+
+
+def read_csv(stream: IO) -> Iterator[dict]:
+    """
+    Reads the CSV export: the consecutive lines of an enterprise are gathered in one record.
+    """
+    rows = csv.DictReader(stream)
+    missing = set(CSV_COLUMNS) - set(rows.fieldnames or [])
+    if missing:
+        raise RecordError("Missing CSV columns: {}".format(", ".join(sorted(missing))))
+    for _, enterprise_rows in groupby(
+        rows, key=itemgetter("enterprise_name", "website")
+    ):
+        enterprise_rows = list(enterprise_rows)
+        first = enterprise_rows[0]
+        record = {
+            "name": first["enterprise_name"],
+            "website": first["website"],
+            "n_employees": first["n_employees"],
+            "annual_sales": first["annual_sales"],
+            "addresses": [],
+            "materials": [],
+            "contacts": [],
+        }
+        for row in enterprise_rows:
+            if row["text_version"]:
+                record["addresses"].append(
+                    {
+                        "text_version": row["text_version"],
+                        "is_production": row["is_production"] == "True",
+                        "longitude": row["longitude"],
+                        "latitude": row["latitude"],
+                    }
+                )
+        for material in filter(None, first["materials"].split("; ")):
+            match = CSV_MATERIAL.match(material)
+            # Without origin, the record will be rejected when validated
+            record["materials"].append(
+                match.groupdict() if match else {"type": material, "origin": None}
+            )
+        for contact in filter(None, first["contacts"].split("; ")):
+            firstname, _, surname = contact.partition(" ")
+            record["contacts"].append({"firstname": firstname, "surname": surname})
+        yield record
+
+
+READERS = {"csv": read_csv, "json": read_json, "jsonl": read_jsonl}
+
+
+def choice_value(choices, value) -> Optional[int]:
+    """
+    Reads a choice given by its value or by its label.
+    :param choices: An IntegerChoices class.
+    :param value: The value, the label, or nothing.
+    :return: The value of the choice, or None.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, int) or str(value).isdigit():
+        if int(value) in choices.values:
+            return int(value)
+    else:
+        for choice, label in choices.choices:
+            if str(label) == value:
+                return choice
+    raise RecordError("Invalid value: {}".format(value))
+
+
+def merge(instance, imported, fields: list[str]) -> None:
+    """
+    Updates an existing instance with the values of an imported one.
+
+    The values missing from the input, such as the descriptions in the CSV export, are kept.
+    """
+    for field in fields:
+        value = getattr(imported, field)
+        if value not in ("", None):
+            setattr(instance, field, value)
+
+
+class SupplierImporter:
+    """
+    Imports batches of records, keeping the material types and biobased materials in memory.
+    """
+
+    def __init__(self, batch_size: int = 500, dry_run: bool = False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.stats = Counter()
+        self.errors = []
+        self.material_types = dict(MaterialType.objects.values_list("name", "pk"))
+        self.biobased_materials = dict(
+            BiobasedOriginMaterial.objects.values_list("name", "pk")
+        )
+
+    def import_records(self, records: Iterable[dict]) -> Iterator[Counter]:
+        """
+        Imports all the records, batch by batch.
+        :param records: The records to import.
+        :return: An iterator over the statistics after each batch, to follow the progress.
+        """
+        first = 1
+        for batch in chunks(records, self.batch_size):
+            self.import_batch(batch, first)
+            first += len(batch)
+            yield self.stats
+
+    def validate(self, record: dict) -> dict:
+        """
+        Checks a record and converts it to model instances, not saved yet.
+        :raise RecordError: If the record is invalid.
+        """
+        try:
+            enterprise = Enterprise(
+                name=record.get("name") or "",
+                website=record.get("website") or "",
+                description=record.get("description") or "",
+                n_employees=choice_value(
+                    Enterprise.NEmployees, record.get("n_employees")
+                ),
+                annual_sales=choice_value(
+                    Enterprise.AnnualSales, record.get("annual_sales")
+                ),
+            )
+            enterprise.full_clean(exclude=["added", "updated"])
+            addresses = {}
+            # The materials of the export refer to the addresses by their id in the exporting database
+            addresses_ids = {}
+            for data in record.get("addresses", []):
+                address = Address(
+                    text_version=data["text_version"],
+                    is_production=bool(data["is_production"]),
+                    geolocation=Point(
+                        float(data["longitude"]), float(data["latitude"]), srid=4326
+                    ),
+                )
+                address.full_clean(exclude=["enterprise"])
+                addresses[address.text_version] = address
+                if "id" in data:
+                    addresses_ids[data["id"]] = address.text_version
+            materials = []
+            for data in record.get("materials", []):
+                if not data.get("origin"):
+                    raise RecordError("Missing material origin.")
+                if data["type"] not in self.material_types:
+                    raise RecordError("Unknown material type: {}".format(data["type"]))
+                unknown = set(data.get("biobased", [])) - set(self.biobased_materials)
+                if unknown:
+                    raise RecordError(
+                        "Unknown biobased materials: {}".format(", ".join(unknown))
+                    )
+                material_addresses = [
+                    addresses_ids.get(address, address)
+                    for address in data.get("addresses", [])
+                ]
+                if not set(material_addresses) <= set(addresses):
+                    raise RecordError("Unknown production address.")
+                materials.append(
+                    {
+                        "type_id": self.material_types[data["type"]],
+                        "origin": choice_value(
+                            MaterialByEnterprise.MaterialOrigins, data["origin"]
+                        ),
+                        "biobased": [
+                            self.biobased_materials[name]
+                            for name in data.get("biobased", [])
+                        ],
+                        "addresses": material_addresses,
+                    }
+                )
+            contacts = []
+            for data in record.get("contacts", []):
+                contact = Contact(
+                    **{field: data.get(field) or "" for field in CONTACT_FIELDS}
+                )
+                contact.mail = contact.mail or None
+                contact.full_clean(exclude=["enterprise"])
+                contacts.append(contact)
+        except ValidationError as error:
+            raise RecordError(
+                "; ".join(
+                    "{}: {}".format(field, " ".join(messages))
+                    for field, messages in error.message_dict.items()
+                )
+            )
+        except (KeyError, TypeError, ValueError) as error:
+            raise RecordError("Invalid record: {!r}".format(error))
+        return {
+            "enterprise": enterprise,
+            "addresses": addresses,
+            "materials": materials,
+            "contacts": contacts,
+        }
+
+    def import_batch(self, records: list[dict], first: int) -> None:
+        """
+        Validates and writes a batch of records.
+        :param records: The records.
+        :param first: The position of the first record in the input, for the errors.
+        """
+        valid = []
+        for position, record in enumerate(records, start=first):
+            try:
+                valid.append(self.validate(record))
+            except RecordError as error:
+                self.errors.append((position, str(error)))
+                self.stats["errors"] += 1
+        # The same enterprise twice in a batch would be created twice
+        unique = {}
+        for item in valid:
+            unique[self.key(item["enterprise"])] = item
+        valid = list(unique.values())
+
+        with transaction.atomic():
+            self.save_enterprises(valid)
+            enterprise_ids = [item["enterprise"].pk for item in valid]
+            # Before the addresses move
+            previous_locations = signals.enterprises_locations(enterprise_ids)
+            self.save_addresses(valid)
+            self.save_materials(valid)
+            self.save_contacts(valid)
+            signals.enterprises_changed(enterprise_ids)
+            signals.locations_changed(previous_locations)
+            # The bulk operations send no signal
+            enterprise_pages.invalidate(enterprise_ids)
+            if self.dry_run:
+                transaction.set_rollback(True)
+
+    @staticmethod
+    def key(enterprise: Enterprise) -> tuple[str, str]:
+        if enterprise.website:
+            return "website", enterprise.website
+        return "name", enterprise.name
+
+    def save_enterprises(self, items: list[dict]) -> None:
+        enterprises = [item["enterprise"] for item in items]
+        by_website, by_name, without_website = {}, {}, {}
+        for enterprise in Enterprise.objects.filter(
+            Q(website__in=[e.website for e in enterprises if e.website])
+            | Q(name__in=[e.name for e in enterprises])
+        ).order_by("pk"):
+            if enterprise.website:
+                by_website.setdefault(enterprise.website, enterprise)
+            else:
+                without_website.setdefault(enterprise.name, enterprise)
+            by_name.setdefault(enterprise.name, enterprise)
+        created, updated = [], {}
+        for enterprise in enterprises:
+            # Matched by name only when one of them has no website: suppliers with the same name but different
+            # websites, as the sawmills of several towns, are different enterprises
+            if enterprise.website:
+                match = by_website.get(enterprise.website) or without_website.get(
+                    enterprise.name
+                )
+            else:
+                match = without_website.get(enterprise.name) or by_name.get(
+                    enterprise.name
+                )
+            if match is None:
+                created.append(enterprise)
+                continue
+            enterprise.pk = match.pk
+            merge(match, enterprise, ENTERPRISE_FIELDS)
+            if match.website and without_website.get(match.name) is match:
+                # Given a website, it can't be matched by name by another website of the batch
+                del without_website[match.name]
+                by_website.setdefault(match.website, match)
+            # Not set by bulk_update, which doesn't call save()
+            match.updated = datetime.date.today()
+            updated[match.pk] = match
+        Enterprise.objects.bulk_create(created)
+        Enterprise.objects.bulk_update(
+            list(updated.values()), ENTERPRISE_FIELDS + ["updated"]
+        )
+        self.stats["enterprises created"] += len(created)
+        self.stats["enterprises updated"] += len(updated)
+
+    def save_addresses(self, items: list[dict]) -> None:
+        enterprise_ids = [item["enterprise"].pk for item in items]
+        existing = {
+            (address.enterprise_id, address.text_version): address
+            for address in Address.objects.filter(enterprise_id__in=enterprise_ids)
+        }
+        created, updated = [], []
+        for item in items:
+            for text_version, address in item["addresses"].items():
+                address.enterprise_id = item["enterprise"].pk
+                # Not computed by bulk_create, which doesn't call save()
+                address.geolocation_projected = project(address.geolocation)
+                match = existing.get((address.enterprise_id, text_version))
+                if match is None:
+                    created.append(address)
+                else:
+                    address.pk = match.pk
+                    updated.append(address)
+        Address.objects.bulk_create(created)
+        Address.objects.bulk_update(
+            updated, ["geolocation", "geolocation_projected", "is_production"]
+        )
+        self.stats["addresses created"] += len(created)
+        self.stats["addresses updated"] += len(updated)
+
+    def save_materials(self, items: list[dict]) -> None:
+        enterprise_ids = [item["enterprise"].pk for item in items]
+        existing = {
+            (product.enterprise_id, product.type_id, product.origin): product
+            for product in MaterialByEnterprise.objects.filter(
+                enterprise_id__in=enterprise_ids
+            )
+        }
+        created = []
+        links = []
+        for item in items:
+            enterprise = item["enterprise"]
+            for material in item["materials"]:
+                key = (enterprise.pk, material["type_id"], material["origin"])
+                product = existing.get(key)
+                if product is None:
+                    product = MaterialByEnterprise(
+                        enterprise_id=enterprise.pk,
+                        type_id=material["type_id"],
+                        origin=material["origin"],
+                    )
+                    existing[key] = product
+                    created.append(product)
+                links.append((product, material, item["addresses"]))
+        MaterialByEnterprise.objects.bulk_create(created)
+        self.stats["materials created"] += len(created)
+
+        # The links already there are ignored, thanks to the unique constraints of the through tables
+        AddressLink = MaterialByEnterprise.address.through
+        BiobasedLink = MaterialByEnterprise.biobased_material.through
+        AddressLink.objects.bulk_create(
+            [
+                AddressLink(
+                    materialbyenterprise_id=product.pk, address_id=addresses[text].pk
+                )
+                for product, material, addresses in links
+                for text in material["addresses"]
+            ],
+            ignore_conflicts=True,
+        )
+        BiobasedLink.objects.bulk_create(
+            [
+                BiobasedLink(
+                    materialbyenterprise_id=product.pk, biobasedoriginmaterial_id=bio
+                )
+                for product, material, addresses in links
+                for bio in material["biobased"]
+            ],
+            ignore_conflicts=True,
+        )
+
+    def save_contacts(self, items: list[dict]) -> None:
+        enterprise_ids = [item["enterprise"].pk for item in items]
+        existing = {
+            (contact.enterprise_id, contact.firstname, contact.surname): contact
+            for contact in Contact.objects.filter(enterprise_id__in=enterprise_ids)
+        }
+        created, updated = [], []
+        for item in items:
+            for contact in item["contacts"]:
+                contact.enterprise_id = item["enterprise"].pk
+                match = existing.get(
+                    (contact.enterprise_id, contact.firstname, contact.surname)
+                )
+                if match is None:
+                    created.append(contact)
+                else:
+                    merge(match, contact, CONTACT_FIELDS)
+                    updated.append(match)
+        Contact.objects.bulk_create(created)
+        Contact.objects.bulk_update(updated, CONTACT_FIELDS)
+        self.stats["contacts created"] += len(created)
+        self.stats["contacts updated"] += len(updated)
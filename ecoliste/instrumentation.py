@@ -0,0 +1,110 @@
+"""
+Measures of the work done by each request: the SQL queries, the template rendering and the cache lookups.
+
+The measures are added to the metrics of the current request, kept in a context variable by the ServerTimingMiddleware.
+Outside of a measured request, recording does nothing, so the code can record its measures unconditionally. The
+context variable follows the code of the async views into the threads running their queries.
+
+The queries are measured by a wrapper installed on every database connection, see install.
+
+The rendering is measured by a template backend, to set in the TEMPLATES setting instead of DjangoTemplates.
+"""
+
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+
+from . import metrics
+
+_metrics: ContextVar[Optional[Counter]] = ContextVar("ecoliste_metrics", default=None)
+
+
+@contextmanager
+def measure() -> Iterator[Counter]:
+    """
+    Measures the code run within the context: the current request.
+    :return: The metrics, filled while the code runs.
+    """
+    metrics = Counter()
+    token = _metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _metrics.reset(token)
+
+
+def record(metric: str, value: float = 1) -> None:
+    """
+    Adds a measure to the metrics of the current request, if it is measured.
+    """
+    metrics = _metrics.get()
+    if metrics is not None:
+        metrics[metric] += value
+
+
+def cache_lookup(cache: str, hit: bool, count: int = 1) -> None:
+    """
+    Records lookups in one of the caches of the application, for the current request and the metrics.
+    :param cache: The name of the cache, such as "search" or "pages".
+    :param hit: Whether the data was found.
+    :param count: The number of lookups.
+    """
+    result = "hit" if hit else "miss"
+    record("cache {} {}".format(cache, result), count)
+    metrics.inc(
+        "ecoliste_cache_lookups_total", {"cache": cache, "result": result}, count
+    )
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    """
+    Measures a query, as a database execute wrapper.
+    """
+    start_time = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record("sql", time.perf_counter() - start_time)
+        record("queries")
+
+
+def install(connection: BaseDatabaseWrapper) -> None:
+    """
+    Measures the queries of a database connection, for all the requests: each thread has its own connections, and the
+    queries of the async views run in other threads than the middleware.
+    """
+    if sql_wrapper not in connection.execute_wrappers:
+        # First, as the wrappers of the execute_wrapper context managers are removed from the end
+        connection.execute_wrappers.insert(0, sql_wrapper)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        start_time = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            record("templates", time.perf_counter() - start_time)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """
+    The Django template backend, measuring the time spent rendering.
+
+    The included templates are rendered within their parent, so their time is only counted once.
+    """
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from ecoliste import synthetic
+from ecoliste.models import Enterprise
+from ecoliste.management.commands.bench_search import current_commit, percentile
+
+
+async def fetch(host: str, port: int, path: str, slow_delay: float = 0) -> int:
+    """
+    Sends a GET request and reads the whole response.
+    :param slow_delay: The pause between each line of the request, to act as a client on a slow network.
+    :return: The status code of the response.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        lines = [
+            "GET {} HTTP/1.1".format(path),
+            "Host: {}:{}".format(host, port),
+            "User-Agent: bench_load",
+            "Connection: close",
+            "",
+            "",
+        ]
+        if slow_delay:
+            for line in lines[:-1]:
+                writer.write((line + "\r\n").encode())
+                await writer.drain()
+                await asyncio.sleep(slow_delay)
+        else:
+            writer.write("\r\n".join(lines).encode())
+            await writer.drain()
+        status_line = await reader.readline()
+        while await reader.read(65536):
+            pass
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return int(status_line.split()[1])
+
+
+def load_paths(locations: int, enterprises: int, radius: int, seed: int) -> dict:
+    """
+    The paths requested by the benchmark: searches around the cities, and the pages of random enterprises.
+    """
+    rng = random.Random(seed)
+    search_api = reverse("ecoliste:search_api")
+    ids = list(Enterprise.objects.values_list("pk", flat=True))
+    return {
+        "search": [
+            "{}?{}".format(
+                search_api,
+                urlencode({"lon": point.x, "lat": point.y, "distance": radius}),
+            )
+            for point in synthetic.search_locations(locations, seed)
+        ],
+        "enterprise": [
+            reverse("ecoliste:enterprise", args=[pk])
+            for pk in rng.sample(ids, min(enterprises, len(ids)))
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the throughput of a running server on the search API and the enterprise pages, with many "
+        "concurrent clients, some of them slow. Run it against the WSGI and the ASGI servers on the same dataset "
+        "to compare them, e.g. `gunicorn BTPecoliste.wsgi --workers 4` and "
+        "`uvicorn BTPecoliste.asgi:application --workers 4`, with the settings of the server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            default="http://127.0.0.1:8000",
+            help="The URL of the server.",
+        )
+        parser.add_argument(
+            "--label",
+            default="",
+            help="The name of the server in the results, e.g. wsgi or asgi.",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=2000,
+            help="The number of requests of the fast clients.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=50,
+            help="The number of fast clients, each one sending its requests one after the other.",
+        )
+        parser.add_argument(
+            "--slow-clients",
+            type=int,
+            default=0,
+            help="The number of clients sending their requests slowly, meanwhile.",
+        )
+        parser.add_argument(
+            "--slow-delay",
+            type=float,
+            default=0.5,
+            help="The pause of the slow clients between each line of their requests, in seconds.",
+        )
+        parser.add_argument(
+            "--locations",
+            type=int,
+            default=100,
+            help="The number of search locations around the cities.",
+        )
+        parser.add_argument(
+            "--enterprises",
+            type=int,
+            default=500,
+            help="The number of enterprise pages.",
+        )
+        parser.add_argument(
+            "--radius",
+            type=int,
+            default=50,
+            help="The search distance, in kilometers.",
+        )
+        parser.add_argument(
+            "--random-seed",
+            type=int,
+            default=0,
+            help="The seed of the search locations and of the enterprises.",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Writes the results as JSON, to compare them between servers and commits.",
+        )
+
+    def handle(self, *args, **options):
+        url = urlsplit(options["url"])
+        if url.scheme != "http" or not url.hostname:
+            raise CommandError("Only http URLs are supported.")
+        paths = load_paths(
+            options["locations"],
+            options["enterprises"],
+            options["radius"],
+            options["random_seed"],
+        )
+        requests = [
+            (kind, url.path.rstrip("/") + path)
+            for kind, kind_paths in paths.items()
+            for path in kind_paths
+        ]
+        if not requests:
+            raise CommandError("No enterprise and no search location.")
+        rng = random.Random(options["random_seed"])
+        requests = [rng.choice(requests) for _ in range(options["requests"])]
+        start = time.perf_counter()
+        measures = asyncio.run(
+            self.load(url.hostname, url.port or 80, requests, options)
+        )
+        elapsed = time.perf_counter() - start
+        results = []
+        for (kind, client), durations in sorted(measures.items()):
+            results.append(
+                {
+                    "kind": kind,
+                    "client": client,
+                    "requests": len(durations),
+                    "errors": sum(
+                        status is None or status >= 500 for status, _ in durations
+                    ),
+                    "p50": round(percentile([d for _, d in durations], 50), 3),
+                    "p95": round(percentile([d for _, d in durations], 95), 3),
+                    "p99": round(percentile([d for _, d in durations], 99), 3),
+                }
+            )
+        report = {
+            "commit": current_commit(),
+            "label": options["label"],
+            "url": options["url"],
+            "concurrency": options["concurrency"],
+            "slow_clients": options["slow_clients"],
+            "elapsed": round(elapsed, 3),
+            "throughput": round(len(requests) / elapsed, 1),
+            "results": results,
+        }
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.write_table(report)
+
+    @staticmethod
+    async def load(
+        host: str, port: int, requests: list[tuple[str, str]], options: dict
+    ) -> dict:
+        """
+        Sends the requests with the fast clients while the slow clients send theirs, until the fast clients are done.
+        :return: The status, or None on a connection error, and the duration in milliseconds of each request, by kind
+        of request and of client.
+        """
+        measures = defaultdict(list)
+        pending = iter(requests)
+        rng = random.Random(options["random_seed"])
+        done = asyncio.Event()
+
+        async def request(kind: str, client: str, path: str, slow_delay: float):
+            start = time.perf_counter()
+            try:
+                status = await fetch(host, port, path, slow_delay)
+            except (OSError, ValueError, IndexError):
+                status = None
+            measures[kind, client].append(
+                (status, (time.perf_counter() - start) * 1000)
+            )
+
+        async def fast_client():
+            for kind, path in pending:
+                await request(kind, "fast", path, 0)
+
+        async def slow_client():
+            while not done.is_set():
+                kind, path = rng.choice(requests)
+                await request(kind, "slow", path, options["slow_delay"])
+
+        slow_clients = [
+            asyncio.create_task(slow_client()) for _ in range(options["slow_clients"])
+        ]
+        await asyncio.gather(*(fast_client() for _ in range(options["concurrency"])))
+        done.set()
+        await asyncio.gather(*slow_clients)
+        return measures
+
+    def write_table(self, report: dict) -> None:
+        self.stdout.write(
+            "{} {}: {} requests/s over {} s, {} clients and {} slow clients".format(
+                report["label"] or "server",
+                report["url"],
+                report["throughput"],
+                report["elapsed"],
+                report["concurrency"],
+                report["slow_clients"],
+            )
+        )
+        line = "{:>12} {:>8} {:>9} {:>7} {:>9} {:>9} {:>9}"
+        self.stdout.write(
+            line.format(
+                "kind", "client", "requests", "errors", "p50 ms", "p95 ms", "p99 ms"
+            )
+        )
+        for result in report["results"]:
+            self.stdout.write(
+                line.format(
+                    result["kind"],
+                    result["client"],
+                    result["requests"],
+                    result["errors"],
+                    "{:.2f}".format(result["p50"]),
+                    "{:.2f}".format(result["p95"]),
+                    "{:.2f}".format(result["p99"]),
+                )
+            )
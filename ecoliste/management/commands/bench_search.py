@@ -0,0 +1,278 @@
+import json
+import math
+import statistics
+import subprocess
+import time
+from contextlib import ExitStack
+from typing import Optional
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import connections
+from django.db.models import Count
+from django.core.management.base import BaseCommand
+from django.test.utils import CaptureQueriesContext
+
+from ecoliste import synthetic
+from ecoliste.models import (
+    Address,
+    BiobasedOriginMaterial,
+    Enterprise,
+    MaterialByEnterprise,
+)
+from ecoliste.search import ecoliste_research
+
+
+def percentile(durations: list[float], percent: int) -> float:
+    """
+    The nearest-rank percentile of the durations.
+    """
+    ordered = sorted(durations)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def rows_scanned(plan: dict) -> int:
+    """
+    The number of rows read by the scans of a query plan of EXPLAIN ANALYZE, including the ones filtered out.
+    """
+    rows = 0
+    if "Scan" in plan["Node Type"]:
+        rows = (
+            plan["Actual Rows"]
+            + plan.get("Rows Removed by Filter", 0)
+            + plan.get("Rows Removed by Index Recheck", 0)
+        ) * plan["Actual Loops"]
+    return rows + sum(rows_scanned(child) for child in plan.get("Plans", []))
+
+
+def filter_cases() -> dict[str, dict]:
+    """
+    The filters of the benchmark, built from the data: the most and least produced material types, the biobased
+    origin and materials, and the enterprise sizes, alone and combined.
+    """
+    types = list(
+        MaterialByEnterprise.objects.values("type")
+        .annotate(count=Count("pk"))
+        .order_by("-count", "type")
+        .values_list("type", flat=True)
+    )
+    biobased = (
+        BiobasedOriginMaterial.objects.annotate(count=Count("products"))
+        .order_by("-count", "pk")
+        .values_list("pk", flat=True)
+        .first()
+    )
+    biobased_origin = MaterialByEnterprise.MaterialOrigins.BIOBASED.value
+    small = (Enterprise.NEmployees.INDIVIDUAL.value, Enterprise.NEmployees.SMALL.value)
+    cases = {
+        "none": {},
+        "biobased origin": {"origin": [biobased_origin]},
+        "small enterprises": {"nemployees": small},
+    }
+    if types:
+        cases["common material"] = {"materials": [types[0]]}
+        cases["rare material"] = {"materials": [types[-1]]}
+        cases["combined"] = {
+            "materials": [types[0]],
+            "origin": [biobased_origin],
+            "nemployees": small,
+        }
+    if biobased is not None:
+        cases["biobased material"] = {"biobased": [biobased]}
+    return cases
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the search durations with the WGS84 and the projected coordinates, for several distances and "
+        "filters, on the current data or on a synthetic dataset of suppliers over metropolitan France."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            metavar="ADDRESSES",
+            help="Adds a synthetic dataset with this number of addresses first, e.g. 10000, 100000 or 1000000.",
+        )
+        parser.add_argument(
+            "--random-seed",
+            type=int,
+            default=0,
+            help="The seed of the synthetic dataset and of the search locations.",
+        )
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Removes the synthetic dataset at the end.",
+        )
+        parser.add_argument(
+            "--location",
+            nargs=2,
+            type=float,
+            metavar=("LONGITUDE", "LATITUDE"),
+            help="A single search location, instead of locations around the cities.",
+        )
+        parser.add_argument(
+            "--locations",
+            type=int,
+            default=10,
+            help="The number of search locations around the cities.",
+        )
+        parser.add_argument(
+            "--radius",
+            nargs="+",
+            type=int,
+            default=[10, 50, 200],
+            help="The search distances, in kilometers.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="The number of runs of each search, at each location.",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Writes the results as JSON, to compare them between commits.",
+        )
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            start = time.perf_counter()
+            enterprises = synthetic.seed(options["seed"], options["random_seed"])
+            self.stderr.write(
+                "Created {} enterprises in {:.1f} s.".format(
+                    enterprises, time.perf_counter() - start
+                )
+            )
+        if options["location"]:
+            locations = [Point(options["location"], srid=4326)]
+        else:
+            locations = synthetic.search_locations(
+                options["locations"], options["random_seed"]
+            )
+        cases = filter_cases()
+        results = []
+        for radius in options["radius"]:
+            for filters_name, filters in cases.items():
+                for mode, projected in (("geography", False), ("projected", True)):
+                    results.append(
+                        self.measure(
+                            locations,
+                            radius,
+                            filters,
+                            projected,
+                            options["repeat"],
+                        )
+                        | {"radius": radius, "filters": filters_name, "mode": mode}
+                    )
+        report = {
+            "commit": current_commit(),
+            "dataset": {
+                "enterprises": Enterprise.objects.count(),
+                "addresses": Address.objects.count(),
+            },
+            "locations": len(locations),
+            "repeat": options["repeat"],
+            "results": results,
+        }
+        if options["clear"]:
+            synthetic.clear()
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.write_table(report)
+
+    @staticmethod
+    def measure(
+        locations: list[Point],
+        radius: int,
+        filters: dict,
+        projected: bool,
+        repeat: int,
+    ) -> dict:
+        """
+        Runs a search from every location, and measures it.
+        :return: The mean number of results, the percentiles of the durations in milliseconds, and the queries and rows
+        scanned by the search from the first location.
+        """
+        searches = [
+            ecoliste_research(location, radius, filters, projected)
+            for location in locations
+        ]
+        # The first run fills the caches of the database, on the databases the searches read, which can be replicas
+        with ExitStack() as stack:
+            captured = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in {search.db for search in searches}
+            ]
+            counts = [len(list(search.all())) for search in searches]
+        queries = sum(len(queries) for queries in captured)
+        plan = json.loads(searches[0].explain(analyze=True, format="json"))[0]
+        durations = []
+        for search in searches:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(search.all())
+                durations.append((time.perf_counter() - start) * 1000)
+        return {
+            "results": statistics.mean(counts),
+            "p50": round(percentile(durations, 50), 3),
+            "p95": round(percentile(durations, 95), 3),
+            "p99": round(percentile(durations, 99), 3),
+            "queries": queries // len(searches),
+            "rows_scanned": rows_scanned(plan["Plan"]),
+        }
+
+    def write_table(self, report: dict) -> None:
+        self.stdout.write(
+            "{} enterprises, {} addresses, {} locations".format(
+                report["dataset"]["enterprises"],
+                report["dataset"]["addresses"],
+                report["locations"],
+            )
+        )
+        line = "{:>8} {:>18} {:>10} {:>9} {:>9} {:>9} {:>9} {:>8} {:>12}"
+        self.stdout.write(
+            line.format(
+                "radius",
+                "filters",
+                "mode",
+                "results",
+                "p50 ms",
+                "p95 ms",
+                "p99 ms",
+                "queries",
+                "rows scanned",
+            )
+        )
+        for result in report["results"]:
+            self.stdout.write(
+                line.format(
+                    result["radius"],
+                    result["filters"],
+                    result["mode"],
+                    round(result["results"], 1),
+                    "{:.2f}".format(result["p50"]),
+                    "{:.2f}".format(result["p95"]),
+                    "{:.2f}".format(result["p99"]),
+                    result["queries"],
+                    result["rows_scanned"],
+                )
+            )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from ecoliste.export import EXPORT_FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = "Exports the whole catalogue of enterprises, with their addresses, materials and contacts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("format", choices=EXPORT_FORMATS.keys())
+        parser.add_argument(
+            "-o",
+            "--output",
+            help="The file to write to, instead of the standard output.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="The number of enterprises whose related objects are loaded at once.",
+        )
+
+    def handle(self, *args, **options):
+        lines = export_lines(options["format"], options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8", newline="") as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
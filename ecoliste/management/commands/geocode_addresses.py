@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from ecoliste.geocoder import MIN_SCORE, geocode_addresses
+from ecoliste.models import Address
+
+
+class Command(BaseCommand):
+    help = "Geocodes the addresses again from their text with the local BAN, and moves the ones whose location changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--enterprise",
+            type=int,
+            nargs="+",
+            help="Only geocodes the addresses of these enterprises.",
+        )
+        parser.add_argument(
+            "--min-score",
+            type=float,
+            default=MIN_SCORE,
+            help="The minimum similarity, from 0 to 1, of a result to be used.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="The number of addresses updated at once.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Counts the addresses that would move, without saving anything.",
+        )
+
+    def handle(self, *args, **options):
+        addresses = Address.objects.all()
+        if options["enterprise"]:
+            addresses = addresses.filter(enterprise_id__in=options["enterprise"])
+        stats = geocode_addresses(
+            addresses, options["min_score"], options["batch_size"], options["dry_run"]
+        )
+        message = "Dry run, nothing saved: " if options["dry_run"] else "Geocoded: "
+        self.stdout.write(
+            self.style.SUCCESS(
+                message
+                + "{} found, {} moved, {} not found".format(
+                    stats["found"], stats["moved"], stats["not found"]
+                )
+            )
+        )
@@ -0,0 +1,35 @@
+import gzip
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ecoliste.geocoder import import_ban
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports Base Adresse Nationale CSV files (adresses-*.csv, possibly gzipped) for the geocoder. "
+        "Entries already imported are replaced."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="The number of rows sent to the database at once.",
+        )
+
+    def handle(self, *args, **options):
+        for path in options["files"]:
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8", newline="") as stream:
+                try:
+                    count = import_ban(stream, options["batch_size"])
+                except (KeyError, ValueError) as error:
+                    raise CommandError(
+                        "{}: invalid BAN file ({!r})".format(path, error)
+                    )
+            self.stdout.write(
+                self.style.SUCCESS("Imported {} entries from {}.".format(count, path))
+            )
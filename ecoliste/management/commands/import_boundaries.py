@@ -0,0 +1,34 @@
+from django.contrib.gis.gdal import GDALException
+from django.core.management.base import BaseCommand, CommandError
+
+from ecoliste.boundaries import import_boundaries
+from ecoliste.models import AdministrativeArea
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports the boundaries of the régions, départements or communes from files readable by GDAL, such as the "
+        "ADMIN EXPRESS shapefiles or GeoJSON files. The areas of this kind already imported are replaced. Import the "
+        "régions and départements first, then the communes, which also locates the addresses in them again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=AdministrativeArea.Kinds.values)
+        parser.add_argument("files", nargs="+")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of areas sent to the database at once.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            count = import_boundaries(
+                options["files"], options["kind"], options["batch_size"]
+            )
+        except (GDALException, ValueError) as error:
+            raise CommandError("Invalid boundaries file ({}).".format(error))
+        self.stdout.write(
+            self.style.SUCCESS("Imported {} {} areas.".format(count, options["kind"]))
+        )
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ecoliste.importer import READERS, RecordError, SupplierImporter
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports suppliers from a JSON lines, JSON or CSV file, in the format of the export. "
+        "Existing enterprises are updated."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file")
+        parser.add_argument(
+            "--format",
+            choices=READERS.keys(),
+            help="The format of the file, guessed from its extension by default.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="The number of records validated and written at once.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Validates and counts the changes, without saving anything.",
+        )
+
+    def handle(self, *args, **options):
+        import_format = options["format"] or options["file"].rsplit(".", 1)[-1]
+        if import_format not in READERS:
+            raise CommandError("Unknown format: {}".format(import_format))
+        importer = SupplierImporter(options["batch_size"], options["dry_run"])
+        with open(options["file"], encoding="utf-8", newline="") as stream:
+            try:
+                for stats in importer.import_records(READERS[import_format](stream)):
+                    self.stdout.write(self.summary(stats))
+            except (RecordError, ValueError) as error:
+                raise CommandError(error)
+        for position, error in importer.errors:
+            self.stderr.write("Record {}: {}".format(position, error))
+        message = "Dry run, nothing saved: " if options["dry_run"] else "Imported: "
+        self.stdout.write(self.style.SUCCESS(message + self.summary(importer.stats)))
+
+    @staticmethod
+    def summary(stats) -> str:
+        return ", ".join("{} {}".format(count, name) for name, count in stats.items())
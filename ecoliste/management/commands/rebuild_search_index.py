@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from ecoliste import search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the whole search index from the addresses, enterprises and products."
+    )
+
+    def handle(self, *args, **options):
+        rows = search_index.rebuild()
+        self.stdout.write(self.style.SUCCESS("Indexed {} addresses.".format(rows)))
@@ -0,0 +1,255 @@
+"""
+A registry of the metrics of the application, exposed in the Prometheus text format by the metrics view.
+
+Each process keeps its metrics in memory. With several processes, as the gunicorn workers, ECOLISTE_METRICS_DIR must
+be set to a directory shared by all of them: each process then writes its metrics to its own file there, at most every
+FLUSH_INTERVAL seconds and at the latest FLUSH_INTERVAL seconds after a change, even when the process gets no other
+request, and the metrics view adds up the files of all the processes. A process killed without exiting, as a gunicorn
+worker killed on its timeout, loses the changes of its last FLUSH_INTERVAL seconds. The files of the stopped processes
+are kept, so the counters never go down, and the directory should be emptied when the application is deployed again.
+"""
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from pathlib import Path
+from typing import Union
+
+from django.conf import settings
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+RESULTS_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# The type, help and buckets of each metric
+METRICS = {
+    "ecoliste_request_duration_seconds": (
+        "histogram",
+        "Duration of the requests, per view.",
+        DURATION_BUCKETS,
+    ),
+    "ecoliste_search_duration_seconds": (
+        "histogram",
+        "Duration of the pages of searches run on the database, per combination of filters.",
+        DURATION_BUCKETS,
+    ),
+    "ecoliste_search_results": (
+        "histogram",
+        "Number of addresses of the pages of searches run on the database, per combination of filters.",
+        RESULTS_BUCKETS,
+    ),
+    "ecoliste_cache_lookups_total": (
+        "counter",
+        "Lookups in the caches of the application, per cache and result.",
+        None,
+    ),
+}
+
+# The seconds between two writes of the metrics of a process
+FLUSH_INTERVAL = 5
+
+_samples: dict[str, Union[float, dict]] = {}
+_lock = threading.Lock()
+_last_flush = 0.0
+_file = None
+# The pending write of the changes made since the last one
+_timer = None
+
+
+def sample_key(name: str, labels: dict) -> str:
+    return json.dumps([name, sorted(labels.items())])
+
+
+def inc(name: str, labels: dict, value: float = 1) -> None:
+    """
+    Increments a counter.
+    """
+    key = sample_key(name, labels)
+    with _lock:
+        _samples[key] = _samples.get(key, 0) + value
+    flush()
+
+
+def observe(name: str, labels: dict, value: float) -> None:
+    """
+    Adds a value to a histogram.
+    """
+    buckets = METRICS[name][2]
+    key = sample_key(name, labels)
+    with _lock:
+        sample = _samples.setdefault(
+            key, {"buckets": [0] * (len(buckets) + 1), "sum": 0, "count": 0}
+        )
+        # The first bucket whose bound is at least the value, the last one being +Inf
+        sample["buckets"][bisect_left(buckets, value)] += 1
+        sample["sum"] += value
+        sample["count"] += 1
+    flush()
+
+
+def process_file() -> Path:
+    """
+    The file of the metrics of this process, unique even if the process id is reused.
+    """
+    global _file
+    if _file is None or _file[0] != os.getpid():
+        _file = (os.getpid(), "{}-{}.json".format(os.getpid(), uuid.uuid4().hex))
+    return Path(settings.ECOLISTE_METRICS_DIR, _file[1])
+
+
+def flush(force: bool = False) -> None:
+    """
+    Writes the metrics of this process to ECOLISTE_METRICS_DIR, if they weren't written recently.
+    """
+    global _last_flush, _timer
+    if not settings.ECOLISTE_METRICS_DIR:
+        return
+    with _lock:
+        now = time.monotonic()
+        if not force and now - _last_flush < FLUSH_INTERVAL:
+            # Written once the interval is over, even without any other change until then
+            if _timer is None:
+                _timer = threading.Timer(
+                    _last_flush + FLUSH_INTERVAL - now, deferred_flush
+                )
+                _timer.daemon = True
+                _timer.start()
+            return
+        _last_flush = now
+        data = json.dumps(_samples)
+    path = process_file()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written aside and renamed, so the metrics view never reads half a file
+    with tempfile.NamedTemporaryFile(
+        "w", dir=path.parent, suffix=".tmp", delete=False
+    ) as file:
+        file.write(data)
+    os.replace(file.name, path)
+
+
+def deferred_flush() -> None:
+    forget_timer()
+    flush(force=True)
+
+
+def forget_timer() -> None:
+    global _timer
+    with _lock:
+        _timer = None
+
+
+atexit.register(flush, force=True)
+# The timer of the parent process doesn't run in the forked workers
+os.register_at_fork(after_in_child=forget_timer)
+
+
+def merge(total: dict, samples: dict) -> None:
+    for key, value in samples.items():
+        if isinstance(value, dict):
+            merged = total.setdefault(
+                key, {"buckets": [0] * len(value["buckets"]), "sum": 0, "count": 0}
+            )
+            merged["buckets"] = [
+                a + b for a, b in zip(merged["buckets"], value["buckets"])
+            ]
+            merged["sum"] += value["sum"]
+            merged["count"] += value["count"]
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+def collect() -> dict[str, Union[float, dict]]:
+    """
+    The metrics of all the processes.
+    :return: The value of each sample, by sample key.
+    """
+    total = {}
+    if not settings.ECOLISTE_METRICS_DIR:
+        with _lock:
+            merge(total, _samples)
+        return total
+    flush(force=True)
+    for path in Path(settings.ECOLISTE_METRICS_DIR).glob("*.json"):
+        try:
+            merge(total, json.loads(path.read_text()))
+        except (OSError, ValueError):
+            # Removed meanwhile
+            continue
+    return total
+
+
+def format_labels(labels: list) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def render() -> str:
+    """
+    The metrics of all the processes, in the Prometheus text format.
+    """
+    by_name = {}
+    for key, value in collect().items():
+        name, labels = json.loads(key)
+        by_name.setdefault(name, []).append((labels, value))
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for labels, value in sorted(
+            by_name.get(name, []), key=lambda sample: sample[0]
+        ):
+            if kind == "counter":
+                lines.append("{}{} {}".format(name, format_labels(labels), value))
+                continue
+            cumulated = 0
+            for bound, count in zip([*buckets, "+Inf"], value["buckets"]):
+                cumulated += count
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        name, format_labels([*labels, ("le", bound)]), cumulated
+                    )
+                )
+            lines.append(
+                "{}_sum{} {}".format(name, format_labels(labels), value["sum"])
+            )
+            lines.append(
+                "{}_count{} {}".format(name, format_labels(labels), value["count"])
+            )
+    lines.extend(cache_ratios(by_name.get("ecoliste_cache_lookups_total", [])))
+    return "\n".join(lines) + "\n"
+
+
+def cache_ratios(lookups: list) -> list[str]:
+    """
+    The share of the lookups of each cache which found the data, from the lookups counters.
+    """
+    counts = {}
+    for labels, value in lookups:
+        labels = dict(labels)
+        cache = counts.setdefault(labels["cache"], {"hit": 0, "miss": 0})
+        cache[labels["result"]] += value
+    lines = [
+        "# HELP ecoliste_cache_hit_ratio Share of the lookups of each cache which found the data.",
+        "# TYPE ecoliste_cache_hit_ratio gauge",
+    ]
+    for cache, count in sorted(counts.items()):
+        lookups_count = count["hit"] + count["miss"]
+        if lookups_count:
+            lines.append(
+                "ecoliste_cache_hit_ratio{} {}".format(
+                    format_labels([("cache", cache)]), count["hit"] / lookups_count
+                )
+            )
+    return lines
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+from . import instrumentation, replicas
+from .metrics import observe
+
+logger = logging.getLogger("ecoliste.timing")
+
+
+def server_timing(metrics: Counter, total: float) -> str:
+    """
+    The Server-Timing header of a request, with durations in milliseconds.
+    """
+    hits = sum(value for key, value in metrics.items() if key.endswith(" hit"))
+    misses = sum(value for key, value in metrics.items() if key.endswith(" miss"))
+    return ", ".join(
+        [
+            'sql;dur={:.1f};desc="{} queries"'.format(
+                metrics["sql"] * 1000, metrics["queries"]
+            ),
+            "tpl;dur={:.1f}".format(metrics["templates"] * 1000),
+            'cache;desc="{} hits, {} misses"'.format(hits, misses),
+            "total;dur={:.1f}".format(total * 1000),
+        ]
+    )
+
+
+class AsyncCapableMiddleware:
+    """
+    A middleware running in the mode of the handler, as Django's MiddlewareMixin: under ASGI, the async views are then
+    called without a thread. The subclasses implement __call__, handing the request to their __acall__ when is_async.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Makes the middleware itself a coroutine function for Django, as MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+
+class ServerTimingMiddleware(AsyncCapableMiddleware):
+    """
+    Measures a sample of the requests, see ECOLISTE_TIMING_SAMPLE_RATE: their queries, SQL time, template rendering
+    time and cache lookups. They are sent in a Server-Timing header, shown by the developer tools of the browsers, and
+    the requests slower than ECOLISTE_TIMING_LOG_THRESHOLD are logged with them, as JSON.
+
+    Unlike the debug toolbar, nothing but a few counters is kept, so it can run in production.
+    """
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self.is_async:
+            return self.__acall__(request)
+        if random.random() >= settings.ECOLISTE_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+        start = time.perf_counter()
+        with instrumentation.measure() as metrics:
+            response = self.get_response(request)
+        return self.timed(request, response, metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        if random.random() >= settings.ECOLISTE_TIMING_SAMPLE_RATE:
+            return await self.get_response(request)
+        start = time.perf_counter()
+        with instrumentation.measure() as metrics:
+            response = await self.get_response(request)
+        return self.timed(request, response, metrics, time.perf_counter() - start)
+
+    @staticmethod
+    def timed(
+        request: HttpRequest, response: HttpResponse, metrics: Counter, total: float
+    ) -> HttpResponse:
+        response["Server-Timing"] = server_timing(metrics, total)
+        if total * 1000 >= settings.ECOLISTE_TIMING_LOG_THRESHOLD:
+            logger.info(
+                json.dumps(
+                    {
+                        "method": request.method,
+                        "path": request.path,
+                        "status": response.status_code,
+                        "total_ms": round(total * 1000, 1),
+                        "sql_ms": round(metrics.pop("sql", 0) * 1000, 1),
+                        "queries": metrics.pop("queries", 0),
+                        "templates_ms": round(metrics.pop("templates", 0) * 1000, 1),
+                        # The lookups of each cache
+                        **metrics,
+                    }
+                )
+            )
+        return response
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """
+    Records the duration of the requests in the metrics, labelled by the name of their view.
+    """
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def observe(request: HttpRequest, duration: float) -> None:
+        match = request.resolver_match
+        observe(
+            "ecoliste_request_duration_seconds",
+            {"view": (match.view_name or "unnamed") if match else "unresolved"},
+            duration,
+        )
+
+
+class ReplicaMiddleware(AsyncCapableMiddleware):
+    """
+    Sends the reads of a user to the primary database for ECOLISTE_REPLICA_STICKINESS seconds after they changed some
+    data, with a cookie, so they see their changes even if the replicas don't have them yet.
+    """
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self.is_async:
+            return self.__acall__(request)
+        with replicas.tracked(replicas.STICKY_COOKIE in request.COOKIES) as state:
+            response = self.get_response(request)
+        return self.stick(response, state)
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        with replicas.tracked(replicas.STICKY_COOKIE in request.COOKIES) as state:
+            response = await self.get_response(request)
+        return self.stick(response, state)
+
+    @staticmethod
+    def stick(response: HttpResponse, state: dict) -> HttpResponse:
+        if state["wrote"] and settings.ECOLISTE_REPLICAS:
+            response.set_cookie(
+                replicas.STICKY_COOKIE,
+                "1",
+                max_age=settings.ECOLISTE_REPLICA_STICKINESS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
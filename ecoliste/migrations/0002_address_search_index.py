@@ -0,0 +1,167 @@
+# Generated by Django 4.0 on 2026-10-17 00:35
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Fills the index with the existing addresses, as ecoliste.search_index.REBUILD_SQL when it was written
+POPULATE_SQL = """
+INSERT INTO ecoliste_addresssearchindex (
+    address_id, enterprise_id, geolocation, is_production, materials, origins, biobased, annual_sales, n_employees
+)
+SELECT
+    address.id,
+    address.enterprise_id,
+    address.geolocation,
+    address.is_production,
+    COALESCE(products.materials, '{}'),
+    COALESCE(products.origins, '{}'),
+    COALESCE(biobased.biobased, '{}'),
+    enterprise.annual_sales,
+    enterprise.n_employees
+FROM ecoliste_address address
+INNER JOIN ecoliste_enterprise enterprise ON enterprise.id = address.enterprise_id
+LEFT JOIN (
+    SELECT enterprise_id, array_agg(DISTINCT type_id) AS materials, array_agg(DISTINCT origin) AS origins
+    FROM ecoliste_materialbyenterprise
+    GROUP BY enterprise_id
+) products ON products.enterprise_id = address.enterprise_id
+LEFT JOIN (
+    SELECT product.enterprise_id, array_agg(DISTINCT link.biobasedoriginmaterial_id) AS biobased
+    FROM ecoliste_materialbyenterprise product
+    INNER JOIN ecoliste_materialbyenterprise_biobased_material link ON link.materialbyenterprise_id = product.id
+    GROUP BY product.enterprise_id
+) biobased ON biobased.enterprise_id = address.enterprise_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ecoliste", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AddressSearchIndex",
+            fields=[
+                (
+                    "address",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="search_index",
+                        serialize=False,
+                        to="ecoliste.address",
+                        verbose_name="Adresse",
+                    ),
+                ),
+                (
+                    "geolocation",
+                    django.contrib.gis.db.models.fields.PointField(
+                        geography=True, srid=4326, verbose_name="Coordonnées"
+                    ),
+                ),
+                (
+                    "is_production",
+                    models.BooleanField(
+                        db_index=True, verbose_name="Est un lieu de production"
+                    ),
+                ),
+                (
+                    "materials",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.BigIntegerField(),
+                        default=list,
+                        size=None,
+                        verbose_name="Typologies",
+                    ),
+                ),
+                (
+                    "origins",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.PositiveSmallIntegerField(),
+                        default=list,
+                        size=None,
+                        verbose_name="Origines",
+                    ),
+                ),
+                (
+                    "biobased",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.BigIntegerField(),
+                        default=list,
+                        size=None,
+                        verbose_name="Matériaux biosourcés",
+                    ),
+                ),
+                (
+                    "annual_sales",
+                    models.PositiveIntegerField(
+                        choices=[
+                            (1, "< 2 millions €"),
+                            (2, "2 à 10 millions €"),
+                            (3, "10 à 50 millions €"),
+                            (4, "50 à 200 millions €"),
+                            (5, "200 à 1500 millions €"),
+                            (6, "> 1500 millions €"),
+                        ],
+                        db_index=True,
+                        null=True,
+                        verbose_name="Chiffre d'affaires",
+                    ),
+                ),
+                (
+                    "n_employees",
+                    models.PositiveIntegerField(
+                        choices=[
+                            (1, "1"),
+                            (2, "2 - 9"),
+                            (10, "10 - 49"),
+                            (50, "50 - 249"),
+                            (250, "250 - 999"),
+                            (1000, "1000 - 4999"),
+                            (5000, "5000+"),
+                        ],
+                        db_index=True,
+                        null=True,
+                        verbose_name="Nombre d'employés",
+                    ),
+                ),
+                (
+                    "enterprise",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="ecoliste.enterprise",
+                        verbose_name="Entreprise",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Index de recherche",
+                "verbose_name_plural": "Index de recherche",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="addresssearchindex",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["materials"], name="ecoliste_ad_materia_f09786_gin"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="addresssearchindex",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["origins"], name="ecoliste_ad_origins_4b3b26_gin"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="addresssearchindex",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["biobased"], name="ecoliste_ad_biobase_1704cd_gin"
+            ),
+        ),
+        migrations.RunSQL(POPULATE_SQL, migrations.RunSQL.noop),
+    ]
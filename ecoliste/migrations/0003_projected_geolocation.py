@@ -0,0 +1,42 @@
+# Generated by Django 4.0 on 2026-10-17 00:37
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ecoliste", "0002_address_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="address",
+            name="geolocation_projected",
+            field=django.contrib.gis.db.models.fields.PointField(
+                editable=False,
+                null=True,
+                srid=2154,
+                verbose_name="Coordonnées projetées",
+            ),
+        ),
+        migrations.AddField(
+            model_name="addresssearchindex",
+            name="geolocation_projected",
+            field=django.contrib.gis.db.models.fields.PointField(
+                null=True, srid=2154, verbose_name="Coordonnées projetées"
+            ),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE ecoliste_address
+            SET geolocation_projected = ST_Transform(geolocation::geometry, 2154);
+            UPDATE ecoliste_addresssearchindex search_index
+            SET geolocation_projected = address.geolocation_projected
+            FROM ecoliste_address address
+            WHERE address.id = search_index.address_id;
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
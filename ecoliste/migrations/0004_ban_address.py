@@ -0,0 +1,99 @@
+# Generated by Django 4.0 on 2026-10-17 00:50
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ecoliste", "0003_projected_geolocation"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name="BanAddress",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "ban_id",
+                    models.CharField(
+                        max_length=64, unique=True, verbose_name="Identifiant BAN"
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("housenumber", "Adresse"),
+                            ("municipality", "Commune"),
+                        ],
+                        max_length=12,
+                        verbose_name="Type",
+                    ),
+                ),
+                ("label", models.CharField(max_length=250, verbose_name="Libellé")),
+                (
+                    "postcode",
+                    models.CharField(
+                        blank=True, max_length=5, verbose_name="Code postal"
+                    ),
+                ),
+                (
+                    "citycode",
+                    models.CharField(
+                        db_index=True, max_length=5, verbose_name="Code INSEE"
+                    ),
+                ),
+                ("city", models.CharField(max_length=100, verbose_name="Commune")),
+                (
+                    "normalized",
+                    models.CharField(max_length=250, verbose_name="Libellé normalisé"),
+                ),
+                (
+                    "tokens",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.CharField(max_length=100),
+                        size=None,
+                        verbose_name="Mots",
+                    ),
+                ),
+                (
+                    "geolocation",
+                    django.contrib.gis.db.models.fields.PointField(
+                        geography=True, srid=4326, verbose_name="Coordonnées"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Adresse BAN",
+                "verbose_name_plural": "Adresses BAN",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="banaddress",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["normalized"],
+                name="ecoliste_ban_normalized_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="banaddress",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["tokens"], name="ecoliste_ban_tokens"
+            ),
+        ),
+    ]
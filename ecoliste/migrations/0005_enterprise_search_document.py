@@ -0,0 +1,152 @@
+# Generated by Django 4.0 on 2026-10-17 00:53
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The document of an enterprise: its name first, then the names of its materials, then its description
+TRIGGERS_SQL = """
+CREATE FUNCTION ecoliste_enterprise_document(name text, description text, enterprise_id bigint)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+SELECT
+    setweight(to_tsvector('french', coalesce(name, '')), 'A')
+    || setweight(to_tsvector('french', coalesce((
+        SELECT string_agg(DISTINCT material_type.name, ' ')
+        FROM ecoliste_materialbyenterprise product
+        INNER JOIN ecoliste_materialtype material_type ON material_type.id = product.type_id
+        WHERE product.enterprise_id = ecoliste_enterprise_document.enterprise_id
+    ), '')), 'B')
+    || setweight(to_tsvector('french', coalesce((
+        SELECT string_agg(DISTINCT biobased.name, ' ')
+        FROM ecoliste_materialbyenterprise product
+        INNER JOIN ecoliste_materialbyenterprise_biobased_material link ON link.materialbyenterprise_id = product.id
+        INNER JOIN ecoliste_biobasedoriginmaterial biobased ON biobased.id = link.biobasedoriginmaterial_id
+        WHERE product.enterprise_id = ecoliste_enterprise_document.enterprise_id
+    ), '')), 'B')
+    || setweight(to_tsvector('french', coalesce(description, '')), 'C')
+$$;
+
+CREATE FUNCTION ecoliste_refresh_enterprise_documents(enterprise_ids bigint[])
+RETURNS void LANGUAGE sql AS $$
+UPDATE ecoliste_enterprise
+SET search_document = ecoliste_enterprise_document(name, description, id)
+WHERE id = ANY(enterprise_ids)
+$$;
+
+CREATE FUNCTION ecoliste_enterprise_document_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_document := ecoliste_enterprise_document(NEW.name, NEW.description, NEW.id);
+    RETURN NEW;
+END
+$$;
+
+-- Only when the name or description are written, so the refresh of the document doesn't trigger it again
+CREATE TRIGGER ecoliste_enterprise_document
+BEFORE INSERT OR UPDATE OF name, description ON ecoliste_enterprise
+FOR EACH ROW EXECUTE FUNCTION ecoliste_enterprise_document_trigger();
+
+CREATE FUNCTION ecoliste_product_document_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM ecoliste_refresh_enterprise_documents(ARRAY[OLD.enterprise_id]);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM ecoliste_refresh_enterprise_documents(ARRAY[NEW.enterprise_id]);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_product_document
+AFTER INSERT OR UPDATE OF enterprise_id, type_id OR DELETE ON ecoliste_materialbyenterprise
+FOR EACH ROW EXECUTE FUNCTION ecoliste_product_document_trigger();
+
+CREATE FUNCTION ecoliste_product_biobased_document_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    product_id bigint := CASE WHEN TG_OP = 'DELETE' THEN OLD.materialbyenterprise_id
+                              ELSE NEW.materialbyenterprise_id END;
+BEGIN
+    PERFORM ecoliste_refresh_enterprise_documents(
+        ARRAY(SELECT enterprise_id FROM ecoliste_materialbyenterprise WHERE id = product_id)
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_product_biobased_document
+AFTER INSERT OR DELETE ON ecoliste_materialbyenterprise_biobased_material
+FOR EACH ROW EXECUTE FUNCTION ecoliste_product_biobased_document_trigger();
+
+CREATE FUNCTION ecoliste_material_type_document_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM ecoliste_refresh_enterprise_documents(
+        ARRAY(SELECT DISTINCT enterprise_id FROM ecoliste_materialbyenterprise WHERE type_id = NEW.id)
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_material_type_document
+AFTER UPDATE OF name ON ecoliste_materialtype
+FOR EACH ROW EXECUTE FUNCTION ecoliste_material_type_document_trigger();
+
+CREATE FUNCTION ecoliste_biobased_document_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM ecoliste_refresh_enterprise_documents(
+        ARRAY(
+            SELECT DISTINCT product.enterprise_id
+            FROM ecoliste_materialbyenterprise product
+            INNER JOIN ecoliste_materialbyenterprise_biobased_material link
+                ON link.materialbyenterprise_id = product.id
+            WHERE link.biobasedoriginmaterial_id = NEW.id
+        )
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_biobased_document
+AFTER UPDATE OF name ON ecoliste_biobasedoriginmaterial
+FOR EACH ROW EXECUTE FUNCTION ecoliste_biobased_document_trigger();
+
+UPDATE ecoliste_enterprise SET search_document = ecoliste_enterprise_document(name, description, id);
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER ecoliste_biobased_document ON ecoliste_biobasedoriginmaterial;
+DROP TRIGGER ecoliste_material_type_document ON ecoliste_materialtype;
+DROP TRIGGER ecoliste_product_biobased_document ON ecoliste_materialbyenterprise_biobased_material;
+DROP TRIGGER ecoliste_product_document ON ecoliste_materialbyenterprise;
+DROP TRIGGER ecoliste_enterprise_document ON ecoliste_enterprise;
+DROP FUNCTION ecoliste_biobased_document_trigger();
+DROP FUNCTION ecoliste_material_type_document_trigger();
+DROP FUNCTION ecoliste_product_biobased_document_trigger();
+DROP FUNCTION ecoliste_product_document_trigger();
+DROP FUNCTION ecoliste_enterprise_document_trigger();
+DROP FUNCTION ecoliste_refresh_enterprise_documents(bigint[]);
+DROP FUNCTION ecoliste_enterprise_document(text, text, bigint);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ecoliste", "0004_ban_address"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="enterprise",
+            name="search_document",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="Document de recherche"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="enterprise",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_document"], name="ecoliste_en_search__2ff46c_gin"
+            ),
+        ),
+        migrations.RunSQL(TRIGGERS_SQL, DROP_TRIGGERS_SQL),
+    ]
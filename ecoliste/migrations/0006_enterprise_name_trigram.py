@@ -0,0 +1,35 @@
+# Generated by Django 4.0 on 2026-10-17 00:55
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import UnaccentExtension
+from django.db import migrations
+import ecoliste.models
+
+# unaccent can't be indexed as it depends on the search_path, but this function always uses the same dictionary
+UNACCENT_SQL = """
+CREATE FUNCTION ecoliste_unaccent(text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS $$
+SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+$$
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ecoliste", "0005_enterprise_search_document"),
+    ]
+
+    operations = [
+        UnaccentExtension(),
+        migrations.RunSQL(UNACCENT_SQL, "DROP FUNCTION ecoliste_unaccent(text)"),
+        migrations.AddIndex(
+            model_name="enterprise",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    ecoliste.models.Unaccent("name"), name="gin_trgm_ops"
+                ),
+                name="ecoliste_enterprise_name_trgm",
+            ),
+        ),
+    ]
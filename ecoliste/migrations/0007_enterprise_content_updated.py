@@ -0,0 +1,162 @@
+# Generated by Django 4.0 on 2026-10-17 00:59
+
+from django.db import migrations, models
+
+# The date of the last change of an enterprise or of anything shown on its page. It is the start of the transaction
+# making the change, so an enterprise changed many times by the same transaction is only updated once.
+TRIGGERS_SQL = """
+CREATE FUNCTION ecoliste_touch_enterprises(enterprise_ids bigint[])
+RETURNS void LANGUAGE sql AS $$
+UPDATE ecoliste_enterprise
+SET content_updated = now()
+WHERE id = ANY(enterprise_ids) AND content_updated IS DISTINCT FROM now()
+$$;
+
+CREATE FUNCTION ecoliste_enterprise_modified_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.content_updated := now();
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER ecoliste_enterprise_modified
+BEFORE INSERT OR UPDATE ON ecoliste_enterprise
+FOR EACH ROW EXECUTE FUNCTION ecoliste_enterprise_modified_trigger();
+
+-- The addresses, contacts and products of an enterprise
+CREATE FUNCTION ecoliste_enterprise_part_modified_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM ecoliste_touch_enterprises(ARRAY[OLD.enterprise_id]);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM ecoliste_touch_enterprises(ARRAY[NEW.enterprise_id]);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_address_modified
+AFTER INSERT OR UPDATE OR DELETE ON ecoliste_address
+FOR EACH ROW EXECUTE FUNCTION ecoliste_enterprise_part_modified_trigger();
+
+CREATE TRIGGER ecoliste_contact_modified
+AFTER INSERT OR UPDATE OR DELETE ON ecoliste_contact
+FOR EACH ROW EXECUTE FUNCTION ecoliste_enterprise_part_modified_trigger();
+
+CREATE TRIGGER ecoliste_product_modified
+AFTER INSERT OR UPDATE OR DELETE ON ecoliste_materialbyenterprise
+FOR EACH ROW EXECUTE FUNCTION ecoliste_enterprise_part_modified_trigger();
+
+-- The links of the products to their addresses and biobased materials
+CREATE FUNCTION ecoliste_product_link_modified_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    product_id bigint := CASE WHEN TG_OP = 'DELETE' THEN OLD.materialbyenterprise_id
+                              ELSE NEW.materialbyenterprise_id END;
+BEGIN
+    PERFORM ecoliste_touch_enterprises(
+        ARRAY(SELECT enterprise_id FROM ecoliste_materialbyenterprise WHERE id = product_id)
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_product_address_modified
+AFTER INSERT OR DELETE ON ecoliste_materialbyenterprise_address
+FOR EACH ROW EXECUTE FUNCTION ecoliste_product_link_modified_trigger();
+
+CREATE TRIGGER ecoliste_product_biobased_modified
+AFTER INSERT OR DELETE ON ecoliste_materialbyenterprise_biobased_material
+FOR EACH ROW EXECUTE FUNCTION ecoliste_product_link_modified_trigger();
+
+-- The names and order of the material types, their categories and the biobased materials, shown with the products.
+-- Their deletion deletes or updates the products and links, which have their own triggers.
+CREATE FUNCTION ecoliste_material_type_modified_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM ecoliste_touch_enterprises(
+        ARRAY(SELECT DISTINCT enterprise_id FROM ecoliste_materialbyenterprise WHERE type_id = NEW.id)
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_material_type_modified
+AFTER UPDATE ON ecoliste_materialtype
+FOR EACH ROW EXECUTE FUNCTION ecoliste_material_type_modified_trigger();
+
+CREATE FUNCTION ecoliste_material_category_modified_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM ecoliste_touch_enterprises(
+        ARRAY(
+            SELECT DISTINCT product.enterprise_id
+            FROM ecoliste_materialbyenterprise product
+            INNER JOIN ecoliste_materialtype material_type ON material_type.id = product.type_id
+            WHERE material_type.category_id = NEW.id
+        )
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_material_category_modified
+AFTER UPDATE ON ecoliste_materialtypecategory
+FOR EACH ROW EXECUTE FUNCTION ecoliste_material_category_modified_trigger();
+
+CREATE FUNCTION ecoliste_biobased_modified_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM ecoliste_touch_enterprises(
+        ARRAY(
+            SELECT DISTINCT product.enterprise_id
+            FROM ecoliste_materialbyenterprise product
+            INNER JOIN ecoliste_materialbyenterprise_biobased_material link
+                ON link.materialbyenterprise_id = product.id
+            WHERE link.biobasedoriginmaterial_id = NEW.id
+        )
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_biobased_modified
+AFTER UPDATE ON ecoliste_biobasedoriginmaterial
+FOR EACH ROW EXECUTE FUNCTION ecoliste_biobased_modified_trigger();
+
+UPDATE ecoliste_enterprise SET content_updated = now();
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER ecoliste_biobased_modified ON ecoliste_biobasedoriginmaterial;
+DROP TRIGGER ecoliste_material_category_modified ON ecoliste_materialtypecategory;
+DROP TRIGGER ecoliste_material_type_modified ON ecoliste_materialtype;
+DROP TRIGGER ecoliste_product_biobased_modified ON ecoliste_materialbyenterprise_biobased_material;
+DROP TRIGGER ecoliste_product_address_modified ON ecoliste_materialbyenterprise_address;
+DROP TRIGGER ecoliste_product_modified ON ecoliste_materialbyenterprise;
+DROP TRIGGER ecoliste_contact_modified ON ecoliste_contact;
+DROP TRIGGER ecoliste_address_modified ON ecoliste_address;
+DROP TRIGGER ecoliste_enterprise_modified ON ecoliste_enterprise;
+DROP FUNCTION ecoliste_biobased_modified_trigger();
+DROP FUNCTION ecoliste_material_category_modified_trigger();
+DROP FUNCTION ecoliste_material_type_modified_trigger();
+DROP FUNCTION ecoliste_product_link_modified_trigger();
+DROP FUNCTION ecoliste_enterprise_part_modified_trigger();
+DROP FUNCTION ecoliste_enterprise_modified_trigger();
+DROP FUNCTION ecoliste_touch_enterprises(bigint[]);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ecoliste", "0006_enterprise_name_trigram"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="enterprise",
+            name="content_updated",
+            field=models.DateTimeField(
+                editable=False, null=True, verbose_name="Contenu modifié le"
+            ),
+        ),
+        migrations.RunSQL(TRIGGERS_SQL, DROP_TRIGGERS_SQL),
+    ]
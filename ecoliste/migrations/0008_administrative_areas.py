@@ -0,0 +1,101 @@
+# Generated by Django 4.0 on 2026-10-17 01:23
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ecoliste", "0007_enterprise_content_updated"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AdministrativeArea",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("region", "Région"),
+                            ("departement", "Département"),
+                            ("commune", "Commune"),
+                        ],
+                        max_length=12,
+                        verbose_name="Type",
+                    ),
+                ),
+                ("code", models.CharField(max_length=5, verbose_name="Code INSEE")),
+                ("name", models.CharField(max_length=100, verbose_name="Nom")),
+                (
+                    "departement",
+                    models.CharField(
+                        blank=True, max_length=3, verbose_name="Département"
+                    ),
+                ),
+                (
+                    "region",
+                    models.CharField(blank=True, max_length=3, verbose_name="Région"),
+                ),
+                (
+                    "geometry",
+                    django.contrib.gis.db.models.fields.MultiPolygonField(
+                        srid=4326, verbose_name="Contour"
+                    ),
+                ),
+                (
+                    "geometry_medium",
+                    django.contrib.gis.db.models.fields.MultiPolygonField(
+                        null=True, srid=4326, verbose_name="Contour simplifié"
+                    ),
+                ),
+                (
+                    "geometry_low",
+                    django.contrib.gis.db.models.fields.MultiPolygonField(
+                        null=True, srid=4326, verbose_name="Contour très simplifié"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Zone administrative",
+                "verbose_name_plural": "Zones administratives",
+            },
+        ),
+        migrations.AddField(
+            model_name="addresssearchindex",
+            name="commune",
+            field=models.CharField(
+                db_index=True, max_length=5, null=True, verbose_name="Commune"
+            ),
+        ),
+        migrations.AddField(
+            model_name="addresssearchindex",
+            name="departement",
+            field=models.CharField(
+                db_index=True, max_length=3, null=True, verbose_name="Département"
+            ),
+        ),
+        migrations.AddField(
+            model_name="addresssearchindex",
+            name="region",
+            field=models.CharField(
+                db_index=True, max_length=3, null=True, verbose_name="Région"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="administrativearea",
+            constraint=models.UniqueConstraint(
+                fields=("kind", "code"), name="ecoliste_administrativearea_kind_code"
+            ),
+        ),
+    ]
@@ -0,0 +1,176 @@
+# Generated by Django 4.0 on 2026-10-17 01:24
+
+from django.db import migrations, models
+
+# The summary of the materials of an enterprise: the names of their categories, in their display order, their origins,
+# and the names of their biobased materials. It is computed by a trigger whenever the material_summary column is
+# written, so the changes of the products only have to write it, and a save of the enterprise with a stale summary
+# computes it again.
+TRIGGERS_SQL = """
+CREATE FUNCTION ecoliste_enterprise_material_summary(enterprise_id bigint)
+RETURNS jsonb LANGUAGE sql STABLE AS $$
+SELECT jsonb_build_object(
+    'categories', coalesce((
+        SELECT jsonb_agg(category.name ORDER BY category."order", category.name)
+        FROM ecoliste_materialtypecategory category
+        WHERE category.id IN (
+            SELECT material_type.category_id
+            FROM ecoliste_materialbyenterprise product
+            INNER JOIN ecoliste_materialtype material_type ON material_type.id = product.type_id
+            WHERE product.enterprise_id = ecoliste_enterprise_material_summary.enterprise_id
+        )
+    ), '[]'),
+    'origins', coalesce((
+        SELECT jsonb_agg(DISTINCT product.origin ORDER BY product.origin)
+        FROM ecoliste_materialbyenterprise product
+        WHERE product.enterprise_id = ecoliste_enterprise_material_summary.enterprise_id
+    ), '[]'),
+    'biobased', coalesce((
+        SELECT jsonb_agg(DISTINCT biobased.name ORDER BY biobased.name)
+        FROM ecoliste_materialbyenterprise product
+        INNER JOIN ecoliste_materialbyenterprise_biobased_material link ON link.materialbyenterprise_id = product.id
+        INNER JOIN ecoliste_biobasedoriginmaterial biobased ON biobased.id = link.biobasedoriginmaterial_id
+        WHERE product.enterprise_id = ecoliste_enterprise_material_summary.enterprise_id
+    ), '[]')
+)
+$$;
+
+-- Computed again by ecoliste_enterprise_summary_trigger
+CREATE FUNCTION ecoliste_refresh_material_summaries(enterprise_ids bigint[])
+RETURNS void LANGUAGE sql AS $$
+UPDATE ecoliste_enterprise
+SET material_summary = NULL
+WHERE id = ANY(enterprise_ids)
+$$;
+
+CREATE FUNCTION ecoliste_enterprise_summary_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.material_summary := ecoliste_enterprise_material_summary(NEW.id);
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER ecoliste_enterprise_summary
+BEFORE INSERT OR UPDATE OF material_summary ON ecoliste_enterprise
+FOR EACH ROW EXECUTE FUNCTION ecoliste_enterprise_summary_trigger();
+
+CREATE FUNCTION ecoliste_product_summary_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM ecoliste_refresh_material_summaries(ARRAY[OLD.enterprise_id]);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM ecoliste_refresh_material_summaries(ARRAY[NEW.enterprise_id]);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_product_summary
+AFTER INSERT OR UPDATE OF enterprise_id, type_id, origin OR DELETE ON ecoliste_materialbyenterprise
+FOR EACH ROW EXECUTE FUNCTION ecoliste_product_summary_trigger();
+
+CREATE FUNCTION ecoliste_product_biobased_summary_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    product_id bigint := CASE WHEN TG_OP = 'DELETE' THEN OLD.materialbyenterprise_id
+                              ELSE NEW.materialbyenterprise_id END;
+BEGIN
+    PERFORM ecoliste_refresh_material_summaries(
+        ARRAY(SELECT enterprise_id FROM ecoliste_materialbyenterprise WHERE id = product_id)
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_product_biobased_summary
+AFTER INSERT OR DELETE ON ecoliste_materialbyenterprise_biobased_material
+FOR EACH ROW EXECUTE FUNCTION ecoliste_product_biobased_summary_trigger();
+
+-- The deletions of the categories set the category of their material types to NULL, handled here too
+CREATE FUNCTION ecoliste_material_type_summary_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM ecoliste_refresh_material_summaries(
+        ARRAY(SELECT DISTINCT enterprise_id FROM ecoliste_materialbyenterprise WHERE type_id = NEW.id)
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_material_type_summary
+AFTER UPDATE OF category_id ON ecoliste_materialtype
+FOR EACH ROW EXECUTE FUNCTION ecoliste_material_type_summary_trigger();
+
+CREATE FUNCTION ecoliste_material_category_summary_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM ecoliste_refresh_material_summaries(
+        ARRAY(
+            SELECT DISTINCT product.enterprise_id
+            FROM ecoliste_materialbyenterprise product
+            INNER JOIN ecoliste_materialtype material_type ON material_type.id = product.type_id
+            WHERE material_type.category_id = NEW.id
+        )
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_material_category_summary
+AFTER UPDATE OF name, "order" ON ecoliste_materialtypecategory
+FOR EACH ROW EXECUTE FUNCTION ecoliste_material_category_summary_trigger();
+
+CREATE FUNCTION ecoliste_biobased_summary_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM ecoliste_refresh_material_summaries(
+        ARRAY(
+            SELECT DISTINCT product.enterprise_id
+            FROM ecoliste_materialbyenterprise product
+            INNER JOIN ecoliste_materialbyenterprise_biobased_material link
+                ON link.materialbyenterprise_id = product.id
+            WHERE link.biobasedoriginmaterial_id = NEW.id
+        )
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER ecoliste_biobased_summary
+AFTER UPDATE OF name ON ecoliste_biobasedoriginmaterial
+FOR EACH ROW EXECUTE FUNCTION ecoliste_biobased_summary_trigger();
+
+UPDATE ecoliste_enterprise SET material_summary = NULL;
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER ecoliste_biobased_summary ON ecoliste_biobasedoriginmaterial;
+DROP TRIGGER ecoliste_material_category_summary ON ecoliste_materialtypecategory;
+DROP TRIGGER ecoliste_material_type_summary ON ecoliste_materialtype;
+DROP TRIGGER ecoliste_product_biobased_summary ON ecoliste_materialbyenterprise_biobased_material;
+DROP TRIGGER ecoliste_product_summary ON ecoliste_materialbyenterprise;
+DROP TRIGGER ecoliste_enterprise_summary ON ecoliste_enterprise;
+DROP FUNCTION ecoliste_biobased_summary_trigger();
+DROP FUNCTION ecoliste_material_category_summary_trigger();
+DROP FUNCTION ecoliste_material_type_summary_trigger();
+DROP FUNCTION ecoliste_product_biobased_summary_trigger();
+DROP FUNCTION ecoliste_product_summary_trigger();
+DROP FUNCTION ecoliste_enterprise_summary_trigger();
+DROP FUNCTION ecoliste_refresh_material_summaries(bigint[]);
+DROP FUNCTION ecoliste_enterprise_material_summary(bigint);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ecoliste", "0008_administrative_areas"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="enterprise",
+            name="material_summary",
+            field=models.JSONField(
+                editable=False, null=True, verbose_name="Résumé des matériaux"
+            ),
+        ),
+        migrations.RunSQL(TRIGGERS_SQL, DROP_TRIGGERS_SQL),
+    ]
@@ -1,11 +1,37 @@
-# We use the WGS84 spherical projection. It's easier to use, but performances might be impacted. It could be useful
-# to change to a local projection. It would need to specify a projection setting, so it's easily changeable,
-# and also to reproject the coordinates.
+# We use the WGS84 spherical projection. It's easier to use, but performances might be impacted. The addresses are
+# therefore also reprojected in the local projection of the ECOLISTE_PROJECTION_SRID setting, used by the search when
+# ECOLISTE_PROJECTED_SEARCH is enabled.
 
+from django.conf import settings
 from django.contrib.gis.db import models
+from django.contrib.gis.geos import Point
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.utils.translation import gettext_lazy as _
 
 
+class Unaccent(models.Func):
+    """
+    The text without its accents, with the immutable ecoliste_unaccent function of the 0006_enterprise_name_trigram
+    migration, which can be indexed unlike unaccent.
+    """
+
+    function = "ecoliste_unaccent"
+    output_field = models.TextField()
+
+
+def project(geolocation: Point) -> Point:
+    """
+    Reprojects WGS84 coordinates in the local projection.
+    :param geolocation: A WGS84 point, its SRID being optional.
+    :return: A new point, in the ECOLISTE_PROJECTION_SRID projection.
+    """
+    if not geolocation.srid:
+        geolocation = Point(geolocation.coords, srid=4326)
+    return geolocation.transform(settings.ECOLISTE_PROJECTION_SRID, clone=True)
+
+
 class Enterprise(models.Model):
     """
     An enterprise and its identity.
@@ -17,6 +43,13 @@ class Enterprise(models.Model):
         verbose_name = _("Entreprise")
         verbose_name_plural = _("Entreprises")
         ordering = ["name"]
+        indexes = [
+            GinIndex(fields=["search_document"]),
+            GinIndex(
+                OpClass(Unaccent("name"), name="gin_trgm_ops"),
+                name="ecoliste_enterprise_name_trgm",
+            ),
+        ]
 
     class NEmployees(models.IntegerChoices):
         INDIVIDUAL = 1, "1"
@@ -62,10 +95,40 @@ class Enterprise(models.Model):
     )
     added = models.DateField(_("Date d'ajout"), auto_now_add=True)
     updated = models.DateField(_("Date de mise à jour"), auto_now=True)
+    # The words of the enterprise and its materials for the full-text search, kept up to date by triggers in the
+    # database, whatever changes them
+    search_document = SearchVectorField(
+        _("Document de recherche"), null=True, editable=False
+    )
+    # The last change of the enterprise or of anything shown on its page, kept up to date by triggers in the database
+    content_updated = models.DateTimeField(
+        _("Contenu modifié le"), null=True, editable=False
+    )
+    # The names of the categories of the materials, their origins and the names of the biobased materials, shown in the
+    # listings without loading the products, kept up to date by triggers in the database, see material_overview
+    material_summary = models.JSONField(
+        _("Résumé des matériaux"), null=True, editable=False
+    )
 
     def __str__(self):
         return self.name
 
+    def material_overview(self) -> dict:
+        """
+        What the enterprise produces, for the listings, from its material_summary.
+        :return: A dictionary with the lists of the names of the material categories, the labels of the origins and
+        the names of the biobased materials.
+        """
+        summary = self.material_summary or {}
+        return {
+            "categories": summary.get("categories", []),
+            "origins": [
+                str(MaterialByEnterprise.MaterialOrigins(origin).label)
+                for origin in summary.get("origins", [])
+            ],
+            "biobased": summary.get("biobased", []),
+        }
+
 
 class Address(models.Model):
     """
@@ -90,10 +153,25 @@ class Address(models.Model):
         _("Coordonnées"), geography=True, null=False, spatial_index=True
     )
     is_production = models.BooleanField(_("Est un lieu de production"))
+    # Always computed from geolocation when saving
+    geolocation_projected = models.PointField(
+        _("Coordonnées projetées"),
+        srid=settings.ECOLISTE_PROJECTION_SRID,
+        null=True,
+        editable=False,
+        spatial_index=True,
+    )
 
     def __str__(self):
         return self.text_version
 
+    def save(self, *args, **kwargs):
+        self.geolocation_projected = project(self.geolocation)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "geolocation" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "geolocation_projected"}
+        super().save(*args, **kwargs)
+
 
 class MaterialTypeCategory(models.Model):
     """
@@ -251,3 +329,159 @@ class Contact(models.Model):
         return _("{firstname} {surname}").format(
             firstname=self.firstname, surname=self.surname
         )
+
+
+class AddressSearchIndex(models.Model):
+    """
+    A flattened copy of an address, with everything its enterprise produces, used by the search.
+
+    The search can then filter on all its parameters with only one table and its indexes, instead of joining the
+    products and their biobased materials. It is kept up to date by the signals in ecoliste.signals, and can be fully
+    rebuilt with the rebuild_search_index command.
+    """
+
+    class Meta:
+        verbose_name = _("Index de recherche")
+        verbose_name_plural = _("Index de recherche")
+        indexes = [
+            GinIndex(fields=["materials"]),
+            GinIndex(fields=["origins"]),
+            GinIndex(fields=["biobased"]),
+        ]
+
+    # The rows are removed by the signals, so they are never deleted before being recreated during a cascade deletion
+    address = models.OneToOneField(
+        Address,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        verbose_name=_("Adresse"),
+        related_name="search_index",
+    )
+    enterprise = models.ForeignKey(
+        Enterprise,
+        on_delete=models.DO_NOTHING,
+        verbose_name=_("Entreprise"),
+        related_name="+",
+        db_index=True,
+    )
+    geolocation = models.PointField(
+        _("Coordonnées"), geography=True, null=False, spatial_index=True
+    )
+    geolocation_projected = models.PointField(
+        _("Coordonnées projetées"),
+        srid=settings.ECOLISTE_PROJECTION_SRID,
+        null=True,
+        spatial_index=True,
+    )
+    is_production = models.BooleanField(_("Est un lieu de production"), db_index=True)
+    materials = ArrayField(
+        models.BigIntegerField(), verbose_name=_("Typologies"), default=list
+    )
+    origins = ArrayField(
+        models.PositiveSmallIntegerField(), verbose_name=_("Origines"), default=list
+    )
+    biobased = ArrayField(
+        models.BigIntegerField(), verbose_name=_("Matériaux biosourcés"), default=list
+    )
+    annual_sales = models.PositiveIntegerField(
+        _("Chiffre d'affaires"),
+        choices=Enterprise.AnnualSales.choices,
+        null=True,
+        db_index=True,
+    )
+    n_employees = models.PositiveIntegerField(
+        _("Nombre d'employés"),
+        choices=Enterprise.NEmployees.choices,
+        null=True,
+        db_index=True,
+    )
+    # The codes of the administrative areas of the address, from the commune containing it, see AdministrativeArea
+    commune = models.CharField(_("Commune"), max_length=5, null=True, db_index=True)
+    departement = models.CharField(
+        _("Département"), max_length=3, null=True, db_index=True
+    )
+    region = models.CharField(_("Région"), max_length=3, null=True, db_index=True)
+
+    def __str__(self):
+        return str(self.address_id)
+
+
+class BanAddress(models.Model):
+    """
+    An address or a commune of the Base Adresse Nationale, used by the local geocoder.
+
+    The table is filled by the import_ban command from the BAN CSV files. The text of each entry is also kept normalized,
+    lower case and without accents nor punctuation, for the trigram search, and split in tokens to find the house
+    numbers and postcodes.
+    """
+
+    class Meta:
+        verbose_name = _("Adresse BAN")
+        verbose_name_plural = _("Adresses BAN")
+        indexes = [
+            GinIndex(
+                fields=["normalized"],
+                name="ecoliste_ban_normalized_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+            GinIndex(fields=["tokens"], name="ecoliste_ban_tokens"),
+        ]
+
+    class Kinds(models.TextChoices):
+        HOUSENUMBER = "housenumber", _("Adresse")
+        MUNICIPALITY = "municipality", _("Commune")
+
+    ban_id = models.CharField(_("Identifiant BAN"), max_length=64, unique=True)
+    kind = models.CharField(_("Type"), max_length=12, choices=Kinds.choices)
+    label = models.CharField(_("Libellé"), max_length=250)
+    postcode = models.CharField(_("Code postal"), max_length=5, blank=True)
+    citycode = models.CharField(_("Code INSEE"), max_length=5, db_index=True)
+    city = models.CharField(_("Commune"), max_length=100)
+    normalized = models.CharField(_("Libellé normalisé"), max_length=250)
+    tokens = ArrayField(models.CharField(max_length=100), verbose_name=_("Mots"))
+    geolocation = models.PointField(_("Coordonnées"), geography=True, null=False)
+
+    def __str__(self):
+        return self.label
+
+
+class AdministrativeArea(models.Model):
+    """
+    The boundaries of a French région, département or commune, with their INSEE codes.
+
+    The table is filled by the import_boundaries command. The addresses are located in their commune when they are
+    indexed, so the search filters on the codes of AddressSearchIndex, without testing the polygons. The simplified
+    geometries are lighter to send and to draw on a map.
+    """
+
+    class Meta:
+        verbose_name = _("Zone administrative")
+        verbose_name_plural = _("Zones administratives")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "code"], name="ecoliste_administrativearea_kind_code"
+            )
+        ]
+
+    class Kinds(models.TextChoices):
+        REGION = "region", _("Région")
+        DEPARTEMENT = "departement", _("Département")
+        COMMUNE = "commune", _("Commune")
+
+    kind = models.CharField(_("Type"), max_length=12, choices=Kinds.choices)
+    code = models.CharField(_("Code INSEE"), max_length=5)
+    name = models.CharField(_("Nom"), max_length=100)
+    # The codes of the areas containing this one, blank for the régions
+    departement = models.CharField(_("Département"), max_length=3, blank=True)
+    region = models.CharField(_("Région"), max_length=3, blank=True)
+    geometry = models.MultiPolygonField(_("Contour"), srid=4326, spatial_index=True)
+    # Computed from geometry at each import, see ecoliste.boundaries.SIMPLIFICATION_TOLERANCES
+    geometry_medium = models.MultiPolygonField(
+        _("Contour simplifié"), srid=4326, null=True, spatial_index=True
+    )
+    geometry_low = models.MultiPolygonField(
+        _("Contour très simplifié"), srid=4326, null=True, spatial_index=True
+    )
+
+    def __str__(self):
+        return "{} ({})".format(self.name, self.code)
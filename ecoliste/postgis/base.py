@@ -0,0 +1,40 @@
+"""
+The PostGIS backend, with the CONN_HEALTH_CHECKS setting of Django 4.1.
+
+A persistent connection kept from a previous request is checked when the request first runs a query on it, and
+connected again if it was lost, instead of failing the request. The connections the request doesn't use aren't checked.
+"""
+
+from django.contrib.gis.db.backends.postgis import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_enabled = self.settings_dict.get("CONN_HEALTH_CHECKS", False)
+        self.health_check_done = False
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def close_if_health_check_failed(self) -> None:
+        if (
+            self.connection is None
+            or not self.health_check_enabled
+            or self.health_check_done
+        ):
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
+
+    def close_if_unusable_or_obsolete(self):
+        # Called at the start and at the end of each request: the connection is checked again by the next one
+        if self.connection is not None:
+            self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
@@ -0,0 +1,151 @@
+"""
+Sends the heaviest reads, searches, facets, maps, exports and enterprise pages, to the read replicas of the database.
+
+These reads choose their database with read_database: a replica of ECOLISTE_REPLICAS whose replication lag is under
+ECOLISTE_REPLICA_MAX_LAG, or the primary database when none is. The lag of each replica is checked at most every
+ECOLISTE_REPLICA_CHECK_INTERVAL seconds, and a replica which can't be reached is left aside until the next check. The
+other reads, as the admin's, and all the writes stay on the primary database, see ReplicaRouter.
+
+A user who changed some data reads it from the primary database for the next ECOLISTE_REPLICA_STICKINESS seconds,
+as the replicas may not have it yet, see the ReplicaMiddleware.
+
+The caches filled from these reads are invalidated a second time once the replicas have caught up, see on_commit.
+"""
+
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# The replication lag of the replicas, in seconds, with the time of their check, by alias
+lags: dict[str, tuple[float, float]] = {}
+
+# Whether the current request reads from the primary database, as its user changed some data recently, and whether it
+# wrote some data, set by the ReplicaMiddleware
+_request: ContextVar[Optional[dict]] = ContextVar(
+    "ecoliste_replica_request", default=None
+)
+
+# Set for ECOLISTE_REPLICA_STICKINESS seconds when a user changed some data
+STICKY_COOKIE = "ecoliste_primary"
+
+LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+
+@contextmanager
+def tracked(sticky: bool) -> Iterator[dict]:
+    """
+    Tracks the writes of the code run within the context: the current request.
+    :param sticky: Whether the request reads from the primary database, as its user changed some data recently.
+    :return: The state of the request, whose "wrote" member tells if it wrote some data.
+    """
+    request = {"sticky": sticky, "wrote": False}
+    token = _request.set(request)
+    try:
+        yield request
+    finally:
+        _request.reset(token)
+
+
+def replication_lag(alias: str) -> float:
+    """
+    The time since the last change replayed by a replica, or 0 if it has replayed all the changes it received.
+    :return: The lag in seconds, infinite if the replica can't be reached.
+    """
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            lag = cursor.fetchone()[0]
+    except DatabaseError:
+        logger.warning("The replica %s can't be reached.", alias, exc_info=True)
+        # Connected again at the next check
+        connections[alias].close()
+        return float("inf")
+    # Unknown until a change is replayed
+    return float("inf") if lag is None else float(lag)
+
+
+def usable(alias: str) -> bool:
+    """
+    Whether a replica is close enough to the primary database, from its last check.
+    """
+    checked, lag = lags.get(alias, (None, None))
+    now = time.monotonic()
+    if checked is None or now - checked >= settings.ECOLISTE_REPLICA_CHECK_INTERVAL:
+        lag = replication_lag(alias)
+        lags[alias] = (now, lag)
+    return lag <= settings.ECOLISTE_REPLICA_MAX_LAG
+
+
+def read_database() -> str:
+    """
+    The database of the heaviest reads: a usable replica, unless the current user changed some data recently.
+    :return: The alias of the database.
+    """
+    request = _request.get()
+    if request is not None and (request["sticky"] or request["wrote"]):
+        return DEFAULT_DB_ALIAS
+    replicas = [alias for alias in settings.ECOLISTE_REPLICAS if usable(alias)]
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+def on_commit(callback: Callable[[], None]) -> None:
+    """
+    Runs a callback once the current transaction is committed, and again once the replicas have caught up: a cache
+    filled from a replica in between would otherwise keep the previous data.
+    """
+
+    def run() -> None:
+        callback()
+        if settings.ECOLISTE_REPLICAS:
+            timer = threading.Timer(
+                settings.ECOLISTE_REPLICA_MAX_LAG
+                + settings.ECOLISTE_REPLICA_CHECK_INTERVAL,
+                callback,
+            )
+            timer.daemon = True
+            timer.start()
+
+    transaction.on_commit(run)
+
+
+class ReplicaRouter:
+    """
+    Keeps the writes on the primary database, and lets the other reads follow the database of their objects, the
+    primary one by default. The schema of the replicas comes from the primary database, so only it is migrated.
+    """
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        return None
+
+    def db_for_write(self, model, **hints) -> str:
+        request = _request.get()
+        # Only the data of the catalogue is read from the replicas: the sessions and the last logins of the users don't
+        # send their reads to the primary database
+        if request is not None and model._meta.app_label == "ecoliste":
+            request["wrote"] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> Optional[bool]:
+        databases = {DEFAULT_DB_ALIAS, *settings.ECOLISTE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db: str, app_label: str, **hints) -> Optional[bool]:
+        if db in settings.ECOLISTE_REPLICAS:
+            return False
+        return None
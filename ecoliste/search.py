@@ -0,0 +1,467 @@
+"""
+The search engine: finds the addresses around a location whose enterprises match the user filters.
+
+All the filters are checked on AddressSearchIndex, a flattened copy of the addresses carrying what their enterprises
+produce. A search is then a scan of this single table with its spatial and GIN indexes, and every address comes back at
+most once, instead of once per matching product when joining the products of the enterprises.
+"""
+
+import copy
+from collections import defaultdict
+from typing import Optional
+
+from django.conf import settings
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.db.models.functions import (
+    Distance,
+    GeometryDistance,
+    LineLocatePoint,
+)
+from django.contrib.gis.geos import GEOSGeometry, LineString, Point
+from django.contrib.gis.measure import D
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import (
+    BooleanField,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Q,
+    QuerySet,
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from django.http import QueryDict
+
+from .models import Address, AddressSearchIndex, Enterprise
+from .replicas import read_database
+
+# The filters with several values, and the ones with a (minimum, maximum) range
+LIST_FILTERS = ("materials", "origin", "biobased")
+RANGE_FILTERS = ("nemployees", "sales")
+# The filters on the INSEE codes of the administrative areas, strings such as "69" or "2A"
+AREA_FILTERS = ("region", "departement", "commune")
+
+# How much the distance lowers the relevance of a text search: by half at the search distance
+TEXT_DISTANCE_WEIGHT = 0.5
+
+# Used when the search location comes without any spatial reference, as the coordinates are then WGS84 ones.
+DEFAULT_SRID = 4326
+
+
+def located(search_location: GEOSGeometry) -> GEOSGeometry:
+    """
+    Makes sure the search location has a spatial reference, without modifying the given object.
+    :param search_location: A geolocation using a Point object from django.contrib.gis.geos, or a route using a
+    LineString.
+    :return: The same geometry, with a SRID.
+    """
+    if search_location.srid:
+        return search_location
+    search_location = search_location.clone()
+    search_location.srid = DEFAULT_SRID
+    return search_location
+
+
+def geolocation_field(projected: bool = None) -> str:
+    """
+    Chooses the coordinates used by the search: WGS84 ones, or planar ones in the local projection.
+    :param projected: Whether to use the projected coordinates, defaults to the ECOLISTE_PROJECTED_SEARCH setting.
+    :return: The path of the geolocation field from Address.
+    """
+    if projected is None:
+        projected = settings.ECOLISTE_PROJECTED_SEARCH
+    if projected:
+        return "search_index__geolocation_projected"
+    return "search_index__geolocation"
+
+
+def filter_addresses(addresses: QuerySet, filters: dict) -> QuerySet:
+    """
+    Applies the user filters to a queryset of addresses, through their search index rows.
+
+    The filters on products are checked independently: an address matches if its enterprise has a product of one of
+    the materials, and a product of one of the origins, which may be two different products.
+    :param addresses: The Address queryset to filter.
+    :param filters: The filters, as described in ecoliste_research.
+    :return: The filtered queryset.
+    """
+    if "materials" in filters.keys():
+        # This parameter needs to be passed as a list
+        addresses = addresses.filter(
+            search_index__materials__overlap=filters["materials"]
+        )
+    if "origin" in filters.keys():
+        # This parameter needs to be passed as a list
+        addresses = addresses.filter(search_index__origins__overlap=filters["origin"])
+    if "biobased" in filters.keys():
+        # This parameter needs to be passed as a list
+        addresses = addresses.filter(
+            search_index__biobased__overlap=filters["biobased"]
+        )
+    if "nemployees" in filters.keys():
+        # This parameter needs to be passed as a tuple
+        addresses = addresses.filter(
+            search_index__n_employees__range=filters["nemployees"]
+        )
+    if "sales" in filters.keys():
+        # This parameter needs to be passed as a tuple
+        addresses = addresses.filter(search_index__annual_sales__range=filters["sales"])
+    for key in AREA_FILTERS:
+        if key in filters.keys():
+            # This parameter needs to be passed as a list, the addresses were located in their areas when indexed
+            addresses = addresses.filter(
+                **{"search_index__{}__in".format(key): filters[key]}
+            )
+    return addresses
+
+
+def ecoliste_research(
+    search_location: Point, distance: int, filters: dict = None, projected: bool = None
+) -> list[Address]:
+    """
+    The search of addresses corresponding to the user desired parameters.
+
+    :param search_location: A geolocation using a Point object from django.contrib.gis.geos
+    :param distance: The distance around the search location, in kilometers
+    :param filters: A dictionary containing all available parameters from the models: material types, origin, enterprise
+    size… Some parameters (materials, origin, biobased), who can have multiple values at once, need to be organized
+    through the form filters[key] = [list of values] even if there is only one value. There should not be empty values
+    or [""] values coming from a QueryDict. Other parameters (nemployees, sales) are ranges, therefore they need their
+    2 values to be passed as a tuple. The last ones (region, departement, commune) are lists of INSEE codes, as strings,
+    to search inside administrative areas, e.g. filters["departement"] = ["69"].
+    :param projected: Computes the distances in the local projection, defaults to the ECOLISTE_PROJECTED_SEARCH setting.
+    :return: A list of Address objects, each one only once, annotated with their distance to the search location and
+    ordered by it.
+    """
+    search_location = located(search_location)
+    geolocation = geolocation_field(projected)
+    # ST_DWithin can use the spatial index, unlike a comparison on ST_Distance
+    addresses = Address.objects.using(read_database()).filter(
+        **{geolocation + "__dwithin": (search_location, D(km=distance))}
+    )
+    if filters:
+        addresses = filter_addresses(addresses, filters)
+    return (
+        addresses.select_related("enterprise")
+        .defer("enterprise__search_document")
+        .annotate(distance=Distance(geolocation, search_location))
+        .order_by("distance", "pk")
+    )
+
+
+def ecoliste_text_research(
+    search_location: Point,
+    distance: int,
+    text: str,
+    filters: dict = None,
+    projected: bool = None,
+) -> list[Address]:
+    """
+    The search of addresses corresponding to the user desired parameters, whose enterprise matches a text.
+
+    The text is searched in French in the name of the enterprises, the names of their materials and their description,
+    through their search_document and its GIN index, in the same query as the distance.
+    :param search_location: A geolocation using a Point object from django.contrib.gis.geos
+    :param distance: The distance around the search location, in kilometers
+    :param text: The words to search, with the syntax of web search engines: "quoted phrases", or, -excluded words.
+    :param filters: The filters, as described in ecoliste_research.
+    :param projected: Computes the distances in the local projection, defaults to the ECOLISTE_PROJECTED_SEARCH setting.
+    :return: A list of Address objects, each one only once, annotated with their distance, their text rank and their
+    relevance, the rank lowered with the distance, and ordered by relevance.
+    """
+    query = SearchQuery(text, config="french", search_type="websearch")
+    return (
+        ecoliste_research(search_location, distance, filters, projected)
+        .filter(enterprise__search_document=query)
+        .annotate(rank=SearchRank(F("enterprise__search_document"), query))
+        .annotate(
+            relevance=ExpressionWrapper(
+                F("rank")
+                * (1 - TEXT_DISTANCE_WEIGHT * F("distance") / (distance * 1000)),
+                output_field=FloatField(),
+            )
+        )
+        .order_by("-relevance", "distance", "pk")
+    )
+
+
+def ecoliste_nearest(
+    search_location: Point,
+    number: int,
+    filters: dict = None,
+    production_only: bool = True,
+    projected: bool = None,
+) -> list[Address]:
+    """
+    The search of the closest addresses corresponding to the user desired parameters, whatever their distance.
+
+    The addresses are ordered with the PostGIS KNN operator (<->), so the spatial index gives them directly in order,
+    and the search stops as soon as enough addresses are found. It avoids guessing a distance: too short in rural areas
+    it returns nothing, too long in dense ones it reads half the table.
+    :param search_location: A geolocation using a Point object from django.contrib.gis.geos
+    :param number: The maximum number of addresses to return
+    :param filters: The filters, as described in ecoliste_research.
+    :param production_only: Only returns the production sites.
+    :param projected: Computes the distances in the local projection, defaults to the ECOLISTE_PROJECTED_SEARCH setting.
+    :return: A list of at most number Address objects, annotated with their distance to the search location and
+    ordered by it.
+    """
+    search_location = located(search_location)
+    geolocation = geolocation_field(projected)
+    addresses = Address.objects.using(read_database())
+    if production_only:
+        addresses = addresses.filter(search_index__is_production=True)
+    if filters:
+        addresses = filter_addresses(addresses, filters)
+    return (
+        addresses.select_related("enterprise")
+        .defer("enterprise__search_document")
+        .annotate(distance=Distance(geolocation, search_location))
+        .order_by(GeometryDistance(geolocation, search_location), "pk")[:number]
+    )
+
+
+def ecoliste_corridor_research(
+    route: LineString,
+    distance: int,
+    filters: dict = None,
+    production_only: bool = True,
+    projected: bool = None,
+) -> list[Address]:
+    """
+    The search of addresses along a route, such as the road between a quarry and a construction site, or a planned
+    transport line.
+
+    A single ST_DWithin on the line uses the spatial index, instead of overlapping searches around points of the route.
+    :param route: The route using a LineString object from django.contrib.gis.geos
+    :param distance: The distance around the route, in kilometers
+    :param filters: The filters, as described in ecoliste_research.
+    :param production_only: Only returns the production sites.
+    :param projected: Computes the distances in the local projection, defaults to the ECOLISTE_PROJECTED_SEARCH setting.
+    :return: A list of Address objects, each one only once, annotated with their distance to the route and their
+    position along it, from 0 at its start to 1 at its end, and ordered by position.
+    """
+    route = located(route)
+    geolocation = geolocation_field(projected)
+    addresses = Address.objects.using(read_database()).filter(
+        **{geolocation + "__dwithin": (route, D(km=distance))}
+    )
+    if production_only:
+        addresses = addresses.filter(search_index__is_production=True)
+    if filters:
+        addresses = filter_addresses(addresses, filters)
+    if geolocation.endswith("_projected"):
+        # Both in the planar coordinates of the projection
+        position = LineLocatePoint(
+            route.transform(settings.ECOLISTE_PROJECTION_SRID, clone=True),
+            geolocation,
+        )
+    else:
+        # ST_LineLocatePoint has no geography version, the WGS84 coordinates are then taken as planar ones
+        position = LineLocatePoint(
+            route.transform(DEFAULT_SRID, clone=True),
+            Cast(geolocation, GeometryField(srid=DEFAULT_SRID)),
+        )
+    return (
+        addresses.select_related("enterprise")
+        .defer("enterprise__search_document")
+        .annotate(distance=Distance(geolocation, route), position=position)
+        .order_by("position", "distance", "pk")
+    )
+
+
+MULTISITE_SQL = """
+SELECT site.index, found.id, found.distance
+FROM (
+    SELECT index, {location} AS location
+    FROM unnest(%s::double precision[], %s::double precision[]) WITH ORDINALITY AS point(longitude, latitude, index)
+) AS site
+CROSS JOIN LATERAL ({addresses}) AS found
+ORDER BY site.index, found.distance, found.id
+"""
+
+
+def ecoliste_multisite_research(
+    sites: list[Point],
+    distance: float = None,
+    number: int = None,
+    filters: dict = None,
+    projected: bool = None,
+) -> list[list[Address]]:
+    """
+    The searches around several locations, such as the construction sites of a project, in one query.
+
+    Each site is joined laterally to its own search, so every search still uses the spatial index, as
+    ecoliste_research within a distance or as ecoliste_nearest for a number of addresses, or both.
+    :param sites: The geolocations using Point objects from django.contrib.gis.geos
+    :param distance: The distance around each site, in kilometers
+    :param number: The maximum number of addresses, the closest ones, around each site
+    :param filters: The filters, as described in ecoliste_research.
+    :param projected: Computes the distances in the local projection, defaults to the ECOLISTE_PROJECTED_SEARCH setting.
+    :return: For each site, a list of Address objects annotated with their distance to the site and ordered by it. An
+    address found around several sites comes once for each of them.
+    :raise ValueError: If there is neither a distance nor a number.
+    """
+    if distance is None and number is None:
+        raise ValueError("A distance or a number of addresses is required.")
+    if not sites:
+        return []
+    database = read_database()
+    connection = connections[database]
+    geolocation = geolocation_field(projected)
+    # The column of the search index joined by the filters
+    column = "{}.{}".format(
+        connection.ops.quote_name(AddressSearchIndex._meta.db_table),
+        connection.ops.quote_name(geolocation.split("__")[-1]),
+    )
+    addresses = filter_addresses(
+        Address.objects.filter(search_index__isnull=False), filters or {}
+    )
+    if distance is not None:
+        addresses = addresses.filter(
+            RawSQL(
+                "ST_DWithin({}, site.location, %s)".format(column),
+                (distance * 1000,),
+                output_field=BooleanField(),
+            )
+        )
+    addresses = addresses.annotate(
+        distance=RawSQL(
+            "ST_Distance({}, site.location)".format(column),
+            (),
+            output_field=FloatField(),
+        )
+    ).values("pk", "distance")
+    if number is not None:
+        # The KNN operator, which walks the spatial index from the site
+        addresses = addresses.order_by(
+            RawSQL("{} <-> site.location".format(column), ()).asc(), "pk"
+        )[:number]
+    else:
+        addresses = addresses.order_by()
+    addresses_sql, addresses_params = addresses.query.get_compiler(
+        using=database
+    ).as_sql()
+    location = "ST_SetSRID(ST_MakePoint(longitude, latitude), {})".format(DEFAULT_SRID)
+    if geolocation.endswith("_projected"):
+        location = "ST_Transform({}, {})".format(
+            location, int(settings.ECOLISTE_PROJECTION_SRID)
+        )
+    else:
+        location += "::geography"
+    points = [located(site).transform(DEFAULT_SRID, clone=True) for site in sites]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            MULTISITE_SQL.format(location=location, addresses=addresses_sql),
+            (
+                [point.x for point in points],
+                [point.y for point in points],
+                *addresses_params,
+            ),
+        )
+        rows = cursor.fetchall()
+    found = (
+        Address.objects.using(database)
+        .select_related("enterprise")
+        .defer("enterprise__search_document")
+        .in_bulk({pk for _, pk, _ in rows})
+    )
+    results = [[] for _ in sites]
+    for index, pk, meters in rows:
+        # A copy for each site, with its own distance
+        address = copy.copy(found[pk])
+        address.distance = D(m=meters)
+        results[index - 1].append(address)
+    return results
+
+
+def shared_enterprises(
+    results: list[list[Address]],
+) -> list[tuple[Enterprise, list[int]]]:
+    """
+    The enterprises found around several sites by ecoliste_multisite_research, which could supply all of them.
+    :param results: The addresses found around each site.
+    :return: The enterprises with the indexes of their sites, the ones serving the most sites first.
+    """
+    enterprises = {}
+    sites = defaultdict(set)
+    for index, addresses in enumerate(results):
+        for address in addresses:
+            enterprises[address.enterprise_id] = address.enterprise
+            sites[address.enterprise_id].add(index)
+    shared = [
+        (enterprises[enterprise_id], sorted(indexes))
+        for enterprise_id, indexes in sites.items()
+        if len(indexes) > 1
+    ]
+    return sorted(shared, key=lambda item: (-len(item[1]), item[0].name, item[0].pk))
+
+
+def querydict_filters(querydict: QueryDict) -> dict:
+    """
+    Transcripts the filters of a QueryDict to the dictionary expected by ecoliste_research.
+
+    Other keys are ignored, as well as empty values and incomplete ranges.
+    :param querydict: The QueryDict object sent by the html form.
+    :return: The filters dictionary.
+    :raise ValueError: If a value is not an integer, but for the codes of the administrative areas.
+    """
+    filters = {}
+    for key in LIST_FILTERS:
+        values = [int(value) for value in querydict.getlist(key) if value != ""]
+        if values:
+            filters[key] = values
+    for key in AREA_FILTERS:
+        values = [value.strip() for value in querydict.getlist(key) if value.strip()]
+        if values:
+            filters[key] = values
+    for key in RANGE_FILTERS:
+        values = [int(value) for value in querydict.getlist(key) if value != ""]
+        if len(values) == 2:
+            filters[key] = tuple(values)
+    return filters
+
+
+def ecoliste_research_querydict(
+    search_location: Point, search_distance: int, querydict: QueryDict
+) -> list[Address]:
+    """
+    Transcripts the QueryDict to a Dict, removes empty values, and passes it the ecoliste_research function.
+    :param search_location: A geolocation using a Point object from django.contrib.gis.geos
+    :param search_distance: The distance around the search location, in kilometers
+    :param querydict: The QueryDict object sent by the html form.
+    :return: A list of Address objects.
+    :raise ValueError: If a filter value is not an integer.
+    """
+    return ecoliste_research(
+        search_location, search_distance, filters=querydict_filters(querydict)
+    )
+
+
+def keyset_page(
+    addresses: QuerySet,
+    size: int,
+    after: tuple[float, int] = None,
+) -> tuple[list[Address], Optional[tuple[float, int]]]:
+    """
+    Gets a page of search results, following the previous one.
+
+    The page starts right after the last (distance, id) of the previous one, instead of skipping all the previous
+    results with an OFFSET, so the deepest pages are as fast as the first one.
+    :param addresses: The results of a search, ordered by distance and id.
+    :param size: The number of addresses of the page.
+    :param after: The key of the last address of the previous page, its distance in meters and its id.
+    :return: The addresses of the page, and the key to get the next one, or None if it's the last page.
+    """
+    if after is not None:
+        distance, pk = after
+        addresses = addresses.filter(
+            Q(distance__gt=D(m=distance)) | Q(distance=D(m=distance), pk__gt=pk)
+        )
+    # One more address tells if there is a next page
+    page = list(addresses[: size + 1])
+    if len(page) <= size:
+        return page, None
+    page = page[:size]
+    return page, (page[-1].distance.m, page[-1].pk)
@@ -0,0 +1,253 @@
+"""
+A cache of the pages of search results, as many users search around the same construction sites with the same filters.
+
+Only the pages actually requested are cached, each one read from the database with its LIMIT, so a large search is
+never loaded whole.
+
+The search location is snapped to a grid, so all the searches from the same cell share their results. They are
+computed from the center of the cell, which moves the search by at most half a cell.
+
+To invalidate the results precisely, the space is also divided in larger tiles, each one with a version. The key of a
+search contains the versions of all the tiles its circle covers, and a change of an address bumps the version of its
+tile: only the searches around this address are then computed again.
+"""
+
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import Counter
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.cache import BaseCache, caches
+
+from . import instrumentation, metrics, replicas
+from .models import Address
+from .search import AREA_FILTERS, ecoliste_research, keyset_page, located
+
+# Beyond this number of tiles, the search covers too much space to be worth caching
+MAX_TILES = 400
+
+KM_PER_DEGREE = 111.32
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def count(event: str) -> None:
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def stats() -> dict:
+    """
+    The counters of this process: hits, misses, and searches too large to be cached.
+    """
+    with _stats_lock:
+        return {event: _stats[event] for event in ("hit", "miss", "bypass")}
+
+
+def search_cache() -> Optional[BaseCache]:
+    """
+    The cache of the ECOLISTE_SEARCH_CACHE setting, or None if the cache is disabled.
+    """
+    alias = settings.ECOLISTE_SEARCH_CACHE
+    return caches[alias] if alias else None
+
+
+def snap(search_location: Point) -> Point:
+    """
+    Moves the search location to the center of its grid cell.
+    """
+    grid = settings.ECOLISTE_SEARCH_CACHE_GRID
+    search_location = search_location.transform(4326, clone=True)
+    return Point(
+        (math.floor(search_location.x / grid) + 0.5) * grid,
+        (math.floor(search_location.y / grid) + 0.5) * grid,
+        srid=4326,
+    )
+
+
+def tile(point: Point) -> tuple[int, int]:
+    size = settings.ECOLISTE_SEARCH_CACHE_TILE
+    return math.floor(point.x / size), math.floor(point.y / size)
+
+
+def covered_tiles(search_location: Point, distance: float) -> list[tuple[int, int]]:
+    """
+    The tiles of the bounding box of the search circle.
+    :param search_location: The WGS84 search location.
+    :param distance: The search distance, in kilometers.
+    """
+    size = settings.ECOLISTE_SEARCH_CACHE_TILE
+    delta_lat = distance / KM_PER_DEGREE
+    # Closer to the poles, a degree of longitude is shorter
+    cos_lat = max(math.cos(math.radians(abs(search_location.y) + delta_lat)), 0.01)
+    delta_lon = min(distance / (KM_PER_DEGREE * cos_lat), 180)
+    x_range = range(
+        math.floor((search_location.x - delta_lon) / size),
+        math.floor((search_location.x + delta_lon) / size) + 1,
+    )
+    y_range = range(
+        math.floor((search_location.y - delta_lat) / size),
+        math.floor((search_location.y + delta_lat) / size) + 1,
+    )
+    if len(x_range) * len(y_range) > MAX_TILES:
+        return []
+    return [(x, y) for x in x_range for y in y_range]
+
+
+def tile_key(tile_xy: tuple[int, int]) -> str:
+    return "search-tile:{}:{}".format(*tile_xy)
+
+
+def tiles_versions(cache: BaseCache, tiles: list[tuple[int, int]]) -> list:
+    keys = [tile_key(tile_xy) for tile_xy in tiles]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # A new version, so the results cached before the tile version was evicted can't be found again
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def canonical_filters(filters: Optional[dict]) -> dict:
+    """
+    The same filters, written the same way whatever their order, duplicates or types.
+    """
+    canonical = {}
+    for key, values in (filters or {}).items():
+        if key in ("nemployees", "sales"):
+            canonical[key] = sorted(int(value) for value in values)
+        elif key in AREA_FILTERS:
+            canonical[key] = sorted({str(value) for value in values})
+        else:
+            canonical[key] = sorted({int(value) for value in values})
+    return canonical
+
+
+def cache_key(
+    cache: BaseCache,
+    search_location: Point,
+    distance: float,
+    filters: Optional[dict],
+    projected: bool,
+    size: int,
+    after: Optional[tuple[float, int]],
+) -> Optional[str]:
+    """
+    The key of a page of a search, for a location already snapped to the grid.
+    :return: The key, or None if the search covers too many tiles to be cached.
+    """
+    tiles = covered_tiles(search_location, distance)
+    if not tiles:
+        return None
+    description = json.dumps(
+        [
+            search_location.coords,
+            distance,
+            canonical_filters(filters),
+            projected,
+            size,
+            after,
+            tiles_versions(cache, tiles),
+        ],
+        sort_keys=True,
+    )
+    return "search:" + hashlib.sha1(description.encode()).hexdigest()
+
+
+def run_page(
+    search_location: Point,
+    distance: float,
+    filters: Optional[dict],
+    projected: Optional[bool],
+    size: int,
+    after: Optional[tuple[float, int]],
+) -> tuple[list[Address], Optional[tuple[float, int]]]:
+    """
+    Reads a page of ecoliste_research from the database, and records its duration and number of results in the
+    metrics.
+    """
+    labels = {"filters": "+".join(sorted(filters)) if filters else "none"}
+    start = time.perf_counter()
+    page, next_key = keyset_page(
+        ecoliste_research(search_location, distance, filters, projected), size, after
+    )
+    metrics.observe(
+        "ecoliste_search_duration_seconds", labels, time.perf_counter() - start
+    )
+    metrics.observe("ecoliste_search_results", labels, len(page))
+    return page, next_key
+
+
+def cached_page(
+    search_location: Point,
+    distance: float,
+    filters: dict = None,
+    size: int = 50,
+    after: tuple[float, int] = None,
+    projected: bool = None,
+) -> tuple[list[Address], Optional[tuple[float, int]]]:
+    """
+    A page of ecoliste_research, see keyset_page, through the cache when it is enabled.
+
+    :param search_location: A geolocation using a Point object from django.contrib.gis.geos
+    :param distance: The distance around the search location, in kilometers
+    :param filters: The filters, as described in ecoliste_research.
+    :param size: The number of addresses of the page.
+    :param after: The key of the last address of the previous page, its distance in meters and its id.
+    :param projected: Computes the distances in the local projection, defaults to the ECOLISTE_PROJECTED_SEARCH setting.
+    :return: The Address objects of the page, annotated with their distance, and the key of the next page, or None if
+    it's the last page.
+    """
+    cache = search_cache()
+    if cache is None:
+        return run_page(search_location, distance, filters, projected, size, after)
+    if projected is None:
+        projected = settings.ECOLISTE_PROJECTED_SEARCH
+    snapped = snap(located(search_location))
+    key = cache_key(cache, snapped, distance, filters, projected, size, after)
+    if key is None:
+        count("bypass")
+        return run_page(search_location, distance, filters, projected, size, after)
+    page = cache.get(key)
+    if page is None:
+        count("miss")
+        instrumentation.cache_lookup("search", hit=False)
+        page = run_page(snapped, distance, filters, projected, size, after)
+        cache.set(key, page)
+    else:
+        count("hit")
+        instrumentation.cache_lookup("search", hit=True)
+    return page
+
+
+def invalidate_points(points: Iterable[Point]) -> None:
+    """
+    Invalidates the results of the searches around some locations, once the current transaction is committed: a
+    search made before would otherwise cache the previous data again.
+    :param points: The WGS84 locations of the addresses that changed.
+    """
+    invalidate_tiles(tile(point) for point in points if point is not None)
+
+
+def invalidate_tiles(tiles: Iterable[tuple[int, int]]) -> None:
+    """
+    Invalidates the results of the searches covering some tiles, once the current transaction is committed.
+    :param tiles: The tiles, as given by tile.
+    """
+    cache = search_cache()
+    if cache is None:
+        return
+    tiles = set(tiles)
+    if tiles:
+        replicas.on_commit(
+            lambda: cache.set_many(
+                {tile_key(tile_xy): time.time_ns() for tile_xy in tiles}, timeout=None
+            )
+        )
@@ -0,0 +1,203 @@
+"""
+Maintenance of the AddressSearchIndex table, the flattened copy of the addresses used by the search.
+
+The index rows of an enterprise only depend on this enterprise, its addresses and its products, so every change is
+handled by recomputing the rows of the enterprises it concerns. The rows also carry the administrative areas of their
+address, which only change with the boundaries, see update_areas.
+"""
+
+from collections import defaultdict
+from typing import Iterable
+
+from django.contrib.gis.geos import Point
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Address, AddressSearchIndex, Enterprise, MaterialByEnterprise
+
+# The commune containing a geolocation, with the codes of its département and région, through the spatial index of the
+# full boundaries
+COMMUNE_SQL = """
+    SELECT code, departement, region
+    FROM ecoliste_administrativearea
+    WHERE kind = 'commune' AND ST_Covers(geometry, {geolocation}::geometry)
+    ORDER BY code
+    LIMIT 1
+"""
+
+# Builds the whole index in one statement, much faster than going through the ORM for each enterprise
+REBUILD_SQL = """
+INSERT INTO ecoliste_addresssearchindex (
+    address_id, enterprise_id, geolocation, geolocation_projected, is_production, materials, origins, biobased,
+    annual_sales, n_employees, commune, departement, region
+)
+SELECT
+    address.id,
+    address.enterprise_id,
+    address.geolocation,
+    address.geolocation_projected,
+    address.is_production,
+    COALESCE(products.materials, '{{}}'),
+    COALESCE(products.origins, '{{}}'),
+    COALESCE(biobased.biobased, '{{}}'),
+    enterprise.annual_sales,
+    enterprise.n_employees,
+    commune.code,
+    commune.departement,
+    commune.region
+FROM ecoliste_address address
+INNER JOIN ecoliste_enterprise enterprise ON enterprise.id = address.enterprise_id
+LEFT JOIN LATERAL ({commune}) commune ON true
+LEFT JOIN (
+    SELECT enterprise_id, array_agg(DISTINCT type_id) AS materials, array_agg(DISTINCT origin) AS origins
+    FROM ecoliste_materialbyenterprise
+    GROUP BY enterprise_id
+) products ON products.enterprise_id = address.enterprise_id
+LEFT JOIN (
+    SELECT product.enterprise_id, array_agg(DISTINCT link.biobasedoriginmaterial_id) AS biobased
+    FROM ecoliste_materialbyenterprise product
+    INNER JOIN ecoliste_materialbyenterprise_biobased_material link ON link.materialbyenterprise_id = product.id
+    GROUP BY product.enterprise_id
+) biobased ON biobased.enterprise_id = address.enterprise_id
+""".format(
+    commune=COMMUNE_SQL.format(geolocation="address.geolocation")
+)
+
+# Locates again the indexed addresses whose areas changed, returning their WGS84 locations
+AREAS_SQL = """
+UPDATE ecoliste_addresssearchindex search_index
+SET commune = commune.code, departement = commune.departement, region = commune.region
+FROM ecoliste_addresssearchindex located
+LEFT JOIN LATERAL ({commune}) commune ON true
+WHERE search_index.address_id = located.address_id
+    AND (search_index.commune, search_index.departement, search_index.region)
+        IS DISTINCT FROM (commune.code, commune.departement, commune.region)
+    {{addresses}}
+RETURNING ST_X(search_index.geolocation::geometry), ST_Y(search_index.geolocation::geometry)
+""".format(
+    commune=COMMUNE_SQL.format(geolocation="located.geolocation")
+)
+
+
+def enterprises_products(enterprise_ids: Iterable[int]) -> dict[int, dict]:
+    """
+    Gathers what the enterprises produce, in one query.
+    :param enterprise_ids: The ids of the enterprises.
+    :return: A dictionary giving, for each enterprise id, the sets of its material types, origins and biobased
+    materials ids. Enterprises without products are missing.
+    """
+    products = defaultdict(
+        lambda: {"materials": set(), "origins": set(), "biobased": set()}
+    )
+    rows = (
+        MaterialByEnterprise.objects.filter(enterprise_id__in=enterprise_ids)
+        .values_list("enterprise_id", "type_id", "origin", "biobased_material")
+        .order_by()
+    )
+    for enterprise_id, type_id, origin, biobased_id in rows:
+        enterprise_products = products[enterprise_id]
+        enterprise_products["materials"].add(type_id)
+        enterprise_products["origins"].add(origin)
+        if biobased_id is not None:
+            enterprise_products["biobased"].add(biobased_id)
+    return products
+
+
+def update_enterprises(enterprise_ids: Iterable[int]) -> int:
+    """
+    Recomputes the index rows of all the addresses of some enterprises.
+    :param enterprise_ids: The ids of the enterprises that changed.
+    :return: The number of index rows written.
+    """
+    enterprise_ids = set(enterprise_ids)
+    if not enterprise_ids:
+        return 0
+    with transaction.atomic():
+        # Two transactions updating the same enterprise would both delete its rows, then both insert them again: the
+        # enterprises are locked, in the order of their ids so that they can't deadlock, and then their addresses, which
+        # are read once the transactions updating them are over
+        list(
+            Enterprise.objects.select_for_update()
+            .filter(pk__in=enterprise_ids)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        products = enterprises_products(enterprise_ids)
+        addresses = (
+            Address.objects.select_for_update(of=("self",))
+            .filter(enterprise_id__in=enterprise_ids)
+            .order_by("pk")
+            .values(
+                "pk",
+                "enterprise_id",
+                "geolocation",
+                "geolocation_projected",
+                "is_production",
+                "enterprise__annual_sales",
+                "enterprise__n_employees",
+            )
+        )
+        rows = []
+        for address in addresses:
+            enterprise_products = products.get(address["enterprise_id"], {})
+            rows.append(
+                AddressSearchIndex(
+                    address_id=address["pk"],
+                    enterprise_id=address["enterprise_id"],
+                    geolocation=address["geolocation"],
+                    geolocation_projected=address["geolocation_projected"],
+                    is_production=address["is_production"],
+                    materials=sorted(enterprise_products.get("materials", [])),
+                    origins=sorted(enterprise_products.get("origins", [])),
+                    biobased=sorted(enterprise_products.get("biobased", [])),
+                    annual_sales=address["enterprise__annual_sales"],
+                    n_employees=address["enterprise__n_employees"],
+                )
+            )
+        # An address moved to another enterprise still has its row under the previous one
+        AddressSearchIndex.objects.filter(
+            Q(enterprise_id__in=enterprise_ids)
+            | Q(address_id__in=[row.address_id for row in rows])
+        ).delete()
+        AddressSearchIndex.objects.bulk_create(rows, batch_size=1000)
+        update_areas([row.address_id for row in rows])
+    return len(rows)
+
+
+def update_areas(address_ids: Iterable[int] = None) -> list[Point]:
+    """
+    Locates indexed addresses in their commune, département and région, once for all, as testing the boundaries of the
+    communes at each search would be far too slow.
+    :param address_ids: The ids of the addresses, all of them by default, as when the boundaries are imported again.
+    :return: The WGS84 locations of the addresses whose areas changed.
+    """
+    if address_ids is None:
+        sql, params = AREAS_SQL.format(addresses=""), ()
+    else:
+        address_ids = list(address_ids)
+        if not address_ids:
+            return []
+        sql = AREAS_SQL.format(addresses="AND located.address_id = ANY(%s)")
+        params = (address_ids,)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [Point(x, y, srid=4326) for x, y in cursor.fetchall()]
+
+
+def remove_addresses(address_ids: Iterable[int]) -> None:
+    """
+    Removes the index rows of deleted addresses.
+    :param address_ids: The ids of the deleted addresses.
+    """
+    AddressSearchIndex.objects.filter(address_id__in=list(address_ids)).delete()
+
+
+def rebuild() -> int:
+    """
+    Rebuilds the whole index from the addresses, enterprises and products.
+    :return: The number of index rows written.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("DELETE FROM ecoliste_addresssearchindex")
+        cursor.execute(REBUILD_SQL)
+        return cursor.rowcount
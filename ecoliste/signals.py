@@ -0,0 +1,179 @@
+"""
+Keeps the data derived from the models up to date when they are saved or deleted: the search index, the cached search
+results, the stored map tiles and the cached enterprise pages. Also measures the queries of the database connections,
+and checks the persistent ones.
+"""
+
+from typing import Iterable
+
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from django.contrib.gis.geos import Point
+
+from . import enterprise_pages, instrumentation, search_cache, search_index, tiles
+from .models import (
+    Address,
+    BiobasedOriginMaterial,
+    Contact,
+    Enterprise,
+    MaterialByEnterprise,
+    MaterialType,
+    MaterialTypeCategory,
+)
+
+# The sections of the enterprise pages showing each model
+PAGE_SECTIONS = {
+    Enterprise: ["identity"],
+    # The materials sections show their production addresses
+    Address: ["addresses", "materials"],
+    MaterialByEnterprise: ["materials"],
+    Contact: ["contacts"],
+}
+
+
+def locations_changed(points: Iterable[Point]) -> None:
+    """
+    Invalidates the cached searches and the map tiles around some locations.
+    :param points: The WGS84 locations of the addresses that changed.
+    """
+    points = [point for point in points if point is not None]
+    search_cache.invalidate_points(points)
+    tiles.invalidate_points(points)
+
+
+def enterprises_locations(enterprise_ids: Iterable[int]) -> list[Point]:
+    return list(
+        Address.objects.filter(enterprise_id__in=list(enterprise_ids)).values_list(
+            "geolocation", flat=True
+        )
+    )
+
+
+def enterprises_changed(enterprise_ids: Iterable[int]) -> None:
+    """
+    Updates the search index and invalidates the cached data of all the addresses of some enterprises.
+    :param enterprise_ids: The ids of the enterprises that changed.
+    """
+    enterprise_ids = set(enterprise_ids)
+    search_index.update_enterprises(enterprise_ids)
+    locations_changed(enterprises_locations(enterprise_ids))
+
+
+@receiver(pre_save, sender=Address)
+def collect_previous_geolocation(sender, instance: Address, **kwargs) -> None:
+    # The searches and tiles around the previous location of a moved address are invalidated too
+    instance._previous_geolocation = None
+    if instance.pk is not None:
+        instance._previous_geolocation = (
+            Address.objects.filter(pk=instance.pk)
+            .values_list("geolocation", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Enterprise)
+@receiver(post_save, sender=Address)
+@receiver(post_save, sender=MaterialByEnterprise)
+@receiver(post_delete, sender=MaterialByEnterprise)
+def update_search_index(sender, instance, **kwargs) -> None:
+    enterprise_id = instance.pk if sender is Enterprise else instance.enterprise_id
+    enterprises_changed([enterprise_id])
+    if sender is Address:
+        locations_changed([instance._previous_geolocation])
+
+
+@receiver(post_delete, sender=Address)
+def remove_from_search_index(sender, instance: Address, **kwargs) -> None:
+    search_index.remove_addresses([instance.pk])
+    locations_changed([instance.geolocation])
+
+
+@receiver(m2m_changed, sender=MaterialByEnterprise.biobased_material.through)
+def update_search_index_biobased(
+    sender, instance, action: str, reverse: bool, pk_set: set, **kwargs
+) -> None:
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            enterprises_changed([instance.enterprise_id])
+        return
+    # The instance is a biobased material, linked to products of several enterprises
+    if action == "pre_clear":
+        instance._search_index_enterprises = set(
+            instance.products.values_list("enterprise_id", flat=True)
+        )
+    elif action == "post_clear":
+        enterprises_changed(instance._search_index_enterprises)
+    elif action in ("post_add", "post_remove"):
+        enterprises_changed(
+            MaterialByEnterprise.objects.filter(pk__in=pk_set).values_list(
+                "enterprise_id", flat=True
+            )
+        )
+
+
+@receiver(pre_delete, sender=BiobasedOriginMaterial)
+def collect_biobased_enterprises(
+    sender, instance: BiobasedOriginMaterial, **kwargs
+) -> None:
+    # The links to the products are deleted without any m2m_changed signal
+    instance._search_index_enterprises = set(
+        instance.products.values_list("enterprise_id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=BiobasedOriginMaterial)
+def update_search_index_biobased_deleted(
+    sender, instance: BiobasedOriginMaterial, **kwargs
+) -> None:
+    enterprises_changed(instance._search_index_enterprises)
+
+
+@receiver(post_save, sender=Enterprise)
+@receiver(post_delete, sender=Enterprise)
+@receiver(post_save, sender=Address)
+@receiver(post_delete, sender=Address)
+@receiver(post_save, sender=MaterialByEnterprise)
+@receiver(post_delete, sender=MaterialByEnterprise)
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+def invalidate_enterprise_page(sender, instance, **kwargs) -> None:
+    enterprise_id = instance.pk if sender is Enterprise else instance.enterprise_id
+    enterprise_pages.invalidate([enterprise_id], PAGE_SECTIONS[sender])
+
+
+@receiver(m2m_changed, sender=MaterialByEnterprise.address.through)
+@receiver(m2m_changed, sender=MaterialByEnterprise.biobased_material.through)
+def invalidate_enterprise_page_materials(
+    sender, instance, action: str, reverse: bool, **kwargs
+) -> None:
+    if not action.startswith("post_"):
+        return
+    if reverse and isinstance(instance, BiobasedOriginMaterial):
+        # Linked to products of any enterprise
+        enterprise_pages.invalidate_materials_names()
+    else:
+        # The products and their addresses both belong to the enterprise
+        enterprise_pages.invalidate([instance.enterprise_id], ["materials"])
+
+
+@receiver(post_save, sender=MaterialTypeCategory)
+@receiver(post_delete, sender=MaterialTypeCategory)
+@receiver(post_save, sender=MaterialType)
+@receiver(post_delete, sender=MaterialType)
+@receiver(post_save, sender=BiobasedOriginMaterial)
+@receiver(post_delete, sender=BiobasedOriginMaterial)
+def invalidate_materials_names(sender, **kwargs) -> None:
+    enterprise_pages.invalidate_materials_names()
+
+
+@receiver(connection_created)
+def measure_queries(sender, connection, **kwargs) -> None:
+    instrumentation.install(connection)
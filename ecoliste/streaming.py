@@ -0,0 +1,74 @@
+"""
+Streaming responses whose content runs database queries, served under ASGI.
+
+Before Django 4.2, the ASGIHandler reads the content of the streaming responses on the event loop, where the queries
+raise SynchronousOnlyOperation. An AsyncStreamingHttpResponse is read a batch of parts at a time in the thread of the
+request instead, by the ASGIHandler of this module. The WSGI handlers read it as any StreamingHttpResponse.
+"""
+
+from itertools import islice
+from typing import AsyncIterator, Iterator
+
+from asgiref.sync import sync_to_async
+from django.core.handlers import asgi
+from django.http import StreamingHttpResponse
+
+
+def next_batch(iterator: Iterator[bytes], size: int) -> list[bytes]:
+    return list(islice(iterator, size))
+
+
+class AsyncStreamingHttpResponse(StreamingHttpResponse):
+    """
+    A StreamingHttpResponse which can be read with async for, its parts being read in a thread.
+    """
+
+    def __init__(self, streaming_content=(), *args, batch_size: int = 100, **kwargs):
+        """
+        :param batch_size: The number of parts read at once, in a single thread switch.
+        """
+        super().__init__(streaming_content, *args, **kwargs)
+        self.batch_size = batch_size
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        # Read from the streaming_content, which the test client wraps, and always in the same thread, as the
+        # iterators with a server-side cursor must be
+        iterator = self.streaming_content
+        while batch := await sync_to_async(next_batch)(iterator, self.batch_size):
+            for part in batch:
+                yield part
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    Django's ASGIHandler, which reads the AsyncStreamingHttpResponse with async for.
+    """
+
+    async def send_response(self, response, send):
+        if not isinstance(response, AsyncStreamingHttpResponse):
+            return await super().send_response(response, send)
+        headers = [
+            (
+                header.encode("ascii") if isinstance(header, str) else header,
+                value.encode("latin1") if isinstance(value, str) else value,
+            )
+            for header, value in response.items()
+        ]
+        for cookie in response.cookies.values():
+            headers.append(
+                (b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+            )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": headers,
+            }
+        )
+        async for part in response:
+            for chunk, _ in self.chunk_bytes(part):
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await send({"type": "http.response.body"})
+        await sync_to_async(response.close, thread_sensitive=True)()
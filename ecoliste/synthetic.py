@@ -0,0 +1,361 @@
+"""
+A synthetic catalogue of suppliers spread over metropolitan France, to measure the search at scale.
+
+Most of the addresses are around the cities, in proportion to their population, and the others are scattered over the
+country. The enterprises are mostly small, with one or two sites, and produce a few materials whose types follow a
+long tail: a few types are produced everywhere, most of them by few enterprises. The same seed always gives the same
+dataset.
+
+The synthetic enterprises are marked by their website, so they can be removed without touching the real ones. They are
+saved and removed without any signal, so the cached data they change is invalidated here, see invalidate_caches.
+"""
+
+import random
+from typing import Iterator
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.cache import caches
+from django.db import connection, transaction
+
+from . import replicas, search_cache, search_index, tiles
+from .export import chunks
+from .models import (
+    Address,
+    BiobasedOriginMaterial,
+    Enterprise,
+    MaterialByEnterprise,
+    MaterialType,
+    MaterialTypeCategory,
+    project,
+)
+
+SYNTHETIC_WEBSITE = "https://synthetic.invalid/"
+
+# The cities and their population in thousands, for the locations of the addresses and the searches
+CITIES = [
+    ("Paris", 2.3522, 48.8566, 2100),
+    ("Marseille", 5.3698, 43.2965, 870),
+    ("Lyon", 4.8357, 45.7640, 520),
+    ("Toulouse", 1.4442, 43.6047, 490),
+    ("Nice", 7.2620, 43.7102, 340),
+    ("Nantes", -1.5536, 47.2184, 320),
+    ("Montpellier", 3.8767, 43.6108, 300),
+    ("Strasbourg", 7.7521, 48.5734, 290),
+    ("Bordeaux", -0.5792, 44.8378, 260),
+    ("Lille", 3.0573, 50.6292, 235),
+    ("Rennes", -1.6778, 48.1173, 220),
+    ("Reims", 4.0317, 49.2583, 180),
+    ("Saint-Étienne", 4.3872, 45.4397, 175),
+    ("Toulon", 5.9280, 43.1242, 175),
+    ("Le Havre", 0.1079, 49.4944, 170),
+    ("Grenoble", 5.7245, 45.1885, 160),
+    ("Dijon", 5.0415, 47.3220, 160),
+    ("Angers", -0.5632, 47.4784, 155),
+    ("Nîmes", 4.3601, 43.8367, 150),
+    ("Clermont-Ferrand", 3.0870, 45.7772, 145),
+    ("Le Mans", 0.1996, 48.0061, 145),
+    ("Aix-en-Provence", 5.4474, 43.5297, 145),
+    ("Brest", -4.4861, 48.3904, 140),
+    ("Tours", 0.6848, 47.3941, 135),
+    ("Amiens", 2.2958, 49.8941, 135),
+    ("Limoges", 1.2611, 45.8336, 130),
+    ("Perpignan", 2.8948, 42.6887, 120),
+    ("Metz", 6.1757, 49.1193, 120),
+    ("Besançon", 6.0241, 47.2378, 115),
+    ("Orléans", 1.9093, 47.9030, 115),
+    ("Rouen", 1.0993, 49.4432, 110),
+    ("Caen", -0.3707, 49.1829, 105),
+    ("Nancy", 6.1844, 48.6921, 105),
+    ("Poitiers", 0.3404, 46.5802, 90),
+    ("Pau", -0.3708, 43.2951, 75),
+    ("La Rochelle", -1.1511, 46.1603, 75),
+]
+
+# The bounding box of metropolitan France, for the scattered addresses
+WEST, SOUTH, EAST, NORTH = -4.8, 42.3, 8.2, 51.1
+
+# The share of the addresses scattered over the country, the others being around the cities
+SCATTERED = 0.25
+
+# The spread of the addresses around a city, in degrees, for the smallest and the largest city
+MIN_SPREAD, MAX_SPREAD = 0.05, 0.3
+
+# Most suppliers are small enterprises with a single site
+N_ADDRESSES_WEIGHTS = {1: 60, 2: 25, 3: 8, 4: 4, 5: 3}
+N_EMPLOYEES_WEIGHTS = {
+    None: 5,
+    Enterprise.NEmployees.INDIVIDUAL: 15,
+    Enterprise.NEmployees.MICRO: 35,
+    Enterprise.NEmployees.SMALL: 25,
+    Enterprise.NEmployees.MEDIUM: 12,
+    Enterprise.NEmployees.MIDSIZE1: 5,
+    Enterprise.NEmployees.MIDSIZE2: 2,
+    Enterprise.NEmployees.BIG: 1,
+}
+ANNUAL_SALES_WEIGHTS = {
+    None: 10,
+    Enterprise.AnnualSales.MICRO: 45,
+    Enterprise.AnnualSales.SMALL: 25,
+    Enterprise.AnnualSales.MEDIUM: 12,
+    Enterprise.AnnualSales.INTERSIZE1: 5,
+    Enterprise.AnnualSales.INTERSIZE2: 2,
+    Enterprise.AnnualSales.BIG: 1,
+}
+N_PRODUCTS_WEIGHTS = {1: 40, 2: 30, 3: 15, 4: 10, 5: 5}
+ORIGIN_WEIGHTS = {
+    MaterialByEnterprise.MaterialOrigins.REUSE: 30,
+    MaterialByEnterprise.MaterialOrigins.BIOBASED: 35,
+    MaterialByEnterprise.MaterialOrigins.RECYCLED: 25,
+    MaterialByEnterprise.MaterialOrigins.REUSABLE: 10,
+}
+PRODUCTION_SHARE = 0.4
+
+# Created when the database has no material types or biobased materials yet
+CATALOGUE = {
+    "Structure": ["Poutres", "Planchers", "Ossatures", "Charpentes", "Briques"],
+    "Isolation": ["Panneaux isolants", "Isolants en vrac", "Rouleaux isolants"],
+    "Revêtements": ["Parquets", "Carrelages", "Enduits", "Bardages", "Peintures"],
+    "Menuiseries": ["Portes", "Fenêtres", "Escaliers"],
+}
+BIOBASED = ["Bois", "Chanvre", "Paille", "Lin", "Ouate de cellulose", "Liège", "Laine"]
+
+SYNTHETIC_ENTERPRISES_SQL = "SELECT id FROM ecoliste_enterprise WHERE website LIKE %s"
+SYNTHETIC_PRODUCTS_SQL = "SELECT id FROM ecoliste_materialbyenterprise WHERE enterprise_id IN ({enterprises})"
+
+# The tiles of the search cache containing the synthetic addresses, see search_cache.tile
+SYNTHETIC_TILES_SQL = """
+SELECT DISTINCT floor(ST_X(geolocation::geometry) / %s)::integer, floor(ST_Y(geolocation::geometry) / %s)::integer
+FROM ecoliste_address
+WHERE enterprise_id IN ({enterprises})
+"""
+
+# In the order of the foreign keys, the enterprises last
+CLEAR_SQL = [
+    "DELETE FROM ecoliste_materialbyenterprise_biobased_material WHERE materialbyenterprise_id IN ("
+    + SYNTHETIC_PRODUCTS_SQL
+    + ")",
+    "DELETE FROM ecoliste_materialbyenterprise_address WHERE materialbyenterprise_id IN ("
+    + SYNTHETIC_PRODUCTS_SQL
+    + ")",
+    "DELETE FROM ecoliste_materialbyenterprise WHERE enterprise_id IN ({enterprises})",
+    "DELETE FROM ecoliste_contact WHERE enterprise_id IN ({enterprises})",
+    "DELETE FROM ecoliste_addresssearchindex WHERE enterprise_id IN ({enterprises})",
+    "DELETE FROM ecoliste_address WHERE enterprise_id IN ({enterprises})",
+    "DELETE FROM ecoliste_enterprise WHERE id IN ({enterprises})",
+]
+
+
+def weighted(rng: random.Random, weights: dict):
+    return rng.choices(list(weights), list(weights.values()))[0]
+
+
+def long_tail(items: list) -> dict:
+    """
+    Weights for a list of choices, the first ones being the most common: the n-th one is n times less common.
+    """
+    return {item: 1 / rank for rank, item in enumerate(items, start=1)}
+
+
+def city_location(rng: random.Random) -> Point:
+    """
+    A location around a city, chosen in proportion to the population.
+    """
+    _, longitude, latitude, population = rng.choices(
+        CITIES, [city[3] for city in CITIES]
+    )[0]
+    spread = MIN_SPREAD + (MAX_SPREAD - MIN_SPREAD) * population / CITIES[0][3]
+    return Point(
+        min(max(rng.gauss(longitude, spread), WEST), EAST),
+        min(max(rng.gauss(latitude, spread), SOUTH), NORTH),
+        srid=4326,
+    )
+
+
+def scattered_location(rng: random.Random) -> Point:
+    return Point(rng.uniform(WEST, EAST), rng.uniform(SOUTH, NORTH), srid=4326)
+
+
+def search_locations(number: int, seed: int = 0) -> list[Point]:
+    """
+    Locations to search from, around the cities as most of the construction sites.
+    """
+    rng = random.Random(seed)
+    return [city_location(rng) for _ in range(number)]
+
+
+def catalogue() -> tuple[list[int], list[int]]:
+    """
+    The ids of the material types and biobased materials, created if the database has none.
+    :return: The material types ids and the biobased materials ids, each list in a random but fixed order.
+    """
+    if not MaterialType.objects.exists():
+        for order, (category_name, types) in enumerate(CATALOGUE.items(), start=1):
+            category = MaterialTypeCategory.objects.create(
+                name=category_name, order=order
+            )
+            for type_order, name in enumerate(types, start=1):
+                MaterialType.objects.create(
+                    name=name, order=type_order, category=category
+                )
+    if not BiobasedOriginMaterial.objects.exists():
+        for name in BIOBASED:
+            BiobasedOriginMaterial.objects.create(name=name)
+    types = list(MaterialType.objects.order_by("pk").values_list("pk", flat=True))
+    biobased = list(
+        BiobasedOriginMaterial.objects.order_by("pk").values_list("pk", flat=True)
+    )
+    # Which types are common doesn't depend on the order they were created in
+    random.Random(0).shuffle(types)
+    random.Random(0).shuffle(biobased)
+    return types, biobased
+
+
+def synthetic_enterprises(rng: random.Random, number: int) -> Iterator[dict]:
+    """
+    Generates enterprises with their addresses and products, until there are enough addresses.
+    :param number: The number of addresses to generate.
+    :return: An iterator over dictionaries with the unsaved enterprise, its addresses and the (type, origin, biobased
+    ids) of its products.
+    """
+    types, biobased = catalogue()
+    type_weights, biobased_weights = long_tail(types), long_tail(biobased)
+    count, n = 0, 0
+    while count < number:
+        n += 1
+        enterprise = Enterprise(
+            name="Entreprise synthétique {}".format(n),
+            website="{}{}".format(SYNTHETIC_WEBSITE, n),
+            n_employees=weighted(rng, N_EMPLOYEES_WEIGHTS),
+            annual_sales=weighted(rng, ANNUAL_SALES_WEIGHTS),
+        )
+        n_addresses = min(weighted(rng, N_ADDRESSES_WEIGHTS), number - count)
+        if rng.random() < SCATTERED:
+            first = scattered_location(rng)
+        else:
+            first = city_location(rng)
+        addresses = []
+        for i in range(n_addresses):
+            # The other sites of an enterprise are in the same area
+            location = (
+                first
+                if i == 0
+                else Point(rng.gauss(first.x, 0.2), rng.gauss(first.y, 0.2), srid=4326)
+            )
+            addresses.append(
+                Address(
+                    enterprise=enterprise,
+                    text_version="{} rue synthétique".format(n),
+                    geolocation=location,
+                    is_production=rng.random() < PRODUCTION_SHARE,
+                )
+            )
+        products = set()
+        for _ in range(weighted(rng, N_PRODUCTS_WEIGHTS)):
+            products.add((weighted(rng, type_weights), weighted(rng, ORIGIN_WEIGHTS)))
+        yield {
+            "enterprise": enterprise,
+            "addresses": addresses,
+            "products": [
+                (
+                    type_id,
+                    origin,
+                    {weighted(rng, biobased_weights) for _ in range(rng.randint(1, 2))}
+                    if origin == MaterialByEnterprise.MaterialOrigins.BIOBASED
+                    else set(),
+                )
+                for type_id, origin in sorted(products)
+            ],
+        }
+        count += n_addresses
+
+
+def save_synthetic(items: list[dict]) -> None:
+    """
+    Saves a batch of generated enterprises, in bulk: no signal is sent.
+    """
+    Enterprise.objects.bulk_create([item["enterprise"] for item in items])
+    addresses = []
+    for item in items:
+        for address in item["addresses"]:
+            # Set again now that the enterprise has its id
+            address.enterprise = item["enterprise"]
+            # Not computed by bulk_create, which doesn't call save()
+            address.geolocation_projected = project(address.geolocation)
+            addresses.append(address)
+    Address.objects.bulk_create(addresses)
+    products, biobased_links = [], []
+    for item in items:
+        for type_id, origin, biobased in item["products"]:
+            product = MaterialByEnterprise(
+                enterprise=item["enterprise"], type_id=type_id, origin=origin
+            )
+            products.append(product)
+            biobased_links.extend((product, biobased_id) for biobased_id in biobased)
+    MaterialByEnterprise.objects.bulk_create(products)
+    BiobasedLink = MaterialByEnterprise.biobased_material.through
+    BiobasedLink.objects.bulk_create(
+        BiobasedLink(
+            materialbyenterprise_id=product.pk, biobasedoriginmaterial_id=biobased_id
+        )
+        for product, biobased_id in biobased_links
+    )
+
+
+def invalidate_caches() -> None:
+    """
+    Invalidates the cached data showing the synthetic enterprises, once the current transaction is committed: the
+    searches around their addresses, and the whole caches of the autocompletion, of the enterprise pages and of the map
+    tiles, as they are too many to be invalidated one by one.
+    """
+    size = settings.ECOLISTE_SEARCH_CACHE_TILE
+    with connection.cursor() as cursor:
+        cursor.execute(
+            SYNTHETIC_TILES_SQL.format(enterprises=SYNTHETIC_ENTERPRISES_SQL),
+            [size, size, SYNTHETIC_WEBSITE + "%"],
+        )
+        search_cache.invalidate_tiles(cursor.fetchall())
+    for alias in (settings.ECOLISTE_AUTOCOMPLETE_CACHE, settings.ECOLISTE_PAGES_CACHE):
+        if alias:
+            replicas.on_commit(caches[alias].clear)
+    tiles.clear()
+
+
+def seed(addresses: int, random_seed: int = 0, batch_size: int = 2000) -> int:
+    """
+    Adds a synthetic dataset to the database, then rebuilds the search index and invalidates the caches.
+    :param addresses: The number of addresses to create.
+    :param random_seed: The seed of the random generator.
+    :param batch_size: The number of enterprises saved at once.
+    :return: The number of enterprises created.
+    """
+    rng = random.Random(random_seed)
+    count = 0
+    with transaction.atomic():
+        for batch in chunks(synthetic_enterprises(rng, addresses), batch_size):
+            save_synthetic(batch)
+            count += len(batch)
+        search_index.rebuild()
+        invalidate_caches()
+    # The planner needs the statistics of the new rows to choose the indexes
+    with connection.cursor() as cursor:
+        for model in (Enterprise, Address, MaterialByEnterprise):
+            cursor.execute("ANALYZE {}".format(model._meta.db_table))
+        cursor.execute("ANALYZE ecoliste_addresssearchindex")
+    return count
+
+
+def clear() -> int:
+    """
+    Removes the synthetic enterprises, and everything linked to them.
+    :return: The number of enterprises removed.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        invalidate_caches()
+        # Much faster than deleting the objects one by one with their signals
+        for sql in CLEAR_SQL:
+            cursor.execute(
+                sql.format(enterprises=SYNTHETIC_ENTERPRISES_SQL),
+                [SYNTHETIC_WEBSITE + "%"],
+            )
+        return cursor.rowcount
@@ -1,10 +1,56 @@
-from django.contrib.gis.geos import Point
-from django.test import TestCase
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import LineString, Point
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse, QueryDict
+from django.test import (
+    LiveServerTestCase,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 
-from . import models
-from .views import ecoliste_research
+from . import (
+    boundaries,
+    enterprise_pages,
+    instrumentation,
+    metrics,
+    models,
+    replicas,
+    search_cache,
+    search_index,
+    synthetic,
+)
+from .autocomplete import autocomplete
+from .clusters import bbox_addresses, clusters
+from .facets import ecoliste_facets
+from .geocoder import geocode, geocode_addresses, import_ban, normalize
+from .middleware import ReplicaMiddleware
+from .search import (
+    ecoliste_corridor_research,
+    ecoliste_multisite_research,
+    ecoliste_nearest,
+    ecoliste_research,
+    ecoliste_text_research,
+    querydict_filters,
+    shared_enterprises,
+)
+from .tiles import build_tile, point_tiles
+from .views import address_feature
 
 ENTERPRISE_VIEW = "ecoliste:enterprise"
 
@@ -503,3 +549,2189 @@ class SearchFunctionTestCase(TestCase):
         self.assertIn(self.ent2_address1, addresses)
         self.assertNotIn(self.ent1_address, addresses)
         self.assertNotIn(self.ent2_address2, addresses)
+
+
+class SearchFunctionRowsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.search_location = Point([0, 0])
+        self.mat_types = add_materials_types()
+        self.bio_origins = add_biobased_origins()
+
+        # An enterprise producing every material type with every origin, all of them with both biobased materials
+        self.enterprise = models.Enterprise(
+            name="Big catalogue", n_employees=models.Enterprise.NEmployees.MEDIUM
+        )
+        self.enterprise.save()
+        self.addresses = []
+        for position in ([1, 1], [0.5, 0.5], [2, 2]):
+            address = models.Address(
+                enterprise=self.enterprise,
+                text_version="Address at {}".format(position),
+                geolocation=Point(position),
+                is_production=True,
+            )
+            address.save()
+            self.addresses.append(address)
+        for material_type in self.mat_types:
+            for origin in models.MaterialByEnterprise.MaterialOrigins.values:
+                material = models.MaterialByEnterprise(
+                    enterprise=self.enterprise, type=material_type, origin=origin
+                )
+                material.save()
+                material.address.add(*self.addresses)
+                material.biobased_material.add(*self.bio_origins)
+
+        # An enterprise without any product, which should never be returned with product filters
+        self.no_products = models.Enterprise(name="No products")
+        self.no_products.save()
+        self.no_products_address = models.Address(
+            enterprise=self.no_products,
+            text_version="No products address",
+            geolocation=Point([0.1, 0.1]),
+            is_production=True,
+        )
+        self.no_products_address.save()
+
+        self.filters = {
+            "materials": [material_type.id for material_type in self.mat_types],
+            "origin": models.MaterialByEnterprise.MaterialOrigins.values,
+            "biobased": [bio_origin.id for bio_origin in self.bio_origins],
+        }
+
+    def test_search_returns_each_address_once(self) -> None:
+        with self.assertNumQueries(1):
+            addresses = list(
+                ecoliste_research(self.search_location, 1000, filters=self.filters)
+            )
+        self.assertEqual(len(addresses), len(self.addresses))
+        self.assertCountEqual(addresses, self.addresses)
+
+    def test_search_ordered_by_distance(self) -> None:
+        addresses = list(
+            ecoliste_research(self.search_location, 1000, filters=self.filters)
+        )
+        self.assertEqual(
+            addresses, [self.addresses[1], self.addresses[0], self.addresses[2]]
+        )
+        self.assertLess(addresses[0].distance.km, addresses[1].distance.km)
+        self.assertAlmostEqual(addresses[0].distance.km, 78.6, delta=1)
+
+    def test_search_without_filters_single_query(self) -> None:
+        with self.assertNumQueries(1):
+            addresses = list(ecoliste_research(self.search_location, 1000))
+            names = [address.enterprise.name for address in addresses]
+        self.assertEqual(len(addresses), len(self.addresses) + 1)
+        self.assertEqual(names[0], self.no_products.name)
+
+
+class SearchNearestTestCase(TestCase):
+    def setUp(self) -> None:
+        self.search_location = Point([0, 0])
+        self.mat_types = add_materials_types()
+
+        self.enterprise = models.Enterprise(name="Producer")
+        self.enterprise.save()
+        self.material = models.MaterialByEnterprise(
+            enterprise=self.enterprise,
+            type=self.mat_types[0],
+            origin=models.MaterialByEnterprise.MaterialOrigins.REUSE,
+        )
+        self.material.save()
+        self.other_enterprise = models.Enterprise(name="Other producer")
+        self.other_enterprise.save()
+        self.other_material = models.MaterialByEnterprise(
+            enterprise=self.other_enterprise,
+            type=self.mat_types[1],
+            origin=models.MaterialByEnterprise.MaterialOrigins.REUSE,
+        )
+        self.other_material.save()
+
+        # Far away from each other, as a fixed distance search would not find them
+        self.production_sites = []
+        for position in ([10, 10], [-5, 5], [20, 20]):
+            address = models.Address(
+                enterprise=self.enterprise,
+                text_version="Site at {}".format(position),
+                geolocation=Point(position),
+                is_production=True,
+            )
+            address.save()
+            self.production_sites.append(address)
+        self.office = models.Address(
+            enterprise=self.enterprise,
+            text_version="Office",
+            geolocation=Point([1, 1]),
+            is_production=False,
+        )
+        self.office.save()
+        self.other_site = models.Address(
+            enterprise=self.other_enterprise,
+            text_version="Other site",
+            geolocation=Point([2, 2]),
+            is_production=True,
+        )
+        self.other_site.save()
+
+    def test_nearest_returns_closest_sites_in_order(self) -> None:
+        filters = {"materials": [self.mat_types[0].id]}
+        with self.assertNumQueries(1):
+            addresses = list(ecoliste_nearest(self.search_location, 2, filters=filters))
+        self.assertEqual(addresses, self.production_sites[1::-1])
+        self.assertLess(addresses[0].distance.km, addresses[1].distance.km)
+
+    def test_nearest_ignores_other_materials(self) -> None:
+        filters = {"materials": [self.mat_types[0].id]}
+        addresses = ecoliste_nearest(self.search_location, 10, filters=filters)
+        self.assertNotIn(self.other_site, addresses)
+        self.assertEqual(len(addresses), len(self.production_sites))
+
+    def test_nearest_not_production_only(self) -> None:
+        addresses = ecoliste_nearest(self.search_location, 2, production_only=False)
+        self.assertEqual(list(addresses), [self.office, self.other_site])
+
+
+class SearchIndexTestCase(TestCase):
+    def setUp(self) -> None:
+        self.mat_types = add_materials_types()
+        self.bio_origins = add_biobased_origins()
+        self.enterprise = models.Enterprise(
+            name="Enterprise", n_employees=models.Enterprise.NEmployees.SMALL
+        )
+        self.enterprise.save()
+        self.address = models.Address(
+            enterprise=self.enterprise,
+            text_version="Address",
+            geolocation=Point([1, 1]),
+            is_production=True,
+        )
+        self.address.save()
+        self.material = models.MaterialByEnterprise(
+            enterprise=self.enterprise,
+            type=self.mat_types[0],
+            origin=models.MaterialByEnterprise.MaterialOrigins.BIOBASED,
+        )
+        self.material.save()
+
+    def get_index(self) -> models.AddressSearchIndex:
+        return models.AddressSearchIndex.objects.get(address=self.address)
+
+    def test_index_created_with_address(self) -> None:
+        index = self.get_index()
+        self.assertEqual(index.enterprise_id, self.enterprise.pk)
+        self.assertTrue(index.is_production)
+        self.assertEqual(index.materials, [self.mat_types[0].pk])
+        self.assertEqual(
+            index.origins, [models.MaterialByEnterprise.MaterialOrigins.BIOBASED]
+        )
+        self.assertEqual(index.n_employees, models.Enterprise.NEmployees.SMALL)
+
+    def test_index_updated_with_biobased_materials(self) -> None:
+        self.material.biobased_material.add(*self.bio_origins)
+        self.assertCountEqual(
+            self.get_index().biobased, [bio.pk for bio in self.bio_origins]
+        )
+        self.bio_origins[0].products.clear()
+        self.assertEqual(self.get_index().biobased, [self.bio_origins[1].pk])
+        self.bio_origins[1].delete()
+        self.assertEqual(self.get_index().biobased, [])
+
+    def test_index_updated_with_enterprise(self) -> None:
+        self.enterprise.n_employees = models.Enterprise.NEmployees.BIG
+        self.enterprise.save()
+        self.assertEqual(self.get_index().n_employees, models.Enterprise.NEmployees.BIG)
+
+    def test_index_updated_when_material_deleted(self) -> None:
+        self.material.delete()
+        self.assertEqual(self.get_index().materials, [])
+
+    def test_index_removed_with_enterprise(self) -> None:
+        self.enterprise.delete()
+        self.assertFalse(models.AddressSearchIndex.objects.exists())
+
+    def test_index_updated_twice_in_a_transaction(self) -> None:
+        with transaction.atomic():
+            self.enterprise.n_employees = models.Enterprise.NEmployees.BIG
+            self.enterprise.save()
+            self.assertEqual(search_index.update_enterprises([self.enterprise.pk]), 1)
+            self.assertEqual(search_index.update_enterprises([self.enterprise.pk]), 1)
+        self.assertEqual(self.get_index().n_employees, models.Enterprise.NEmployees.BIG)
+        self.assertEqual(self.get_index().materials, [self.mat_types[0].pk])
+
+    def test_rebuild_command(self) -> None:
+        models.AddressSearchIndex.objects.all().delete()
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(self.get_index().materials, [self.mat_types[0].pk])
+
+
+class SearchProjectedTestCase(TestCase):
+    def setUp(self) -> None:
+        # Lyon, with Villeurbanne ~4km away and Grenoble ~95km away
+        self.search_location = Point([4.835, 45.764])
+        self.enterprise = models.Enterprise(name="Enterprise")
+        self.enterprise.save()
+        self.villeurbanne = models.Address(
+            enterprise=self.enterprise,
+            text_version="Villeurbanne",
+            geolocation=Point([4.88, 45.771]),
+            is_production=True,
+        )
+        self.villeurbanne.save()
+        self.grenoble = models.Address(
+            enterprise=self.enterprise,
+            text_version="Grenoble",
+            geolocation=Point([5.724, 45.188]),
+            is_production=True,
+        )
+        self.grenoble.save()
+
+    def test_projected_coordinates_saved(self) -> None:
+        self.assertEqual(self.villeurbanne.geolocation_projected.srid, 2154)
+        index = models.AddressSearchIndex.objects.get(address=self.villeurbanne)
+        self.assertAlmostEqual(index.geolocation_projected.x, 846100, delta=1000)
+        self.assertAlmostEqual(index.geolocation_projected.y, 6520600, delta=1000)
+
+    def test_projected_search(self) -> None:
+        addresses = ecoliste_research(self.search_location, 50, projected=True)
+        self.assertEqual(list(addresses), [self.villeurbanne])
+
+    def test_projected_distances_close_to_geography(self) -> None:
+        projected = ecoliste_research(self.search_location, 200, projected=True)
+        geography = ecoliste_research(self.search_location, 200, projected=False)
+        self.assertEqual(list(projected), list(geography))
+        for planar, spherical in zip(projected, geography):
+            self.assertAlmostEqual(planar.distance.m, spherical.distance.m, delta=200)
+
+    def test_projected_nearest(self) -> None:
+        addresses = ecoliste_nearest(self.search_location, 1, projected=True)
+        self.assertEqual(list(addresses), [self.villeurbanne])
+
+
+class SearchApiTestCase(TestCase):
+    def setUp(self) -> None:
+        # The invalidations of the cache only happen on commit, never within a test
+        search_cache.search_cache().clear()
+        self.url = reverse("ecoliste:search_api")
+        self.mat_types = add_materials_types()
+        self.enterprise = models.Enterprise(name="Enterprise")
+        self.enterprise.save()
+        models.MaterialByEnterprise(
+            enterprise=self.enterprise,
+            type=self.mat_types[0],
+            origin=models.MaterialByEnterprise.MaterialOrigins.REUSE,
+        ).save()
+        self.other_enterprise = models.Enterprise(name="Other enterprise")
+        self.other_enterprise.save()
+        self.addresses = []
+        for i in range(1, 6):
+            address = models.Address(
+                enterprise=self.enterprise,
+                text_version="Address {}".format(i),
+                geolocation=Point([i / 10, 0]),
+                is_production=True,
+            )
+            address.save()
+            self.addresses.append(address)
+        self.other_address = models.Address(
+            enterprise=self.other_enterprise,
+            text_version="Other address",
+            geolocation=Point([0, 0.05]),
+            is_production=False,
+        )
+        self.other_address.save()
+        self.parameters = {"lon": 0, "lat": 0, "distance": 100}
+
+    def test_returns_geojson(self) -> None:
+        response = self.client.get(self.url, self.parameters)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["type"], "FeatureCollection")
+        self.assertEqual(len(data["features"]), len(self.addresses) + 1)
+        self.assertIsNone(data["next"])
+        feature = data["features"][1]
+        self.assertEqual(feature["id"], self.addresses[0].pk)
+        self.assertEqual(feature["geometry"]["coordinates"], [0.1, 0])
+        self.assertEqual(feature["properties"]["enterprise"]["name"], "Enterprise")
+        self.assertAlmostEqual(feature["properties"]["distance"], 11.1, delta=0.1)
+
+    def test_filters_from_query_string(self) -> None:
+        parameters = {**self.parameters, "materials": [self.mat_types[0].pk, ""]}
+        data = self.client.get(self.url, parameters).json()
+        ids = [feature["id"] for feature in data["features"]]
+        self.assertEqual(ids, [address.pk for address in self.addresses])
+
+    def test_keyset_pagination(self) -> None:
+        parameters = {**self.parameters, "size": 2}
+        data = self.client.get(self.url, parameters).json()
+        ids = [feature["id"] for feature in data["features"]]
+        pages = 1
+        while data["next"]:
+            with self.assertNumQueries(1):
+                data = self.client.get(data["next"]).json()
+            ids += [feature["id"] for feature in data["features"]]
+            pages += 1
+        self.assertEqual(pages, 3)
+        self.assertEqual(
+            ids,
+            [self.other_address.pk] + [address.pk for address in self.addresses],
+        )
+
+    def test_missing_location(self) -> None:
+        response = self.client.get(self.url, {"distance": 100})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_filter(self) -> None:
+        response = self.client.get(self.url, {**self.parameters, "materials": "wood"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_cursor(self) -> None:
+        response = self.client.get(self.url, {**self.parameters, "cursor": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        search_cache.search_cache().clear()
+        self.mat_types = add_materials_types()
+        self.enterprise = models.Enterprise(name="Enterprise")
+        self.enterprise.save()
+        self.address = models.Address(
+            enterprise=self.enterprise,
+            text_version="Address",
+            geolocation=Point([0.1, 0]),
+            is_production=True,
+        )
+        self.address.save()
+
+    def search(self, location=(0, 0), filters=None) -> list[models.Address]:
+        page, _ = search_cache.cached_page(Point(location), 50, filters)
+        return page
+
+    def test_results_cached(self) -> None:
+        self.assertEqual(self.search(), [self.address])
+        stats = search_cache.stats()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search(), [self.address])
+        self.assertEqual(search_cache.stats()["hit"], stats["hit"] + 1)
+
+    def test_same_cell_and_equivalent_filters_share_results(self) -> None:
+        self.search((0.001, 0.001), {"materials": [2, 1, 1]})
+        with self.assertNumQueries(0):
+            self.search((0.002, 0.002), {"materials": [1, 2]})
+
+    def test_other_filters_not_shared(self) -> None:
+        self.search(filters={"materials": [1]})
+        stats = search_cache.stats()
+        self.search(filters={"materials": [2]})
+        self.assertEqual(search_cache.stats()["miss"], stats["miss"] + 1)
+
+    def test_invalidated_by_nearby_address(self) -> None:
+        self.search()
+        with self.captureOnCommitCallbacks(execute=True):
+            address = models.Address(
+                enterprise=self.enterprise,
+                text_version="Nearby address",
+                geolocation=Point([0.2, 0]),
+                is_production=True,
+            )
+            address.save()
+        self.assertEqual(self.search(), [self.address, address])
+
+    def test_not_invalidated_by_distant_address(self) -> None:
+        self.search()
+        other = models.Enterprise(name="Other enterprise")
+        other.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Address(
+                enterprise=other,
+                text_version="Distant address",
+                geolocation=Point([5, 45]),
+                is_production=True,
+            ).save()
+        with self.assertNumQueries(0):
+            self.search()
+
+    def test_invalidated_by_moved_address(self) -> None:
+        self.search()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.address.geolocation = Point([5, 45])
+            self.address.save()
+        self.assertEqual(self.search(), [])
+
+    def test_invalidated_by_products(self) -> None:
+        filters = {"materials": [self.mat_types[0].pk]}
+        self.assertEqual(self.search(filters=filters), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            models.MaterialByEnterprise(
+                enterprise=self.enterprise,
+                type=self.mat_types[0],
+                origin=models.MaterialByEnterprise.MaterialOrigins.REUSE,
+            ).save()
+        self.assertEqual(self.search(filters=filters), [self.address])
+
+    def test_large_searches_not_cached(self) -> None:
+        stats = search_cache.stats()
+        search_cache.cached_page(Point([0, 0]), 2000)
+        self.assertEqual(search_cache.stats()["bypass"], stats["bypass"] + 1)
+
+    def test_pages_cached_separately(self) -> None:
+        nearby = models.Address(
+            enterprise=self.enterprise,
+            text_version="Nearby address",
+            geolocation=Point([0.2, 0]),
+            is_production=True,
+        )
+        nearby.save()
+        first, next_key = search_cache.cached_page(Point([0, 0]), 50, size=1)
+        second, last_key = search_cache.cached_page(
+            Point([0, 0]), 50, size=1, after=next_key
+        )
+        self.assertEqual((first, second, last_key), ([self.address], [nearby], None))
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                search_cache.cached_page(Point([0, 0]), 50, size=1, after=next_key),
+                (second, None),
+            )
+
+    def test_uncached_searches_read_only_the_page(self) -> None:
+        for search_distance, cache in ((2000, "search"), (50, None)):
+            with self.subTest(cache=cache), override_settings(
+                ECOLISTE_SEARCH_CACHE=cache
+            ), CaptureQueriesContext(connection) as queries:
+                search_cache.cached_page(Point([0, 0]), search_distance, size=2)
+            self.assertEqual(len(queries), 1)
+            self.assertIn("LIMIT 3", queries[0]["sql"])
+
+
+class FacetsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.mat_types = add_materials_types()
+        self.biobased = add_biobased_origins()
+        origins = models.MaterialByEnterprise.MaterialOrigins
+        self.small = models.Enterprise(
+            name="Small enterprise",
+            n_employees=models.Enterprise.NEmployees.SMALL,
+            annual_sales=models.Enterprise.AnnualSales.MICRO,
+        )
+        self.small.save()
+        self.big = models.Enterprise(
+            name="Big enterprise",
+            n_employees=models.Enterprise.NEmployees.BIG,
+            annual_sales=models.Enterprise.AnnualSales.BIG,
+        )
+        self.big.save()
+        models.MaterialByEnterprise(
+            enterprise=self.small, type=self.mat_types[0], origin=origins.REUSE
+        ).save()
+        product = models.MaterialByEnterprise(
+            enterprise=self.small, type=self.mat_types[1], origin=origins.BIOBASED
+        )
+        product.save()
+        product.biobased_material.add(self.biobased[0])
+        models.MaterialByEnterprise(
+            enterprise=self.big, type=self.mat_types[0], origin=origins.RECYCLED
+        ).save()
+        for i, enterprise in enumerate([self.small, self.small, self.big]):
+            models.Address(
+                enterprise=enterprise,
+                text_version="Address {}".format(i),
+                geolocation=Point([i / 10, 0]),
+                is_production=True,
+            ).save()
+        # Out of the search radius
+        models.Address(
+            enterprise=self.big,
+            text_version="Distant address",
+            geolocation=Point([5, 45]),
+            is_production=True,
+        ).save()
+
+    def test_counts_addresses_per_value(self) -> None:
+        with self.assertNumQueries(1):
+            facets = ecoliste_facets(Point([0, 0]), 50)
+        origins = models.MaterialByEnterprise.MaterialOrigins
+        self.assertEqual(
+            facets["materials"], {self.mat_types[0].pk: 3, self.mat_types[1].pk: 2}
+        )
+        self.assertEqual(
+            facets["origin"],
+            {origins.REUSE: 2, origins.BIOBASED: 2, origins.RECYCLED: 1},
+        )
+        self.assertEqual(facets["biobased"], {self.biobased[0].pk: 2})
+        self.assertEqual(
+            facets["nemployees"],
+            {
+                models.Enterprise.NEmployees.SMALL: 2,
+                models.Enterprise.NEmployees.BIG: 1,
+            },
+        )
+        self.assertEqual(
+            facets["sales"],
+            {
+                models.Enterprise.AnnualSales.MICRO: 2,
+                models.Enterprise.AnnualSales.BIG: 1,
+            },
+        )
+
+    def test_facet_ignores_its_own_filter(self) -> None:
+        origins = models.MaterialByEnterprise.MaterialOrigins
+        facets = ecoliste_facets(Point([0, 0]), 50, {"origin": [origins.RECYCLED]})
+        self.assertEqual(
+            facets["origin"],
+            {origins.REUSE: 2, origins.BIOBASED: 2, origins.RECYCLED: 1},
+        )
+        self.assertEqual(facets["materials"], {self.mat_types[0].pk: 1})
+        self.assertEqual(facets["biobased"], {})
+
+    def test_facets_api(self) -> None:
+        response = self.client.get(
+            reverse("ecoliste:facets_api"), {"lon": 0, "lat": 0, "distance": 50}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["materials"][str(self.mat_types[1].pk)], 2)
+
+
+class ClustersTestCase(TestCase):
+    def setUp(self) -> None:
+        self.url = reverse("ecoliste:clusters_api")
+        self.enterprise = models.Enterprise(name="Enterprise")
+        self.enterprise.save()
+        self.addresses = []
+        for i, location in enumerate([(2.35, 48.85), (2.36, 48.86), (5.37, 43.3)]):
+            address = models.Address(
+                enterprise=self.enterprise,
+                text_version="Address {}".format(i),
+                geolocation=Point(location),
+                is_production=True,
+            )
+            address.save()
+            self.addresses.append(address)
+        self.bbox = (-5, 41, 10, 52)
+
+    def test_close_addresses_clustered(self) -> None:
+        found = sorted(clusters(self.bbox, 5), key=lambda cluster: -cluster["count"])
+        self.assertEqual([cluster["count"] for cluster in found], [2, 1])
+        self.assertAlmostEqual(found[0]["longitude"], 2.355)
+        self.assertAlmostEqual(found[0]["latitude"], 48.855)
+        self.assertIsNone(found[0]["address_id"])
+        self.assertEqual(found[1]["address_id"], self.addresses[2].pk)
+
+    def test_addresses_out_of_view_ignored(self) -> None:
+        found = clusters((4, 42, 6, 44), 5)
+        self.assertEqual([cluster["count"] for cluster in found], [1])
+
+    def test_clusters_api(self) -> None:
+        response = self.client.get(self.url, {"bbox": "-5,41,10,52", "zoom": 5})
+        self.assertEqual(response.status_code, 200)
+        features = response.json()["features"]
+        self.assertEqual(
+            sorted(feature["properties"]["count"] for feature in features), [1, 2]
+        )
+
+    def test_addresses_at_high_zoom(self) -> None:
+        response = self.client.get(self.url, {"bbox": "2.3,48.8,2.4,48.9", "zoom": 16})
+        features = response.json()["features"]
+        self.assertEqual(
+            [feature["id"] for feature in features],
+            [address.pk for address in self.addresses[:2]],
+        )
+        self.assertEqual(features[0]["properties"]["text_version"], "Address 0")
+
+    def test_invalid_bbox(self) -> None:
+        response = self.client.get(self.url, {"bbox": "10,41,-5,52", "zoom": 5})
+        self.assertEqual(response.status_code, 400)
+
+    def test_large_bbox_at_high_zoom(self) -> None:
+        response = self.client.get(self.url, {"bbox": "-180,-90,180,90", "zoom": 22})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.url, {"bbox": "-180,-90,180,90", "zoom": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()["truncated"])
+
+    @override_settings(ECOLISTE_CLUSTER_MAX_FEATURES=1)
+    def test_addresses_truncated(self) -> None:
+        response = self.client.get(self.url, {"bbox": "2.3,48.8,2.4,48.9", "zoom": 16})
+        self.assertEqual(
+            [feature["id"] for feature in response.json()["features"]],
+            [self.addresses[0].pk],
+        )
+        self.assertTrue(response.json()["truncated"])
+
+
+class TilesTestCase(TestCase):
+    def setUp(self) -> None:
+        tiles_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tiles_dir.cleanup)
+        tiles_settings = override_settings(ECOLISTE_TILES_DIR=tiles_dir.name)
+        tiles_settings.enable()
+        self.addCleanup(tiles_settings.disable)
+        self.tiles_dir = tiles_dir.name
+        self.enterprise = models.Enterprise(name="Enterprise")
+        self.enterprise.save()
+        models.MaterialByEnterprise(
+            enterprise=self.enterprise,
+            type=add_materials_types()[0],
+            origin=models.MaterialByEnterprise.MaterialOrigins.RECYCLED,
+        ).save()
+        self.address = models.Address(
+            enterprise=self.enterprise,
+            text_version="Paris",
+            geolocation=Point([2.35, 48.85]),
+            is_production=True,
+        )
+        self.address.save()
+
+    def get_tile(self, z, x, y):
+        return self.client.get(
+            reverse("ecoliste:tile", kwargs={"z": z, "x": x, "y": y})
+        )
+
+    def test_point_tiles(self) -> None:
+        tiles = point_tiles(Point([2.35, 48.85]))
+        self.assertIn((0, 0, 0), tiles)
+        self.assertIn((10, 518, 352), tiles)
+        # On the edge of two tiles
+        tiles = point_tiles(Point([2.8125, 48.85]))
+        self.assertIn((10, 519, 352), tiles)
+        self.assertIn((10, 520, 352), tiles)
+
+    def test_tile_with_address(self) -> None:
+        response = self.get_tile(10, 518, 352)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/vnd.mapbox-vector-tile")
+        self.assertIn(b"addresses", response.content)
+        path = os.path.join(self.tiles_dir, "10", "518", "352.mvt")
+        with open(path, "rb") as file:
+            self.assertEqual(file.read(), response.content)
+
+    def test_tile_without_address(self) -> None:
+        response = self.get_tile(10, 0, 0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"")
+
+    def test_tile_removed_when_address_moves(self) -> None:
+        self.get_tile(10, 518, 352)
+        self.get_tile(10, 0, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.address.geolocation = Point([5.37, 43.3])
+            self.address.save()
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tiles_dir, "10", "518", "352.mvt"))
+        )
+        self.assertTrue(
+            os.path.exists(os.path.join(self.tiles_dir, "10", "0", "0.mvt"))
+        )
+        self.assertEqual(self.get_tile(10, 518, 352).content, b"")
+
+    def test_invalid_tile(self) -> None:
+        self.assertEqual(self.get_tile(2, 4, 0).status_code, 404)
+
+
+BAN_CSV = """id;id_fantoir;numero;rep;nom_voie;code_postal;code_insee;nom_commune;lon;lat
+75102_7050_00012;75102_7050;12;;Rue de la Paix;75002;75102;Paris 2e Arrondissement;2.3312;48.8693
+75102_7050_00014;75102_7050;14;;Rue de la Paix;75002;75102;Paris 2e Arrondissement;2.3310;48.8695
+75102_7050_00012_bis;75102_7050;12;bis;Rue de la Paix;75002;75102;Paris 2e Arrondissement;2.3313;48.8694
+69383_1234_00003;69383_1234;3;;Place Bellecour;69002;69382;Lyon 2e Arrondissement;4.8320;45.7578
+13055_5678_00001;13055_5678;1;;Boulevard Saint-Michel;13001;13055;Marseille;5.3800;43.3000
+13055_5678_00003;13055_5678;3;;Boulevard Saint-Michel;13001;13055;Marseille;5.3820;43.3020
+"""
+
+
+class GeocoderTestCase(TestCase):
+    def setUp(self) -> None:
+        # The results of the previous tests are still in the cache
+        caches["geocoder"].clear()
+        self.count = import_ban(StringIO(BAN_CSV))
+
+    def test_normalize(self) -> None:
+        self.assertEqual(
+            normalize("12, Bd Saint-Éloi — Châteauneuf"),
+            "12 boulevard saint eloi chateauneuf",
+        )
+
+    def test_import_addresses_and_communes(self) -> None:
+        self.assertEqual(self.count, 9)
+        marseille = models.BanAddress.objects.get(
+            kind=models.BanAddress.Kinds.MUNICIPALITY, citycode="13055"
+        )
+        self.assertEqual(marseille.label, "Marseille")
+        self.assertEqual(marseille.postcode, "13001")
+        self.assertAlmostEqual(marseille.geolocation.x, 5.381)
+        self.assertIn("13001", marseille.tokens)
+
+    def test_import_twice_replaces_entries(self) -> None:
+        import_ban(StringIO(BAN_CSV.replace("2.3312", "2.3412")))
+        self.assertEqual(models.BanAddress.objects.count(), 9)
+        address = models.BanAddress.objects.get(ban_id="75102_7050_00012")
+        self.assertAlmostEqual(address.geolocation.x, 2.3412)
+
+    def test_geocode_address(self) -> None:
+        result = geocode("12 rue de la paix, 75002 PARIS")[0]
+        self.assertEqual(
+            result.label, "12 Rue de la Paix 75002 Paris 2e Arrondissement"
+        )
+        self.assertEqual(result.kind, models.BanAddress.Kinds.HOUSENUMBER)
+        self.assertEqual(result.point.coords, (2.3312, 48.8693))
+
+    def test_geocode_house_number(self) -> None:
+        self.assertEqual(
+            geocode("14 rue de la paix paris")[0].label,
+            "14 Rue de la Paix 75002 Paris 2e Arrondissement",
+        )
+
+    def test_geocode_abbreviations(self) -> None:
+        self.assertEqual(
+            geocode("3 bd St Michel Marseille")[0].label,
+            "3 Boulevard Saint-Michel 13001 Marseille",
+        )
+
+    def test_geocode_commune(self) -> None:
+        result = geocode("marseille")[0]
+        self.assertEqual(result.kind, models.BanAddress.Kinds.MUNICIPALITY)
+
+    def test_geocode_unknown(self) -> None:
+        self.assertEqual(geocode("Strasbourg"), [])
+        self.assertEqual(geocode("  ,;"), [])
+
+    def test_results_cached(self) -> None:
+        geocode("place bellecour lyon")
+        with self.assertNumQueries(0):
+            geocode("Place Bellecour, Lyon")
+
+    def test_results_invalidated_by_import(self) -> None:
+        geocode("place bellecour lyon")
+        with self.captureOnCommitCallbacks(execute=True):
+            import_ban(StringIO(BAN_CSV.replace("4.8320", "4.8420")))
+        result = geocode("place bellecour lyon")[0]
+        self.assertEqual(result.point.coords, (4.842, 45.7578))
+
+    def test_geocode_addresses(self) -> None:
+        enterprise = models.Enterprise(name="Enterprise")
+        enterprise.save()
+        moved = models.Address(
+            enterprise=enterprise,
+            text_version="1 boulevard Saint-Michel 13001 Marseille",
+            geolocation=Point([0, 0]),
+            is_production=True,
+        )
+        moved.save()
+        models.Address(
+            enterprise=enterprise,
+            text_version="Somewhere else",
+            geolocation=Point([1, 1]),
+            is_production=True,
+        ).save()
+        stats = geocode_addresses(models.Address.objects.all())
+        self.assertEqual(stats["moved"], 1)
+        self.assertEqual(stats["not found"], 1)
+        moved.refresh_from_db()
+        self.assertEqual(moved.geolocation.coords, (5.38, 43.3))
+        self.assertEqual(
+            models.AddressSearchIndex.objects.get(address=moved).geolocation.coords,
+            (5.38, 43.3),
+        )
+
+    def test_search_api_with_address(self) -> None:
+        response = self.client.get(
+            reverse("ecoliste:search_api"), {"address": "Marseille", "distance": 10}
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            reverse("ecoliste:search_api"), {"address": "Strasbourg", "distance": 10}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_geocode_api(self) -> None:
+        response = self.client.get(reverse("ecoliste:geocode_api"), {"q": "Lyon"})
+        self.assertEqual(response.json()["results"][0]["longitude"], 4.832)
+
+
+class TextSearchTestCase(TestCase):
+    def setUp(self) -> None:
+        self.mat_types = add_materials_types()
+        self.biobased = add_biobased_origins()
+        self.sawmill = models.Enterprise(
+            name="Scierie du Jura", description="Bois de charpente et bardages."
+        )
+        self.sawmill.save()
+        self.joinery = models.Enterprise(
+            name="Menuiserie", description="Fenêtres en bois massif."
+        )
+        self.joinery.save()
+        self.addresses = {}
+        for i, enterprise in enumerate([self.sawmill, self.joinery]):
+            self.addresses[enterprise.pk] = models.Address(
+                enterprise=enterprise,
+                text_version="Address {}".format(i),
+                geolocation=Point([i / 10, 0]),
+                is_production=True,
+            )
+            self.addresses[enterprise.pk].save()
+        self.search_location = Point([0, 0])
+
+    def search(self, text: str) -> list[models.Address]:
+        return list(ecoliste_text_research(self.search_location, 50, text))
+
+    def test_search_description(self) -> None:
+        self.assertEqual(self.search("charpentes"), [self.addresses[self.sawmill.pk]])
+
+    def test_ranked_by_relevance(self) -> None:
+        # In the name of the joinery, only in the description of the sawmill
+        self.sawmill.description = "Menuiserie et charpente."
+        self.sawmill.save()
+        self.assertEqual(
+            self.search("menuiserie"),
+            [self.addresses[self.joinery.pk], self.addresses[self.sawmill.pk]],
+        )
+
+    def test_closer_first_when_as_relevant(self) -> None:
+        found = self.search("bois")
+        self.assertEqual(
+            found,
+            [self.addresses[self.sawmill.pk], self.addresses[self.joinery.pk]],
+        )
+        self.assertGreater(found[0].relevance, found[1].relevance)
+
+    def test_search_materials(self) -> None:
+        product = models.MaterialByEnterprise(
+            enterprise=self.joinery,
+            type=self.mat_types[1],
+            origin=models.MaterialByEnterprise.MaterialOrigins.BIOBASED,
+        )
+        product.save()
+        self.assertEqual(self.search("beams"), [self.addresses[self.joinery.pk]])
+        product.biobased_material.add(self.biobased[1])
+        self.assertEqual(self.search("cotton"), [self.addresses[self.joinery.pk]])
+        self.biobased[1].name = "Hemp"
+        self.biobased[1].save()
+        self.assertEqual(self.search("cotton"), [])
+        self.assertEqual(self.search("hemp"), [self.addresses[self.joinery.pk]])
+
+    def test_excluded_words(self) -> None:
+        self.assertEqual(
+            self.search("bois -fenêtres"), [self.addresses[self.sawmill.pk]]
+        )
+
+    def test_out_of_distance(self) -> None:
+        self.assertEqual(list(ecoliste_text_research(Point([5, 45]), 50, "bois")), [])
+
+
+class AutocompleteTestCase(TestCase):
+    def setUp(self) -> None:
+        caches["autocomplete"].clear()
+        for name in ["Scierie du Jura", "Écoferme Bâtiment", "Menuiserie Durand"]:
+            models.Enterprise(name=name).save()
+
+    def names(self, text: str) -> list[str]:
+        return [enterprise["name"] for enterprise in autocomplete(text)]
+
+    def test_typos(self) -> None:
+        self.assertEqual(self.names("scirie")[0], "Scierie du Jura")
+
+    def test_accents(self) -> None:
+        self.assertEqual(self.names("ecoferme"), ["Écoferme Bâtiment"])
+        self.assertEqual(self.names("BATIMENT"), ["Écoferme Bâtiment"])
+
+    def test_other_words(self) -> None:
+        self.assertEqual(self.names("durand"), ["Menuiserie Durand"])
+
+    def test_short_text(self) -> None:
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(" s "), [])
+
+    def test_max_results(self) -> None:
+        for i in range(12):
+            models.Enterprise(name="Scierie {}".format(i)).save()
+        self.assertEqual(len(self.names("scierie")), 10)
+
+    def test_prefixes_cached(self) -> None:
+        self.names("menui")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names("Menui "), ["Menuiserie Durand"])
+        # Longer texts are not cached
+        self.names("menuiserie")
+        with self.assertNumQueries(1):
+            self.names("menuiserie")
+
+    def test_autocomplete_api(self) -> None:
+        response = self.client.get(reverse("ecoliste:autocomplete_api"), {"q": "jura"})
+        self.assertEqual(response.json()["results"][0]["name"], "Scierie du Jura")
+
+
+class EnterprisePagesTestCase(TestCase):
+    def setUp(self) -> None:
+        caches["pages"].clear()
+        self.enterprise = models.Enterprise(name="Enterprise 1")
+        self.enterprise.save()
+        self.address = models.Address(
+            enterprise=self.enterprise,
+            text_version="address of enterprise 1",
+            geolocation=Point([10, 10]),
+            is_production=True,
+        )
+        self.address.save()
+        self.material = models.MaterialByEnterprise(
+            enterprise=self.enterprise, type=add_materials_types()[0], origin=1
+        )
+        self.material.save()
+        self.material.address.add(self.address)
+        self.contact = models.Contact(enterprise=self.enterprise, firstname="Jeanne")
+        self.contact.save()
+        self.url = reverse(ENTERPRISE_VIEW, args=[self.enterprise.pk])
+
+    def test_cached_page_without_queries(self) -> None:
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, "Enterprise 1")
+        self.assertContains(response, "address of enterprise 1")
+        self.assertContains(response, "[10.0, 10.0]")
+        self.assertContains(response, "Slabs")
+        self.assertContains(response, "Jeanne")
+
+    def test_only_changed_section_rendered(self) -> None:
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.contact.firstname = "Marie"
+            self.contact.save()
+        # The date of the last change, the enterprise and its contacts
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertContains(response, "Marie")
+        self.assertNotContains(response, "Jeanne")
+
+    def test_address_changed(self) -> None:
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.address.text_version = "new address of enterprise 1"
+            self.address.geolocation = Point([11, 11])
+            self.address.save()
+        response = self.client.get(self.url)
+        self.assertContains(response, "new address of enterprise 1")
+        self.assertContains(response, "[11.0, 11.0]")
+
+    def test_materials_names_changed(self) -> None:
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.material.type.name = "Planchers"
+            self.material.type.save()
+        self.assertContains(self.client.get(self.url), "Planchers")
+
+    def test_enterprise_deleted(self) -> None:
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.enterprise.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_unknown_enterprise_versions_expire(self) -> None:
+        self.assertEqual(
+            self.client.get(reverse(ENTERPRISE_VIEW, args=[99999])).status_code, 404
+        )
+        cache = caches["pages"]
+        key = enterprise_pages.version_key(99999, "identity")
+        self.assertIsNotNone(cache.get(key))
+        # The expiry of the key in the LocMemCache
+        self.assertIsNotNone(cache._expire_info[cache.make_key(key)])
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self) -> None:
+        caches["pages"].clear()
+        self.enterprise = models.Enterprise(name="Enterprise 1")
+        self.enterprise.save()
+        self.url = reverse(ENTERPRISE_VIEW, args=[self.enterprise.pk])
+
+    def test_content_updated_propagated(self) -> None:
+        contact = models.Contact(enterprise=self.enterprise, firstname="Jeanne")
+        contact.save()
+        self.enterprise.refresh_from_db()
+        self.assertIsNotNone(self.enterprise.content_updated)
+
+    def test_validators(self) -> None:
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertTrue(response["ETag"])
+        self.assertTrue(response["Last-Modified"])
+
+    def test_not_modified_etag(self) -> None:
+        etag = self.client.get(self.url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_not_modified_since(self) -> None:
+        modified = self.client.get(self.url)["Last-Modified"]
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_modified_etag(self) -> None:
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_enterprise(self) -> None:
+        url = reverse(ENTERPRISE_VIEW, args=[99999])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_json_api(self) -> None:
+        url = reverse("ecoliste:autocomplete_api")
+        etag = self.client.get(url, {"q": "enterprise"})["ETag"]
+        response = self.client.get(url, {"q": "enterprise"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class BenchSearchTestCase(TestCase):
+    def test_synthetic_dataset(self) -> None:
+        enterprises = synthetic.seed(300, random_seed=1)
+        self.assertEqual(models.Address.objects.count(), 300)
+        self.assertEqual(models.Enterprise.objects.count(), enterprises)
+        self.assertEqual(models.AddressSearchIndex.objects.count(), 300)
+        self.assertTrue(
+            models.MaterialByEnterprise.objects.filter(
+                origin=models.MaterialByEnterprise.MaterialOrigins.BIOBASED,
+                biobased_material__isnull=False,
+            ).exists()
+        )
+        # Metropolitan France
+        for address in models.Address.objects.all():
+            self.assertTrue(-6 < address.geolocation.x < 10)
+            self.assertTrue(41 < address.geolocation.y < 52)
+
+    def test_same_seed_same_dataset(self) -> None:
+        synthetic.seed(50, random_seed=2)
+        first = list(
+            models.Address.objects.order_by("pk").values_list("geolocation", flat=True)
+        )
+        synthetic.clear()
+        synthetic.seed(50, random_seed=2)
+        second = list(
+            models.Address.objects.order_by("pk").values_list("geolocation", flat=True)
+        )
+        self.assertEqual(
+            [point.coords for point in first], [point.coords for point in second]
+        )
+
+    def test_clear_keeps_real_enterprises(self) -> None:
+        models.Enterprise(name="Real enterprise").save()
+        enterprises = synthetic.seed(50)
+        self.assertEqual(synthetic.clear(), enterprises)
+        self.assertEqual(
+            list(models.Enterprise.objects.values_list("name", flat=True)),
+            ["Real enterprise"],
+        )
+        self.assertFalse(models.Address.objects.exists())
+
+    def test_synthetic_dataset_invalidates_caches(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        tiles_dir = os.path.join(directory.name, "tiles")
+        os.makedirs(os.path.join(tiles_dir, "0", "0"))
+        with override_settings(ECOLISTE_TILES_DIR=tiles_dir):
+            with self.captureOnCommitCallbacks(execute=True):
+                synthetic.seed(50)
+            self.assertFalse(os.path.exists(tiles_dir))
+            keys = {
+                search_cache.tile_key(search_cache.tile(geolocation))
+                for geolocation in models.Address.objects.values_list(
+                    "geolocation", flat=True
+                )
+            }
+            seeded = caches["search"].get_many(keys)
+            self.assertEqual(seeded.keys(), keys)
+            caches["autocomplete"].set("autocomplete:synthetic", [])
+            caches["pages"].set("enterprise-page:synthetic", "")
+            with self.captureOnCommitCallbacks(execute=True):
+                synthetic.clear()
+        cleared = caches["search"].get_many(keys)
+        self.assertTrue(all(cleared[key] != seeded[key] for key in keys))
+        self.assertIsNone(caches["autocomplete"].get("autocomplete:synthetic"))
+        self.assertIsNone(caches["pages"].get("enterprise-page:synthetic"))
+
+    def test_bench_json(self) -> None:
+        out = StringIO()
+        call_command(
+            "bench_search",
+            "--seed=200",
+            "--locations=2",
+            "--radius",
+            "20",
+            "100",
+            "--repeat=2",
+            "--json",
+            "--clear",
+            stdout=out,
+            stderr=StringIO(),
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["dataset"]["addresses"], 200)
+        self.assertEqual(report["locations"], 2)
+        # 2 distances, 7 filters, 2 modes
+        self.assertEqual(len(report["results"]), 28)
+        for result in report["results"]:
+            self.assertLessEqual(result["p50"], result["p95"])
+            self.assertLessEqual(result["p95"], result["p99"])
+            self.assertEqual(result["queries"], 1)
+            self.assertIsInstance(result["rows_scanned"], int)
+        self.assertFalse(models.Enterprise.objects.exists())
+
+
+class ServerTimingTestCase(TestCase):
+    def setUp(self) -> None:
+        caches["pages"].clear()
+        self.enterprise = models.Enterprise(name="Enterprise 1")
+        self.enterprise.save()
+        self.url = reverse(ENTERPRISE_VIEW, args=[self.enterprise.pk])
+
+    def timing(self, response) -> dict[str, str]:
+        return {
+            metric.split(";", 1)[0]: metric.split(";", 1)[1]
+            for metric in response["Server-Timing"].split(", ")
+        }
+
+    def test_server_timing(self) -> None:
+        timing = self.timing(self.client.get(self.url))
+        self.assertEqual(set(timing), {"sql", "tpl", "cache", "total"})
+        self.assertRegex(timing["sql"], r'^dur=[0-9.]+;desc="[1-9][0-9]* queries"$')
+        self.assertRegex(timing["tpl"], r"^dur=[0-9.]+$")
+        self.assertIn("misses", timing["cache"])
+
+    def test_cached_page(self) -> None:
+        self.client.get(self.url)
+        timing = self.timing(self.client.get(self.url))
+        self.assertIn('desc="0 queries"', timing["sql"])
+        self.assertIn(" 0 misses", timing["cache"])
+
+    @override_settings(ECOLISTE_TIMING_SAMPLE_RATE=0)
+    def test_not_sampled(self) -> None:
+        self.assertNotIn("Server-Timing", self.client.get(self.url))
+
+    @override_settings(ECOLISTE_TIMING_LOG_THRESHOLD=0)
+    def test_log(self) -> None:
+        with self.assertLogs("ecoliste.timing", "INFO") as logs:
+            self.client.get(self.url)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line["path"], self.url)
+        self.assertEqual(line["status"], 200)
+        self.assertGreater(line["queries"], 0)
+        self.assertEqual(line["cache pages miss"], 5)
+
+    @override_settings(ECOLISTE_TIMING_LOG_THRESHOLD=60000)
+    def test_fast_requests_not_logged(self) -> None:
+        with self.assertNoLogs("ecoliste.timing", "INFO"):
+            self.client.get(self.url)
+
+    def test_record_outside_requests(self) -> None:
+        instrumentation.record("queries")
+        with instrumentation.measure() as metrics:
+            instrumentation.record("queries")
+            instrumentation.cache_lookup("search", hit=True)
+        self.assertEqual(metrics, {"queries": 1, "cache search hit": 1})
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self) -> None:
+        search_cache.search_cache().clear()
+        self.url = reverse("ecoliste:metrics")
+        self.staff = User.objects.create_user("staff", is_staff=True)
+        self.client.force_login(self.staff)
+        self.enterprise = models.Enterprise(name="Enterprise")
+        self.enterprise.save()
+        models.Address(
+            enterprise=self.enterprise,
+            text_version="Address",
+            geolocation=Point([0.1, 0]),
+            is_production=True,
+        ).save()
+
+    def samples(self) -> dict[str, float]:
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        return {
+            line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in response.content.decode().splitlines()
+            if not line.startswith("#")
+        }
+
+    def test_reserved_to_staff_and_token(self) -> None:
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        with override_settings(ECOLISTE_METRICS_TOKEN="secret"):
+            response = self.client.get(self.url, HTTP_AUTHORIZATION="Bearer secret")
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(self.url, HTTP_AUTHORIZATION="Bearer other")
+            self.assertEqual(response.status_code, 403)
+        user = User.objects.create_user("user")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_request_duration(self) -> None:
+        sample = 'ecoliste_request_duration_seconds_count{view="ecoliste:about"}'
+        before = self.samples().get(sample, 0)
+        self.client.get(reverse("ecoliste:about"))
+        samples = self.samples()
+        self.assertEqual(samples[sample], before + 1)
+        self.assertEqual(
+            samples[
+                'ecoliste_request_duration_seconds_bucket{view="ecoliste:about",le="+Inf"}'
+            ],
+            samples[sample],
+        )
+
+    def test_search(self) -> None:
+        count = 'ecoliste_search_results_count{filters="none"}'
+        total = 'ecoliste_search_results_sum{filters="none"}'
+        miss = 'ecoliste_cache_lookups_total{cache="search",result="miss"}'
+        before = self.samples()
+        parameters = {"lon": 0, "lat": 0, "distance": 100}
+        self.client.get(reverse("ecoliste:search_api"), parameters)
+        samples = self.samples()
+        self.assertEqual(samples[count], before.get(count, 0) + 1)
+        self.assertEqual(samples[total], before.get(total, 0) + 1)
+        self.assertEqual(samples[miss], before.get(miss, 0) + 1)
+        self.assertIn('ecoliste_search_duration_seconds_count{filters="none"}', samples)
+        self.assertIn('ecoliste_cache_hit_ratio{cache="search"}', samples)
+
+    def test_processes_added_up(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sample = 'ecoliste_cache_lookups_total{cache="other",result="hit"}'
+        with override_settings(ECOLISTE_METRICS_DIR=directory.name):
+            other_process = metrics.sample_key(
+                "ecoliste_cache_lookups_total", {"cache": "other", "result": "hit"}
+            )
+            with open(os.path.join(directory.name, "1-other.json"), "w") as file:
+                json.dump({other_process: 3}, file)
+            instrumentation.cache_lookup("other", hit=True, count=2)
+            self.assertEqual(self.samples()[sample], 5)
+            self.assertEqual(len(os.listdir(directory.name)), 2)
+
+    def test_idle_process_flushed(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(setattr, metrics, "FLUSH_INTERVAL", metrics.FLUSH_INTERVAL)
+        metrics.FLUSH_INTERVAL = 0.1
+        key = metrics.sample_key(
+            "ecoliste_cache_lookups_total", {"cache": "idle", "result": "hit"}
+        )
+        with override_settings(ECOLISTE_METRICS_DIR=directory.name):
+            metrics.flush(force=True)
+            instrumentation.cache_lookup("idle", hit=True)
+            # Written without any other observation, by the pending write
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline:
+                if json.loads(metrics.process_file().read_text()).get(key) == 1:
+                    break
+                time.sleep(0.05)
+            else:
+                self.fail("The observation wasn't written")
+
+    def test_labels_escaped(self) -> None:
+        self.assertEqual(
+            metrics.format_labels([("view", 'a"b\\c')]), '{view="a\\"b\\\\c"}'
+        )
+
+
+class AsyncViewsTestCase(TestCase):
+    def setUp(self) -> None:
+        caches["pages"].clear()
+        search_cache.search_cache().clear()
+        self.enterprise = models.Enterprise(name="Enterprise 1")
+        self.enterprise.save()
+        models.Contact(enterprise=self.enterprise, firstname="Jeanne").save()
+        models.Address(
+            enterprise=self.enterprise,
+            text_version="Address",
+            geolocation=Point([0.1, 0]),
+            is_production=True,
+        ).save()
+        self.url = reverse(ENTERPRISE_VIEW, args=[self.enterprise.pk])
+
+    async def test_enterprise_page(self) -> None:
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Jeanne")
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertIn("Server-Timing", response)
+        self.assertTrue(response["ETag"])
+
+    async def test_search_api(self) -> None:
+        url = reverse("ecoliste:search_api")
+        response = await self.async_client.get(
+            url, {"lon": 0, "lat": 0, "distance": 100}
+        )
+        self.assertEqual(len(response.json()["features"]), 1)
+        response = await self.async_client.get(url, {"lon": 0, "lat": 0})
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.post(url)
+        self.assertEqual(response.status_code, 405)
+
+    def test_sections_in_transaction(self) -> None:
+        # The data of the test transaction can't be read by other connections
+        sections = async_to_sync(enterprise_pages.aenterprise_sections)(
+            self.enterprise.pk
+        )
+        self.assertIn("Jeanne", sections["contacts"])
+        caches["pages"].clear()
+        self.assertEqual(
+            sections, enterprise_pages.enterprise_sections(self.enterprise.pk)
+        )
+
+
+class ConcurrentSectionsTestCase(TransactionTestCase):
+    # Committed, so the sections can be rendered concurrently by other connections
+    def setUp(self) -> None:
+        caches["pages"].clear()
+        self.enterprise = models.Enterprise(name="Enterprise 1")
+        self.enterprise.save()
+        models.Contact(enterprise=self.enterprise, firstname="Jeanne").save()
+        models.Address(
+            enterprise=self.enterprise,
+            text_version="Address",
+            geolocation=Point([0.1, 0]),
+            is_production=True,
+        ).save()
+
+    def test_sections_rendered_concurrently(self) -> None:
+        with CaptureQueriesContext(connection) as queries:
+            sections = async_to_sync(enterprise_pages.aenterprise_sections)(
+                self.enterprise.pk
+            )
+        self.assertIn("Jeanne", sections["contacts"])
+        self.assertIn("Address", sections["addresses"])
+        # Only the enterprise is read by this thread, the sections by the others
+        self.assertEqual(len(queries), 1)
+        caches["pages"].clear()
+        self.assertEqual(
+            sections, enterprise_pages.enterprise_sections(self.enterprise.pk)
+        )
+
+
+class BenchLoadTestCase(LiveServerTestCase):
+    def setUp(self) -> None:
+        caches["pages"].clear()
+        for i in range(3):
+            enterprise = models.Enterprise(name="Enterprise {}".format(i))
+            enterprise.save()
+            models.Address(
+                enterprise=enterprise,
+                text_version="Address",
+                geolocation=Point([2.35, 48.85]),
+                is_production=True,
+            ).save()
+
+    def test_load(self) -> None:
+        out = StringIO()
+        call_command(
+            "bench_load",
+            "--url",
+            self.live_server_url,
+            "--requests",
+            20,
+            "--concurrency",
+            4,
+            "--slow-clients",
+            1,
+            "--slow-delay",
+            0.01,
+            "--locations",
+            3,
+            "--json",
+            stdout=out,
+        )
+        report = json.loads(out.getvalue())
+        results = {
+            (result["kind"], result["client"]): result for result in report["results"]
+        }
+        self.assertEqual(
+            results["search", "fast"]["requests"]
+            + results["enterprise", "fast"]["requests"],
+            20,
+        )
+        for result in report["results"]:
+            self.assertEqual(result["errors"], 0)
+        self.assertGreater(report["throughput"], 0)
+
+
+class ReplicaTestCase(TransactionTestCase):
+    # The replica is a second connection to the test database
+    databases = {"default", "replica"}
+
+    def setUp(self) -> None:
+        replicas.lags.clear()
+        caches["pages"].clear()
+        search_cache.search_cache().clear()
+        replica_settings = override_settings(ECOLISTE_REPLICAS=["replica"])
+        replica_settings.enable()
+        self.addCleanup(replica_settings.disable)
+        self.enterprise = models.Enterprise(name="Enterprise")
+        self.enterprise.save()
+        models.Address(
+            enterprise=self.enterprise,
+            text_version="Address",
+            geolocation=Point([0.1, 0]),
+            is_production=True,
+        ).save()
+
+    def test_reads_on_replica(self) -> None:
+        addresses = ecoliste_research(Point([0, 0]), 100)
+        self.assertEqual(addresses.db, "replica")
+        with CaptureQueriesContext(connections["replica"]) as queries:
+            self.assertEqual(len(addresses), 1)
+            ecoliste_facets(Point([0, 0]), 100)
+            sections = enterprise_pages.enterprise_sections(self.enterprise.pk)
+            self.assertIn("Address", sections["addresses"])
+            self.assertIsNotNone(enterprise_pages.last_modified(self.enterprise.pk))
+        self.assertGreaterEqual(len(queries), 5)
+
+    def test_writes_on_primary(self) -> None:
+        enterprise = models.Enterprise.objects.using("replica").get()
+        enterprise.name = "Renamed"
+        enterprise.save()
+        self.assertEqual(enterprise._state.db, "default")
+        self.assertEqual(models.Enterprise.objects.get().name, "Renamed")
+
+    def test_maps_on_replica(self) -> None:
+        self.assertEqual(ecoliste_nearest(Point([0, 0]), 1).db, "replica")
+        self.assertEqual(bbox_addresses((-1, -1, 1, 1)).db, "replica")
+        with self.assertNumQueries(1, using="replica"):
+            self.assertTrue(build_tile(0, 0, 0))
+
+    def test_lag_checked_at_interval(self) -> None:
+        self.assertEqual(replicas.read_database(), "replica")
+        with self.assertNumQueries(0, using="replica"):
+            self.assertEqual(replicas.read_database(), "replica")
+
+    @override_settings(ECOLISTE_REPLICA_MAX_LAG=-1)
+    def test_lagging_replica(self) -> None:
+        self.assertEqual(replicas.read_database(), "default")
+
+    def test_read_your_writes(self) -> None:
+        def edit_view(request):
+            self.enterprise.save()
+            return HttpResponse(replicas.read_database())
+
+        def read_view(request):
+            return HttpResponse(replicas.read_database())
+
+        response = ReplicaMiddleware(edit_view)(RequestFactory().get("/"))
+        self.assertEqual(response.content, b"default")
+        self.assertIn(replicas.STICKY_COOKIE, response.cookies)
+        request = RequestFactory().get("/")
+        response = ReplicaMiddleware(read_view)(request)
+        self.assertEqual(response.content, b"replica")
+        self.assertNotIn(replicas.STICKY_COOKIE, response.cookies)
+        request.COOKIES[replicas.STICKY_COOKIE] = "1"
+        self.assertEqual(ReplicaMiddleware(read_view)(request).content, b"default")
+
+    def test_other_writes_not_sticky(self) -> None:
+        def login_view(request):
+            User.objects.create_user("user").save(update_fields=["last_login"])
+            return HttpResponse(replicas.read_database())
+
+        response = ReplicaMiddleware(login_view)(RequestFactory().get("/"))
+        self.assertEqual(response.content, b"replica")
+        self.assertNotIn(replicas.STICKY_COOKIE, response.cookies)
+
+    @override_settings(ECOLISTE_REPLICA_MAX_LAG=0.01, ECOLISTE_REPLICA_CHECK_INTERVAL=0)
+    def test_invalidated_again_after_lag(self) -> None:
+        calls = []
+        called_twice = threading.Event()
+
+        def callback():
+            calls.append(time.monotonic())
+            if len(calls) == 2:
+                called_twice.set()
+
+        replicas.on_commit(callback)
+        self.assertTrue(called_twice.wait(5))
+
+    def test_lost_connection_connected_again(self) -> None:
+        replica = connections["replica"]
+        replica.ensure_connection()
+        replica.connection.close()
+        # As at the end of a request: the connection is only checked once used
+        replica.close_if_unusable_or_obsolete()
+        self.assertIsNotNone(replica.connection)
+        with replica.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            self.assertEqual(cursor.fetchone(), (1,))
+
+
+class MultisiteTestCase(TestCase):
+    def setUp(self) -> None:
+        self.url = reverse("ecoliste:multisite_api")
+        self.mat_types = add_materials_types()
+        self.sites = [Point([0, 0], srid=4326), Point([1, 0], srid=4326)]
+        self.enterprise = models.Enterprise(name="Enterprise")
+        self.enterprise.save()
+        self.other_enterprise = models.Enterprise(name="Other enterprise")
+        self.other_enterprise.save()
+        self.far_enterprise = models.Enterprise(name="Far enterprise")
+        self.far_enterprise.save()
+        for enterprise, mat_type in (
+            (self.enterprise, self.mat_types[0]),
+            (self.other_enterprise, self.mat_types[0]),
+            (self.far_enterprise, self.mat_types[1]),
+        ):
+            models.MaterialByEnterprise(
+                enterprise=enterprise,
+                type=mat_type,
+                origin=models.MaterialByEnterprise.MaterialOrigins.REUSE,
+            ).save()
+        self.addresses = {}
+        for name, enterprise, longitude in (
+            ("west", self.enterprise, 0.1),
+            ("east", self.enterprise, 0.9),
+            ("middle", self.other_enterprise, 0.5),
+            ("far", self.far_enterprise, 3),
+        ):
+            address = models.Address(
+                enterprise=enterprise,
+                text_version=name,
+                geolocation=Point([longitude, 0]),
+                is_production=True,
+            )
+            address.save()
+            self.addresses[name] = address
+
+    def test_nearest_around_each_site(self) -> None:
+        with self.assertNumQueries(2):
+            results = ecoliste_multisite_research(self.sites, number=2)
+        self.assertEqual(
+            results,
+            [
+                [self.addresses["west"], self.addresses["middle"]],
+                [self.addresses["east"], self.addresses["middle"]],
+            ],
+        )
+        self.assertAlmostEqual(results[0][0].distance.km, 11.1, delta=0.1)
+        self.assertAlmostEqual(results[1][1].distance.km, 55.7, delta=0.1)
+        # Each site has its own distance to the same address
+        self.assertAlmostEqual(results[0][1].distance.km, 55.7, delta=0.1)
+
+    def test_within_distance(self) -> None:
+        results = ecoliste_multisite_research(self.sites, distance=20)
+        self.assertEqual(results, [[self.addresses["west"]], [self.addresses["east"]]])
+
+    def test_filters(self) -> None:
+        filters = {"materials": [self.mat_types[1].pk]}
+        results = ecoliste_multisite_research(self.sites, number=5, filters=filters)
+        self.assertEqual(results, [[self.addresses["far"]], [self.addresses["far"]]])
+
+    def test_requires_distance_or_number(self) -> None:
+        with self.assertRaises(ValueError):
+            ecoliste_multisite_research(self.sites)
+
+    def test_shared_enterprises(self) -> None:
+        results = ecoliste_multisite_research(self.sites, number=2)
+        results.append([self.addresses["far"]])
+        self.assertEqual(
+            shared_enterprises(results),
+            [(self.enterprise, [0, 1]), (self.other_enterprise, [0, 1])],
+        )
+
+    def test_api(self) -> None:
+        response = self.client.get(
+            self.url, {"site": ["0,0", "1,0"], "distance": 60, "materials": ""}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            [[feature["id"] for feature in site["features"]] for site in data["sites"]],
+            [
+                [self.addresses["west"].pk, self.addresses["middle"].pk],
+                [self.addresses["east"].pk, self.addresses["middle"].pk],
+            ],
+        )
+        self.assertEqual(data["sites"][1]["site"], [1, 0])
+        self.assertEqual(
+            data["shared"],
+            [
+                {
+                    "enterprise": {"id": self.enterprise.pk, "name": "Enterprise"},
+                    "sites": [0, 1],
+                },
+                {
+                    "enterprise": {
+                        "id": self.other_enterprise.pk,
+                        "name": "Other enterprise",
+                    },
+                    "sites": [0, 1],
+                },
+            ],
+        )
+
+    def test_api_number_by_default(self) -> None:
+        data = self.client.get(self.url, {"site": "0,0"}).json()
+        self.assertEqual(len(data["sites"][0]["features"]), len(self.addresses))
+
+    def test_api_invalid_parameters(self) -> None:
+        for parameters in (
+            {},
+            {"site": "0"},
+            {"site": "0,a"},
+            {"site": "0,0,0"},
+            {"site": ["0,0"] * 51},
+            {"site": "0,0", "number": 0},
+            {"site": "0,0", "distance": "far"},
+            {"site": "0,0", "materials": "wood"},
+        ):
+            with self.subTest(parameters=parameters):
+                response = self.client.get(self.url, parameters)
+                self.assertEqual(response.status_code, 400)
+
+
+class CorridorTestCase(TestCase):
+    def setUp(self) -> None:
+        self.url = reverse("ecoliste:corridor_api")
+        self.mat_types = add_materials_types()
+        # East, then north, near Lyon for the projection
+        self.route = LineString((4, 45), (5, 45), (5, 46), srid=4326)
+        self.enterprise = models.Enterprise(name="Enterprise")
+        self.enterprise.save()
+        models.MaterialByEnterprise(
+            enterprise=self.enterprise,
+            type=self.mat_types[0],
+            origin=models.MaterialByEnterprise.MaterialOrigins.REUSE,
+        ).save()
+        self.other_enterprise = models.Enterprise(name="Other enterprise")
+        self.other_enterprise.save()
+        self.addresses = {}
+        for name, enterprise, position, is_production in (
+            ("north", self.enterprise, [5.02, 45.5], True),
+            ("east", self.enterprise, [4.8, 45.02], True),
+            ("west", self.other_enterprise, [4.2, 44.97], True),
+            ("office", self.enterprise, [4.4, 45], False),
+            ("far", self.enterprise, [4.5, 45.5], True),
+        ):
+            address = models.Address(
+                enterprise=enterprise,
+                text_version=name,
+                geolocation=Point(position),
+                is_production=is_production,
+            )
+            address.save()
+            self.addresses[name] = address
+
+    def test_ordered_along_the_route(self) -> None:
+        for projected in (False, True):
+            with self.subTest(projected=projected):
+                with self.assertNumQueries(1):
+                    addresses = list(
+                        ecoliste_corridor_research(self.route, 5, projected=projected)
+                    )
+                self.assertEqual(
+                    addresses,
+                    [
+                        self.addresses["west"],
+                        self.addresses["east"],
+                        self.addresses["north"],
+                    ],
+                )
+                self.assertAlmostEqual(addresses[1].distance.km, 2.2, delta=0.1)
+                self.assertLess(addresses[1].position, 0.5)
+                self.assertGreater(addresses[2].position, 0.5)
+
+    def test_filters_and_offices(self) -> None:
+        filters = {"materials": [self.mat_types[0].pk]}
+        addresses = ecoliste_corridor_research(self.route, 5, filters)
+        self.assertEqual(
+            list(addresses), [self.addresses["east"], self.addresses["north"]]
+        )
+        addresses = ecoliste_corridor_research(
+            self.route, 5, filters, production_only=False
+        )
+        self.assertIn(self.addresses["office"], addresses)
+
+    def test_api(self) -> None:
+        response = self.client.get(
+            self.url, {"point": ["4,45", "5,45", "5,46"], "distance": 5}
+        )
+        self.assertEqual(response.status_code, 200)
+        features = response.json()["features"]
+        self.assertEqual(
+            [feature["id"] for feature in features],
+            [
+                self.addresses["west"].pk,
+                self.addresses["east"].pk,
+                self.addresses["north"].pk,
+            ],
+        )
+        self.assertAlmostEqual(features[0]["properties"]["position"], 0.1, delta=0.01)
+
+    def test_api_invalid_parameters(self) -> None:
+        for parameters in (
+            {"distance": 5},
+            {"point": "4,45", "distance": 5},
+            {"point": ["4,45", "5,a"], "distance": 5},
+            {"point": ["4,45", "5,45"]},
+            {"point": ["4,45", "5,45"], "distance": -1},
+            {"point": ["4,45", "5,45"], "distance": 5, "materials": "wood"},
+        ):
+            with self.subTest(parameters=parameters):
+                response = self.client.get(self.url, parameters)
+                self.assertEqual(response.status_code, 400)
+
+
+def area_feature(
+    properties: dict, west: float, south: float, east: float, north: float
+) -> dict:
+    return {
+        "type": "Feature",
+        "properties": properties,
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [
+                [
+                    [west, south],
+                    [east, south],
+                    [east, north],
+                    [west, north],
+                    [west, south],
+                ]
+            ],
+        },
+    }
+
+
+class BoundariesTestCase(TestCase):
+    def setUp(self) -> None:
+        search_cache.search_cache().clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.departements = [
+            area_feature(
+                {"code": "69", "nom": "Rhône", "codeRegion": "84"}, 4.2, 45.4, 5.2, 46.3
+            ),
+            area_feature(
+                {"code": "38", "nom": "Isère", "codeRegion": "84"}, 4.7, 44.7, 6.3, 45.4
+            ),
+        ]
+        # Without their département and région, as some files
+        self.communes = [
+            area_feature({"code": "69123", "nom": "Lyon"}, 4.77, 45.7, 4.9, 45.8),
+            area_feature(
+                {"code": "69266", "nom": "Villeurbanne"}, 4.9, 45.7, 4.95, 45.8
+            ),
+            area_feature(
+                {"code": "38185", "nom": "Grenoble"}, 5.67, 45.15, 5.75, 45.22
+            ),
+        ]
+        boundaries.import_boundaries(
+            [self.write("departements", self.departements)], "departement"
+        )
+        boundaries.import_boundaries([self.write("communes", self.communes)], "commune")
+        enterprise = models.Enterprise(name="Enterprise")
+        enterprise.save()
+        self.addresses = {}
+        for name, position in (
+            ("lyon", [4.835, 45.758]),
+            ("villeurbanne", [4.93, 45.771]),
+            ("grenoble", [5.724, 45.188]),
+            ("sea", [4, 43]),
+        ):
+            address = models.Address(
+                enterprise=enterprise,
+                text_version=name,
+                geolocation=Point(position),
+                is_production=True,
+            )
+            address.save()
+            self.addresses[name] = address
+
+    def write(self, name: str, features: list[dict]) -> str:
+        path = os.path.join(self.directory.name, "{}.geojson".format(name))
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"type": "FeatureCollection", "features": features}, file)
+        return path
+
+    def areas(self, address: models.Address) -> tuple:
+        index = models.AddressSearchIndex.objects.get(address=address)
+        return index.commune, index.departement, index.region
+
+    def test_import(self) -> None:
+        self.assertEqual(models.AdministrativeArea.objects.count(), 5)
+        lyon = models.AdministrativeArea.objects.get(kind="commune", code="69123")
+        self.assertEqual(
+            (lyon.name, lyon.departement, lyon.region), ("Lyon", "69", "84")
+        )
+        self.assertEqual(lyon.geometry.geom_type, "MultiPolygon")
+        self.assertIsNotNone(lyon.geometry_medium)
+        self.assertIsNotNone(lyon.geometry_low)
+
+    def test_addresses_located_when_indexed(self) -> None:
+        self.assertEqual(self.areas(self.addresses["lyon"]), ("69123", "69", "84"))
+        self.assertEqual(self.areas(self.addresses["grenoble"]), ("38185", "38", "84"))
+        self.assertEqual(self.areas(self.addresses["sea"]), (None, None, None))
+        address = self.addresses["sea"]
+        address.geolocation = Point([5.7, 45.2])
+        address.save()
+        self.assertEqual(self.areas(address), ("38185", "38", "84"))
+
+    def test_addresses_located_again_on_import(self) -> None:
+        boundaries.import_boundaries(
+            [self.write("communes", self.communes[1:])], "commune"
+        )
+        self.assertEqual(self.areas(self.addresses["lyon"]), (None, None, None))
+        self.assertEqual(
+            self.areas(self.addresses["villeurbanne"]), ("69266", "69", "84")
+        )
+
+    def test_rebuild_locates_addresses(self) -> None:
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(
+            self.areas(self.addresses["villeurbanne"]), ("69266", "69", "84")
+        )
+
+    def test_search_inside_areas(self) -> None:
+        search_location = Point([5, 45.5])
+        for filters, expected in (
+            ({"departement": ["69"]}, ["villeurbanne", "lyon"]),
+            ({"commune": ["38185", "69123"]}, ["lyon", "grenoble"]),
+            ({"region": ["84"], "departement": ["38"]}, ["grenoble"]),
+            ({"region": ["11"]}, []),
+        ):
+            with self.subTest(filters=filters):
+                addresses = ecoliste_research(search_location, 100, filters)
+                self.assertEqual(
+                    list(addresses), [self.addresses[name] for name in expected]
+                )
+
+    def test_querydict_filters(self) -> None:
+        filters = querydict_filters(
+            QueryDict("departement=69&departement=2A&departement=&commune=+")
+        )
+        self.assertEqual(filters, {"departement": ["69", "2A"]})
+
+    def test_search_api(self) -> None:
+        response = self.client.get(
+            reverse("ecoliste:search_api"),
+            {"lon": 5, "lat": 45.5, "distance": 100, "departement": "38"},
+        )
+        ids = [feature["id"] for feature in response.json()["features"]]
+        self.assertEqual(ids, [self.addresses["grenoble"].pk])
+
+    def test_command_invalid_file(self) -> None:
+        path = self.write(
+            "points",
+            [
+                {
+                    "type": "Feature",
+                    "properties": {"code": "1"},
+                    "geometry": {"type": "Point", "coordinates": [0, 0]},
+                }
+            ],
+        )
+        with self.assertRaises(CommandError):
+            call_command("import_boundaries", "commune", path, stdout=StringIO())
+        # Nothing is replaced
+        self.assertEqual(
+            models.AdministrativeArea.objects.filter(kind="commune").count(), 3
+        )
+
+
+class MaterialSummaryTestCase(TestCase):
+    def setUp(self) -> None:
+        self.mat_types = add_materials_types()
+        self.bio_origins = add_biobased_origins()
+        self.enterprise = models.Enterprise(name="Enterprise")
+        self.enterprise.save()
+        self.reused = models.MaterialByEnterprise(
+            enterprise=self.enterprise,
+            type=self.mat_types[2],
+            origin=models.MaterialByEnterprise.MaterialOrigins.REUSE,
+        )
+        self.reused.save()
+        self.biobased = models.MaterialByEnterprise(
+            enterprise=self.enterprise,
+            type=self.mat_types[0],
+            origin=models.MaterialByEnterprise.MaterialOrigins.BIOBASED,
+        )
+        self.biobased.save()
+        self.biobased.biobased_material.add(*self.bio_origins)
+        models.Address(
+            enterprise=self.enterprise,
+            text_version="Address",
+            geolocation=Point([0, 0]),
+            is_production=True,
+        ).save()
+
+    def summary(self) -> dict:
+        self.enterprise.refresh_from_db()
+        return self.enterprise.material_summary
+
+    def test_summary(self) -> None:
+        self.assertEqual(
+            self.summary(),
+            {
+                "categories": ["Structure", "Isolation"],
+                "origins": [1, 2],
+                "biobased": ["Cotton", "Wood"],
+            },
+        )
+        self.assertEqual(
+            self.enterprise.material_overview(),
+            {
+                "categories": ["Structure", "Isolation"],
+                "origins": ["De réemploi", "Biosourcé"],
+                "biobased": ["Cotton", "Wood"],
+            },
+        )
+
+    def test_new_enterprise(self) -> None:
+        enterprise = models.Enterprise.objects.create(name="New")
+        enterprise.refresh_from_db()
+        self.assertEqual(
+            enterprise.material_summary,
+            {"categories": [], "origins": [], "biobased": []},
+        )
+
+    def test_products_changes(self) -> None:
+        self.biobased.biobased_material.remove(self.bio_origins[1])
+        self.assertEqual(self.summary()["biobased"], ["Wood"])
+        self.reused.delete()
+        self.assertEqual(self.summary()["categories"], ["Structure"])
+        self.assertEqual(self.summary()["origins"], [2])
+        self.biobased.type = self.mat_types[3]
+        self.biobased.save()
+        self.assertEqual(self.summary()["categories"], ["Isolation"])
+
+    def test_names_changes(self) -> None:
+        category = self.mat_types[0].category
+        category.name = "Gros œuvre"
+        category.save()
+        self.bio_origins[0].name = "Bois"
+        self.bio_origins[0].save()
+        summary = self.summary()
+        self.assertEqual(summary["categories"], ["Gros œuvre", "Isolation"])
+        self.assertEqual(summary["biobased"], ["Bois", "Cotton"])
+        category.delete()
+        self.assertEqual(self.summary()["categories"], ["Isolation"])
+
+    def test_save_with_stale_summary(self) -> None:
+        enterprise = models.Enterprise.objects.get(pk=self.enterprise.pk)
+        self.reused.delete()
+        enterprise.name = "Renamed"
+        enterprise.save()
+        self.assertEqual(self.summary()["origins"], [2])
+
+    def test_search_results_in_one_query(self) -> None:
+        with self.assertNumQueries(1):
+            features = [
+                address_feature(address)
+                for address in ecoliste_research(Point([0, 0]), 10)
+            ]
+        self.assertEqual(
+            features[0]["properties"]["enterprise"]["categories"],
+            ["Structure", "Isolation"],
+        )
+
+
+class ExportTestCase(TestCase):
+    def setUp(self) -> None:
+        self.mat_types = add_materials_types()
+        self.bio_origins = add_biobased_origins()
+        self.enterprise = models.Enterprise(
+            name="Enterprise", n_employees=models.Enterprise.NEmployees.SMALL
+        )
+        self.enterprise.save()
+        self.address = models.Address(
+            enterprise=self.enterprise,
+            text_version="Address",
+            geolocation=Point([2, 48]),
+            is_production=True,
+        )
+        self.address.save()
+        self.material = models.MaterialByEnterprise(
+            enterprise=self.enterprise,
+            type=self.mat_types[0],
+            origin=models.MaterialByEnterprise.MaterialOrigins.BIOBASED,
+        )
+        self.material.save()
+        self.material.address.add(self.address)
+        self.material.biobased_material.add(self.bio_origins[0])
+        models.Contact(enterprise=self.enterprise, firstname="Jean").save()
+        self.empty_enterprise = models.Enterprise(name="Empty Enterprise")
+        self.empty_enterprise.save()
+
+    def export(self, export_format: str) -> str:
+        output = StringIO()
+        call_command("export_catalogue", export_format, stdout=output)
+        return output.getvalue()
+
+    def test_export_jsonl(self) -> None:
+        records = [json.loads(line) for line in self.export("jsonl").splitlines()]
+        self.assertEqual(len(records), 2)
+        record = next(record for record in records if record["name"] == "Enterprise")
+        self.assertEqual(record["n_employees"], "10 - 49")
+        self.assertEqual(record["addresses"][0]["longitude"], 2)
+        self.assertEqual(record["materials"][0]["type"], self.mat_types[0].name)
+        self.assertEqual(record["materials"][0]["biobased"], ["Wood"])
+        self.assertEqual(record["materials"][0]["addresses"], [self.address.pk])
+        self.assertEqual(record["contacts"][0]["firstname"], "Jean")
+
+    def test_export_csv(self) -> None:
+        rows = list(csv.DictReader(StringIO(self.export("csv"))))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]["text_version"], "Address")
+        self.assertIn(self.mat_types[0].name, rows[0]["materials"])
+        self.assertEqual(rows[1]["enterprise_name"], "Empty Enterprise")
+        self.assertEqual(rows[1]["address_id"], "")
+
+    def test_export_geojson(self) -> None:
+        data = json.loads(self.export("geojson"))
+        self.assertEqual(len(data["features"]), 1)
+        self.assertEqual(data["features"][0]["geometry"]["coordinates"], [2, 48])
+
+    def test_export_view_streams(self) -> None:
+        url = reverse("ecoliste:export", args=["jsonl"])
+        self.assertEqual(self.client.get(url).status_code, 302)
+        staff = User.objects.create_user("staff", password="password", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(len(content.splitlines()), 2)
+        unknown = reverse("ecoliste:export", args=["xml"])
+        self.assertEqual(self.client.get(unknown).status_code, 404)
+
+    async def test_export_view_streams_asynchronously(self) -> None:
+        # Read on the event loop, as under ASGI: the queries must run in a thread
+        staff = await sync_to_async(User.objects.create_user)(
+            "staff", password="password", is_staff=True
+        )
+        await sync_to_async(self.async_client.force_login)(staff)
+        url = reverse("ecoliste:export", args=["geojson"])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        content = b"".join([part async for part in response]).decode()
+        features = json.loads(content)["features"]
+        self.assertEqual([feature["id"] for feature in features], [self.address.pk])
+
+
+class ImportSuppliersTestCase(TestCase):
+    def setUp(self) -> None:
+        self.mat_types = add_materials_types()
+        self.bio_origins = add_biobased_origins()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def record(self, i: int) -> dict:
+        return {
+            "name": "Enterprise {}".format(i),
+            "website": "https://enterprise{}.com".format(i),
+            "n_employees": "10 - 49",
+            "annual_sales": 2,
+            "addresses": [
+                {
+                    "id": 1,
+                    "text_version": "Site {}".format(i),
+                    "is_production": True,
+                    "longitude": 2,
+                    "latitude": 48 + i / 100,
+                }
+            ],
+            "materials": [
+                {
+                    "type": self.mat_types[0].name,
+                    "origin": models.MaterialByEnterprise.MaterialOrigins.BIOBASED,
+                    "biobased": [self.bio_origins[0].name],
+                    "addresses": [1],
+                }
+            ],
+            "contacts": [{"firstname": "Jean", "mail": "jean@example.com"}],
+        }
+
+    def write(self, name: str, content: str) -> str:
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def write_jsonl(self, records: list[dict]) -> str:
+        return self.write(
+            "suppliers.jsonl", "".join(json.dumps(record) + "\n" for record in records)
+        )
+
+    def import_file(self, path: str, *args) -> str:
+        output = StringIO()
+        call_command("import_suppliers", path, *args, stdout=output, stderr=output)
+        return output.getvalue()
+
+    def test_import_creates_everything(self) -> None:
+        self.import_file(self.write_jsonl([self.record(1), self.record(2)]))
+        enterprise = models.Enterprise.objects.get(name="Enterprise 1")
+        self.assertEqual(enterprise.n_employees, models.Enterprise.NEmployees.SMALL)
+        address = enterprise.addresses.get()
+        self.assertEqual(address.geolocation_projected.srid, 2154)
+        material = enterprise.products.get()
+        self.assertEqual(list(material.address.all()), [address])
+        self.assertEqual(list(material.biobased_material.all()), [self.bio_origins[0]])
+        self.assertEqual(enterprise.contacts.get().mail, "jean@example.com")
+        index = models.AddressSearchIndex.objects.get(address=address)
+        self.assertEqual(index.biobased, [self.bio_origins[0].pk])
+
+    def test_import_is_idempotent(self) -> None:
+        path = self.write_jsonl([self.record(1), self.record(2)])
+        self.import_file(path)
+        output = self.import_file(path)
+        self.assertIn("2 enterprises updated", output)
+        self.assertEqual(models.Enterprise.objects.count(), 2)
+        self.assertEqual(models.Address.objects.count(), 2)
+        self.assertEqual(models.MaterialByEnterprise.objects.count(), 2)
+        self.assertEqual(models.Contact.objects.count(), 2)
+
+    def test_import_matches_by_name_without_website(self) -> None:
+        models.Enterprise(name="Enterprise 1").save()
+        self.import_file(self.write_jsonl([self.record(1)]))
+        self.assertEqual(models.Enterprise.objects.count(), 1)
+        self.assertEqual(
+            models.Enterprise.objects.get().website, "https://enterprise1.com"
+        )
+
+    def test_import_keeps_same_names_with_different_websites(self) -> None:
+        models.Enterprise(name="Enterprise 1", website="https://other.com").save()
+        homonyms = [self.record(1), self.record(2)]
+        homonyms[1]["name"] = "Enterprise 1"
+        self.import_file(self.write_jsonl(homonyms))
+        self.assertCountEqual(
+            models.Enterprise.objects.filter(name="Enterprise 1").values_list(
+                "website", flat=True
+            ),
+            ["https://other.com", "https://enterprise1.com", "https://enterprise2.com"],
+        )
+        other = models.Enterprise.objects.get(website="https://other.com")
+        self.assertFalse(other.addresses.exists())
+
+    def test_dry_run_saves_nothing(self) -> None:
+        output = self.import_file(self.write_jsonl([self.record(1)]), "--dry-run")
+        self.assertIn("1 enterprises created", output)
+        self.assertFalse(models.Enterprise.objects.exists())
+
+    def test_invalid_records_reported(self) -> None:
+        invalid = self.record(2)
+        invalid["materials"][0]["type"] = "Unknown"
+        output = self.import_file(self.write_jsonl([self.record(1), invalid]))
+        self.assertIn("Record 2: Unknown material type", output)
+        self.assertEqual(models.Enterprise.objects.count(), 1)
+
+    def test_queries_do_not_depend_on_records(self) -> None:
+        queries = []
+        for first, number in ((0, 5), (100, 50)):
+            records = [self.record(i) for i in range(first, first + number)]
+            path = self.write_jsonl(records)
+            with CaptureQueriesContext(connection) as context:
+                self.import_file(path)
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_import_export_round_trip(self) -> None:
+        self.import_file(self.write_jsonl([self.record(1), self.record(2)]))
+        for export_format in ("jsonl", "csv"):
+            exported = StringIO()
+            call_command("export_catalogue", export_format, stdout=exported)
+            path = self.write("export." + export_format, exported.getvalue())
+            output = self.import_file(path)
+            self.assertIn("2 enterprises updated", output)
+            self.assertNotIn("created", output)
@@ -0,0 +1,164 @@
+"""
+Mapbox Vector Tiles of all the addresses, for the maps to show every supplier while only loading the visible tiles.
+
+The tiles are built by PostGIS from the search index, with compact properties: the enterprise id, whether the address
+is a production site, and the origins of the enterprise materials as a bitmask, bit n - 1 standing for the origin n.
+
+Built tiles are stored in ECOLISTE_TILES_DIR, as {z}/{x}/{y}.mvt files. When addresses change, the tiles containing
+them are removed at every zoom level, and built again on the next request.
+"""
+
+import math
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import connections
+
+from . import instrumentation, replicas
+
+MAX_ZOOM = 22
+
+# The size of a tile in its own coordinates, and the margin around it with the points drawn across its edges
+EXTENT = 4096
+BUFFER = 256
+
+# Below this zoom level, the tiles are too large for their envelope to be used as a geography
+MIN_INDEXED_ZOOM = 4
+
+TILE_SQL = """
+WITH bounds AS (
+    SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS envelope
+),
+features AS (
+    SELECT
+        ST_AsMVTGeom(
+            ST_Transform(search_index.geolocation::geometry, 3857),
+            bounds.envelope,
+            %(extent)s,
+            %(buffer)s
+        ) AS geom,
+        search_index.enterprise_id AS enterprise,
+        search_index.is_production AS production,
+        (
+            SELECT COALESCE(bit_or(1 << (origin - 1)), 0)
+            FROM unnest(search_index.origins) AS origin
+        ) AS origins
+    FROM ecoliste_addresssearchindex search_index, bounds
+    WHERE {where}
+)
+SELECT ST_AsMVT(features, 'addresses', %(extent)s, 'geom')
+FROM features
+WHERE geom IS NOT NULL
+"""
+
+# Uses the spatial index, with a margin as the edges of a geography polygon aren't parallels
+INDEXED_WHERE = """
+search_index.geolocation && ST_Transform(
+    ST_Expand(bounds.envelope, (ST_XMax(bounds.envelope) - ST_XMin(bounds.envelope)) / 4), 4326
+)::geography
+"""
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def build_tile(z: int, x: int, y: int) -> bytes:
+    """
+    Builds a tile from the database.
+    :return: The tile, empty if it has no address.
+    """
+    sql = TILE_SQL.format(where=INDEXED_WHERE if z >= MIN_INDEXED_ZOOM else "TRUE")
+    with connections[replicas.read_database()].cursor() as cursor:
+        cursor.execute(
+            sql, {"z": z, "x": x, "y": y, "extent": EXTENT, "buffer": BUFFER}
+        )
+        tile = cursor.fetchone()[0]
+    return bytes(tile) if tile else b""
+
+
+def tile_path(z: int, x: int, y: int) -> Optional[Path]:
+    tiles_dir = settings.ECOLISTE_TILES_DIR
+    if not tiles_dir:
+        return None
+    return Path(tiles_dir, str(z), str(x), "{}.mvt".format(y))
+
+
+def get_tile(z: int, x: int, y: int) -> bytes:
+    """
+    Gets a tile from the disk, or builds it and stores it.
+    """
+    path = tile_path(z, x, y)
+    if path is None:
+        return build_tile(z, x, y)
+    try:
+        tile = path.read_bytes()
+        instrumentation.cache_lookup("tiles", hit=True)
+        return tile
+    except FileNotFoundError:
+        instrumentation.cache_lookup("tiles", hit=False)
+    tile = build_tile(z, x, y)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written aside and renamed, so a concurrent request never reads half a tile
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as file:
+        file.write(tile)
+    os.replace(file.name, path)
+    return tile
+
+
+def point_tiles(point: Point) -> set[tuple[int, int, int]]:
+    """
+    The tiles containing a point at every zoom level, including the ones where it is drawn in the buffer.
+    :param point: A WGS84 point.
+    """
+    latitude = max(min(point.y, 85.0511), -85.0511)
+    # The position in the world, from 0 to 1, in Web Mercator
+    world_x = (point.x + 180) / 360
+    world_y = (1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2
+    margin = BUFFER / EXTENT
+    tiles = set()
+    for z in range(MAX_ZOOM + 1):
+        n = 2**z
+        for dx in (-margin, margin):
+            for dy in (-margin, margin):
+                x = math.floor(world_x * n + dx)
+                y = math.floor(world_y * n + dy)
+                if 0 <= x < n and 0 <= y < n:
+                    tiles.add((z, x, y))
+    return tiles
+
+
+def invalidate_points(points: Iterable[Point]) -> None:
+    """
+    Removes the stored tiles containing some locations, once the current transaction is committed, and again once the
+    replicas have caught up, see replicas.on_commit.
+    :param points: The WGS84 locations of the addresses that changed.
+    """
+    if not settings.ECOLISTE_TILES_DIR:
+        return
+    tiles = set()
+    for point in points:
+        if point is not None:
+            tiles |= point_tiles(point)
+
+    def remove_tiles():
+        for tile in tiles:
+            tile_path(*tile).unlink(missing_ok=True)
+
+    if tiles:
+        replicas.on_commit(remove_tiles)
+
+
+def clear() -> None:
+    """
+    Removes all the stored tiles, once the current transaction is committed, and again once the replicas have caught up.
+    """
+    if settings.ECOLISTE_TILES_DIR:
+        replicas.on_commit(
+            lambda: shutil.rmtree(settings.ECOLISTE_TILES_DIR, ignore_errors=True)
+        )
@@ -6,9 +6,19 @@ from . import views
 app_name = "ecoliste"
 urlpatterns = [
     path(_(""), views.search_view, name="search"),
+    path(_("api/search/"), views.search_api_view, name="search_api"),
+    path(_("api/multisite/"), views.multisite_api_view, name="multisite_api"),
+    path(_("api/corridor/"), views.corridor_api_view, name="corridor_api"),
+    path(_("api/facets/"), views.facets_api_view, name="facets_api"),
+    path(_("api/geocode/"), views.geocode_api_view, name="geocode_api"),
+    path(_("api/autocomplete/"), views.autocomplete_api_view, name="autocomplete_api"),
+    path(_("api/clusters/"), views.clusters_api_view, name="clusters_api"),
+    path(_("tiles/<int:z>/<int:x>/<int:y>.mvt"), views.tile_view, name="tile"),
     path(
         _("entreprise/<int:enterprise_id>/"), views.enterprise_view, name="enterprise"
     ),
+    path(_("export/<str:export_format>/"), views.export_view, name="export"),
+    path("metrics", views.metrics_view, name="metrics"),
     path(_("about"), views.about_view, name="about"),
     path(_("legal"), views.about_view, name="legal"),
     path(_("contact"), views.about_view, name="contact"),
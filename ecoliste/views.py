@@ -1,105 +1,460 @@
-from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse, HttpRequest, QueryDict
-from django.core.serializers import serialize
-from django.contrib.gis.measure import D
-from django.contrib.gis.geos import Point
-from .models import Enterprise, Address
-
-
-def ecoliste_research(
-    search_location: Point, distance: int, filters: dict = None
-) -> list[Address]:
-    """
-    The search of addresses corresponding to the user desired parameters.
-
-    :param search_location: A geolocation using a Point object from django.contrib.gis.geos
-    :param distance: The distance around the search location, in kilometers
-    :param filters: A dictionary containing all available parameters from the models: material types, origin, enterprise
-    size… Some parameters (materials, origin, biobased), who can have multiple values at once, need to be organized
-    through the form filters[key] = [list of values] even if there is only one value. There should not be empty values
-    or [""] values coming from a QueryDict. Other parameters (nemployees, sales) are ranges, therefore they need their
-    2 values to be passed as a tuple.
-    :return: A list of Address objects.
-    """
-    addresses = Address.objects.filter(
-        geolocation__distance_lte=(search_location, D(km=distance))
-    )
-    if filters:
-        if "materials" in filters.keys():
-            # This parameter needs to be passed as a list
-            addresses = addresses.filter(
-                enterprise__products__type_id__in=filters["materials"]
-            )
-        if "origin" in filters.keys():
-            # This parameter needs to be passed as a list
-            addresses = addresses.filter(
-                enterprise__products__origin__in=filters["origin"]
-            )
-        if "biobased" in filters.keys():
-            # This parameter needs to be passed as a list
-            addresses = addresses.filter(
-                enterprise__products__biobased_material__id__in=filters["biobased"]
-            )
-        if "nemployees" in filters.keys():
-            # This parameter needs to be passed as a tuple
-            addresses = addresses.filter(
-                enterprise__n_employees__range=filters["nemployees"]
-            )
-        if "sales" in filters.keys():
-            # This parameter needs to be passed as a tuple
-            addresses = addresses.filter(
-                enterprise__annual_sales__range=filters["sales"]
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.shortcuts import render
+from django.http import (
+    HttpResponse,
+    HttpRequest,
+    JsonResponse,
+    HttpResponseNotAllowed,
+    Http404,
+)
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import BadRequest, PermissionDenied
+from django.contrib.gis.geos import LineString, Point
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET
+from . import metrics
+from .autocomplete import autocomplete
+from .clusters import bbox_addresses, clusters, view_too_large
+from .enterprise_pages import aenterprise_sections, last_modified
+from .export import EXPORT_FORMATS, export_lines
+from .facets import ecoliste_facets
+from .geocoder import geocode
+from .models import Address
+from .search import (
+    ecoliste_corridor_research,
+    ecoliste_multisite_research,
+    querydict_filters,
+    shared_enterprises,
+)
+from .search_cache import cached_page
+from .streaming import AsyncStreamingHttpResponse
+from .tiles import get_tile, valid_tile
+
+# Number of addresses per page of the search API, by default and at most
+SEARCH_API_PAGE_SIZE = 50
+SEARCH_API_MAX_PAGE_SIZE = 200
+
+# Number of sites of the multi-site search API, and of addresses around each of them, by default and at most
+MULTISITE_MAX_SITES = 50
+MULTISITE_NUMBER = 10
+MULTISITE_MAX_NUMBER = 100
+
+# Number of points of the route of the corridor search API, at most
+CORRIDOR_MAX_POINTS = 500
+
+
+def search_view(request: HttpRequest) -> HttpResponse:
+    return render(request, "ecoliste/search.html")
+
+
+def search_parameters(request: HttpRequest) -> tuple[Point, float]:
+    """
+    Reads the search location and distance from the query string.
+    :param request: A request with the lon and lat parameters, or an address to geocode, and the distance (in
+    kilometers) parameter.
+    :return: The search location and distance.
+    :raise BadRequest: If a parameter is missing or invalid, or if the address is not found.
+    """
+    if "lon" not in request.GET and request.GET.get("address"):
+        results = geocode(request.GET["address"], limit=1)
+        if not results:
+            raise BadRequest("Address not found.")
+        location = results[0].point
+    else:
+        try:
+            location = Point(
+                float(request.GET["lon"]), float(request.GET["lat"]), srid=4326
             )
-    return addresses
+        except (KeyError, ValueError):
+            raise BadRequest("lon and lat, or address, parameters are required.")
+    try:
+        distance = float(request.GET["distance"])
+    except (KeyError, ValueError):
+        raise BadRequest("distance parameter is a required number.")
+    if distance <= 0:
+        raise BadRequest("distance must be positive.")
+    return location, distance
 
 
-def ecoliste_research_querydict(
-    search_location: Point, search_distance: int, querydict: QueryDict
-) -> list[Address]:
+def parse_cursor(cursor: str) -> tuple[float, int]:
     """
-    Transcripts the QueryDict to a Dict, removes empty values, and passes it the ecoliste_research function.
-    :param search_location: A geolocation using a Point object from django.contrib.gis.geos
-    :param search_distance: The distance around the search location, in kilometers
-    :param querydict: The QueryDict object sent by the html form.
-    :return: A list of Address objects.
+    Reads a cursor given by a previous page of the search API.
+    :param cursor: The "distance:id" of the last address of the previous page.
+    :return: The distance in meters and the id.
+    :raise BadRequest: If the cursor is invalid.
     """
-    # filters = {key: value for key, value in querydict.lists()}
-    filters = {}
-    for key, value in querydict.lists():
-        if not value == "":
-            filters[key] = value
-    return ecoliste_research(search_location, search_distance, filters=filters)
+    try:
+        distance, pk = cursor.split(":")
+        return float(distance), int(pk)
+    except ValueError:
+        raise BadRequest("Invalid cursor.")
 
 
-def search_view(request: HttpRequest) -> HttpResponse:
-    return render(request, "ecoliste/search.html")
+def address_feature(address: Address) -> dict:
+    """
+    An address as a GeoJSON feature.
+    :param address: An Address, with its distance when it comes from a search, and its position along the route when
+    it comes from a corridor search.
+    :return: The feature, as a dictionary.
+    """
+    properties = {
+        "text_version": address.text_version,
+        "is_production": address.is_production,
+        "enterprise": {
+            "id": address.enterprise_id,
+            "name": address.enterprise.name,
+            # Without loading the products
+            **address.enterprise.material_overview(),
+        },
+    }
+    if hasattr(address, "distance"):
+        properties["distance"] = round(address.distance.km, 3)
+    if hasattr(address, "position"):
+        properties["position"] = round(address.position, 4)
+    return {
+        "type": "Feature",
+        "id": address.pk,
+        "geometry": {"type": "Point", "coordinates": address.geolocation.coords},
+        "properties": properties,
+    }
 
 
-def enterprise_view(request: HttpRequest, enterprise_id: int) -> HttpResponse:
-    enterprise = get_object_or_404(Enterprise, pk=enterprise_id)
-    addresses = enterprise.addresses.all()
-    contacts = enterprise.contacts.all()
+def cluster_feature(cluster: dict) -> dict:
+    """
+    A cluster of addresses as a GeoJSON feature, with the id of the address when it is alone.
+    """
+    return {
+        "type": "Feature",
+        "id": cluster["address_id"],
+        "geometry": {
+            "type": "Point",
+            "coordinates": [cluster["longitude"], cluster["latitude"]],
+        },
+        "properties": {"count": cluster["count"]},
+    }
+
+
+def search_api_page(
+    request: HttpRequest,
+) -> tuple[list[Address], Optional[tuple[float, int]]]:
+    """
+    Runs the search of the search API.
+    :return: The addresses of the requested page, and the key of the next page, or None if it's the last page.
+    :raise BadRequest: If a parameter is invalid.
+    """
+    search_location, search_distance = search_parameters(request)
+    try:
+        size = min(
+            int(request.GET.get("size", SEARCH_API_PAGE_SIZE)), SEARCH_API_MAX_PAGE_SIZE
+        )
+        filters = querydict_filters(request.GET)
+    except ValueError:
+        raise BadRequest("Filters and size must be integers.")
+    if size < 1:
+        raise BadRequest("size must be positive.")
+    cursor = request.GET.get("cursor")
+    after = parse_cursor(cursor) if cursor else None
+    return cached_page(search_location, search_distance, filters, size, after)
 
-    materials = (
-        enterprise.products.all()
-        .select_related("type", "type__category")
-        .prefetch_related("address", "biobased_material")
+
+async def search_api_view(request: HttpRequest) -> HttpResponse:
+    """
+    The search, as a GeoJSON FeatureCollection, paginated with the cursor of the "next" member.
+
+    Async: the search runs in a thread, but the response is sent without one.
+    """
+    # require_GET doesn't support the async views before Django 5.0
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+    page, next_key = await sync_to_async(search_api_page)(request)
+    next_url = None
+    if next_key is not None:
+        query = request.GET.copy()
+        query["cursor"] = "{!r}:{}".format(*next_key)
+        next_url = "{}?{}".format(request.path, query.urlencode())
+    return JsonResponse(
+        {
+            "type": "FeatureCollection",
+            "features": [address_feature(address) for address in page],
+            "next": next_url,
+        }
     )
-    addresses_points = serialize(
-        "geojson",
-        addresses,
-        geometry_field="geolocation",
-        fields=("text_version", "is_production"),
+
+
+def parse_points(request: HttpRequest, parameter: str, maximum: int) -> list[Point]:
+    """
+    Reads a list of locations from the query string.
+    :param parameter: The name of the parameter, repeated for each location as "longitude,latitude".
+    :param maximum: The maximum number of locations.
+    :return: The locations, in their order in the query string.
+    :raise BadRequest: If there is no location, too many, or an invalid one.
+    """
+    try:
+        points = [
+            Point(*(float(coordinate) for coordinate in point.split(",")), srid=4326)
+            for point in request.GET.getlist(parameter)
+        ]
+    except (TypeError, ValueError):
+        raise BadRequest("{} parameters must be longitude,latitude.".format(parameter))
+    if not points or any(len(point.coords) != 2 for point in points):
+        raise BadRequest(
+            "{} parameters (longitude,latitude) are required.".format(parameter)
+        )
+    if len(points) > maximum:
+        raise BadRequest("At most {} {} parameters.".format(maximum, parameter))
+    return points
+
+
+def multisite_parameters(
+    request: HttpRequest,
+) -> tuple[list[Point], Optional[float], Optional[int]]:
+    """
+    Reads the sites, the distance and the number of addresses of the multi-site search from the query string.
+    :param request: A request with a site parameter ("longitude,latitude") for each site, and the distance (in
+    kilometers) or the number parameter, or both. Without a distance, the number defaults to MULTISITE_NUMBER.
+    :return: The sites, the distance and the number.
+    :raise BadRequest: If a parameter is missing or invalid.
+    """
+    sites = parse_points(request, "site", MULTISITE_MAX_SITES)
+    try:
+        distance = float(request.GET["distance"]) if "distance" in request.GET else None
+        number = int(request.GET["number"]) if "number" in request.GET else None
+    except ValueError:
+        raise BadRequest("distance and number must be numbers.")
+    if distance is None and number is None:
+        number = MULTISITE_NUMBER
+    if (distance is not None and distance <= 0) or (number is not None and number < 1):
+        raise BadRequest("distance and number must be positive.")
+    if number is not None:
+        number = min(number, MULTISITE_MAX_NUMBER)
+    return sites, distance, number
+
+
+@require_GET
+def multisite_api_view(request: HttpRequest) -> JsonResponse:
+    """
+    The searches around several construction sites, as a GeoJSON FeatureCollection for each site, with the enterprises
+    found around several of them, the indexes of their sites in "shared".
+    """
+    sites, distance, number = multisite_parameters(request)
+    try:
+        filters = querydict_filters(request.GET)
+    except ValueError:
+        raise BadRequest("Filters must be integers.")
+    results = ecoliste_multisite_research(sites, distance, number, filters)
+    return JsonResponse(
+        {
+            "sites": [
+                {
+                    "site": site.coords,
+                    "type": "FeatureCollection",
+                    "features": [address_feature(address) for address in addresses],
+                }
+                for site, addresses in zip(sites, results)
+            ],
+            "shared": [
+                {
+                    "enterprise": {"id": enterprise.pk, "name": enterprise.name},
+                    "sites": indexes,
+                }
+                for enterprise, indexes in shared_enterprises(results)
+            ],
+        }
     )
 
-    context = {
-        "enterprise": enterprise,
-        "addresses": addresses,
-        "materials": materials,
-        "contacts": contacts,
-        "addresses_points": addresses_points,
-    }
-    return render(request, "ecoliste/enterprise.html", context)
+
+@require_GET
+def corridor_api_view(request: HttpRequest) -> JsonResponse:
+    """
+    The production sites along a route, as a GeoJSON FeatureCollection ordered by their position along the route.
+    :param request: A request with a point parameter ("longitude,latitude") for each point of the route, from its start
+    to its end, the distance (in kilometers) around the route and the filters.
+    """
+    points = parse_points(request, "point", CORRIDOR_MAX_POINTS)
+    if len(points) < 2:
+        raise BadRequest("A route needs at least 2 point parameters.")
+    try:
+        distance = float(request.GET["distance"])
+    except (KeyError, ValueError):
+        raise BadRequest("distance parameter is a required number.")
+    if distance <= 0:
+        raise BadRequest("distance must be positive.")
+    try:
+        filters = querydict_filters(request.GET)
+    except ValueError:
+        raise BadRequest("Filters must be integers.")
+    route = LineString(points, srid=4326)
+    addresses = ecoliste_corridor_research(route, distance, filters)
+    return JsonResponse(
+        {
+            "type": "FeatureCollection",
+            "features": [address_feature(address) for address in addresses],
+        }
+    )
+
+
+@require_GET
+def autocomplete_api_view(request: HttpRequest) -> JsonResponse:
+    """
+    The enterprises whose name matches the text being typed.
+    """
+    return JsonResponse({"results": autocomplete(request.GET.get("q", ""))})
+
+
+@require_GET
+def geocode_api_view(request: HttpRequest) -> JsonResponse:
+    """
+    The locations of an address or a commune, the most likely first.
+    """
+    results = geocode(request.GET.get("q", ""))
+    return JsonResponse(
+        {
+            "results": [
+                {
+                    "label": result.label,
+                    "kind": result.kind,
+                    "longitude": result.longitude,
+                    "latitude": result.latitude,
+                    "score": round(result.score, 3),
+                }
+                for result in results
+            ]
+        }
+    )
+
+
+@require_GET
+def facets_api_view(request: HttpRequest) -> JsonResponse:
+    """
+    The number of addresses found for each filter value, for the current search.
+    """
+    search_location, search_distance = search_parameters(request)
+    try:
+        filters = querydict_filters(request.GET)
+    except ValueError:
+        raise BadRequest("Filters must be integers.")
+    return JsonResponse(ecoliste_facets(search_location, search_distance, filters))
+
+
+@require_GET
+def clusters_api_view(request: HttpRequest) -> JsonResponse:
+    """
+    The addresses of a map view as a GeoJSON FeatureCollection: clusters with their count, or the addresses themselves
+    from ECOLISTE_CLUSTER_MAX_ZOOM on, at most ECOLISTE_CLUSTER_MAX_FEATURES of them, "truncated" telling if there are
+    more.
+    """
+    try:
+        west, south, east, north = (
+            float(value) for value in request.GET["bbox"].split(",")
+        )
+        zoom = int(request.GET["zoom"])
+        filters = querydict_filters(request.GET)
+    except (KeyError, ValueError):
+        raise BadRequest(
+            "bbox (west,south,east,north) and zoom parameters are required, filters must be integers."
+        )
+    if not (west < east and south < north and 0 <= zoom <= 22):
+        raise BadRequest("Invalid bbox or zoom.")
+    bbox = (west, south, east, north)
+    truncated = False
+    if zoom >= settings.ECOLISTE_CLUSTER_MAX_ZOOM:
+        if view_too_large(bbox, zoom):
+            raise BadRequest("The bbox is too large for the zoom.")
+        maximum = settings.ECOLISTE_CLUSTER_MAX_FEATURES
+        addresses = bbox_addresses(bbox, filters).select_related("enterprise")
+        # One more, to know if there are others
+        addresses = list(addresses.order_by("pk")[: maximum + 1])
+        truncated = len(addresses) > maximum
+        features = [address_feature(address) for address in addresses[:maximum]]
+    else:
+        features = [
+            cluster_feature(cluster) for cluster in clusters(bbox, zoom, filters)
+        ]
+    return JsonResponse(
+        {"type": "FeatureCollection", "features": features, "truncated": truncated}
+    )
+
+
+@require_GET
+def tile_view(request: HttpRequest, z: int, x: int, y: int) -> HttpResponse:
+    """
+    A Mapbox Vector Tile of the addresses, with an "addresses" layer.
+    """
+    if not valid_tile(z, x, y):
+        raise Http404("No such tile.")
+    return HttpResponse(
+        get_tile(z, x, y), content_type="application/vnd.mapbox-vector-tile"
+    )
+
+
+@staff_member_required
+@require_GET
+def export_view(request: HttpRequest, export_format: str) -> AsyncStreamingHttpResponse:
+    """
+    The whole catalogue, streamed as it is read from the database, in a thread under ASGI, see streaming.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise Http404("Unknown export format.")
+    response = AsyncStreamingHttpResponse(
+        export_lines(export_format), content_type=EXPORT_FORMATS[export_format]
+    )
+    response["Content-Disposition"] = 'attachment; filename="ecoliste.{}"'.format(
+        export_format
+    )
+    return response
+
+
+async def enterprise_view(request: HttpRequest, enterprise_id: int) -> HttpResponse:
+    """
+    The page of an enterprise, answering the conditional requests from the date of its last change.
+
+    Async, its missing sections being rendered concurrently, see aenterprise_sections.
+    """
+    modified = await sync_to_async(last_modified)(enterprise_id)
+    # As the condition decorator, which doesn't support the async views before Django 5.0
+    etag = quote_etag(modified.isoformat()) if modified else None
+    timestamp = int(modified.timestamp()) if modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        context = {"sections": await aenterprise_sections(enterprise_id)}
+        response = render(request, "ecoliste/enterprise.html", context)
+    if request.method in ("GET", "HEAD"):
+        if timestamp and not response.has_header("Last-Modified"):
+            response.headers["Last-Modified"] = http_date(timestamp)
+        if etag:
+            response.headers.setdefault("ETag", etag)
+    # Stored by the browsers and caches, but checked again at each use: an unchanged page then costs a 304 response
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def metrics_allowed(request: HttpRequest) -> bool:
+    """
+    Whether a request is from the staff, or from a scraper with the ECOLISTE_METRICS_TOKEN.
+    """
+    token = settings.ECOLISTE_METRICS_TOKEN
+    if token and constant_time_compare(
+        request.headers.get("Authorization", ""), "Bearer {}".format(token)
+    ):
+        return True
+    return request.user.is_active and request.user.is_staff
+
+
+@require_GET
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    The metrics of all the processes of the application, for Prometheus.
+    """
+    if not metrics_allowed(request):
+        raise PermissionDenied("The metrics are reserved to the staff.")
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 def about_view(request: HttpRequest) -> HttpResponse: